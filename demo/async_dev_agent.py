@@ -0,0 +1,153 @@
+#coding: utf-8
+
+import asyncio
+import contextlib
+import msg_pb2
+from dev_agent import DevAgent, getRspValue
+from msg_udp_handler import MSG_GET_CMD_RESPONS
+from msg_request_tracker import MsgRequestTracker
+from async_msg_udp_handler import AsyncMsgUdpHandler
+from stream_codec import parseCamImgStream, parseHumanPoseStream
+
+
+class AsyncDevAgent(DevAgent):
+    '''asyncio版设备代理
+
+    属性的获取和设置接口与DevAgent一致，但均为协程，需要await，例如：
+    ``await agent.getTemperature()``，``await agent.enableAi()``。
+    属性请求按req_msg_id匹配回复，多个请求可同时进行，例如：
+    ``await asyncio.gather(agent.getTemperature(), agent.getDevStatus())``。
+    stream_handler不为None时，可通过iterHumanPose/iterCamImg异步迭代数据流。
+    '''
+    def __init__(self, msg_handler:AsyncMsgUdpHandler,
+            stream_handler:AsyncMsgUdpHandler=None, use_prop_cache=False):
+        super(AsyncDevAgent, self).__init__(msg_handler,
+                use_prop_cache=use_prop_cache)
+        self.stream_handler = stream_handler
+        self.req_tracker = MsgRequestTracker(
+                future_factory=lambda: asyncio.get_running_loop().create_future())
+        # 属性回复在事件循环中直接完成对应的请求
+        for cmd in [msg_pb2.MSG_CMD_GET_PROPERTY, msg_pb2.MSG_CMD_SET_PROPERTY]:
+            msg_handler.setMsgCallback(MSG_GET_CMD_RESPONS(cmd),
+                    self.handleRspMsg)
+        # 切换版本和重启没有req_msg_id，同一时刻只能有一个请求在等待回复
+        self.request_lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def pipeline(self):
+        '''请求本来就立即发送、按req_msg_id匹配回复，不需要流水线模式；为与DevAgent
+        接口一致，提供什么也不做的async with。多个请求用asyncio.gather同时等待。'''
+        yield self
+
+    async def waitResult(self, future, timeout=None):
+        try:
+            return await asyncio.wait_for(asyncio.shield(future),
+                    self.getTimeout(timeout))
+        except asyncio.TimeoutError:
+            self.req_tracker.discard(future)
+            return future.result() if future.done() else None
+
+    ############################################################################
+    # Get Prop
+    ############################################################################
+    async def getProp(self, prop_id, timeout=None, **args):
+        future = self.requestGetProp(prop_id, timeout, **args)
+        return await self.waitResult(future, timeout)
+
+    async def getProps(self, prop_ids, timeout=None):
+        return await asyncio.gather(*[self.getProp(prop_id, timeout)
+                for prop_id in prop_ids])
+
+    async def getPropValue(self, prop_id, field, convert=None, **args):
+        rsp = await self.getProp(prop_id, **args)
+        return getRspValue(rsp, field, convert)
+
+    ############################################################################
+    # Set Prop
+    ############################################################################
+    async def setProp(self, proto_obj, timeout=None):
+        future = self.requestSetProp(proto_obj, timeout)
+        result = await self.waitResult(future, timeout)
+        return False if result is None else result
+
+    async def setProps(self, proto_objs, timeout=None):
+        return await asyncio.gather(*[self.setProp(req, timeout)
+                for req in proto_objs])
+
+    async def requestMsg(self, cmd, proto_obj=None, timeout=None):
+        '''发送没有req_msg_id的请求并等待其回复消息，超时返回None'''
+        future = self.msg_handler.expectMsg(MSG_GET_CMD_RESPONS(cmd))
+        self.msg_handler.sendMsg(cmd, proto_obj)
+        try:
+            return await asyncio.wait_for(future, self.getTimeout(timeout))
+        except asyncio.TimeoutError:
+            self.msg_handler.cancelExpect(future)
+            return None
+
+    async def switchAppVersion(self, version):
+        '''切换软件版本号'''
+        req = msg_pb2.ReqSwitchAppVersion()
+        req.app_version = version
+        async with self.request_lock:
+            msg_ret = await self.requestMsg(
+                    msg_pb2.MSG_CMD_SWITCH_APP_VERSION, req, 1)
+        return self.parseSwitchAppVersionRsp(msg_ret, version)
+
+    async def rebootSystem(self):
+        '''重启设备'''
+        async with self.request_lock:
+            msg_ret = await self.requestMsg(msg_pb2.MSG_CMD_REBOOT_SYSTEM,
+                    timeout=1)
+        return self.parseRebootSystemRsp(msg_ret)
+
+    ############################################################################
+    # Stream
+    ############################################################################
+    async def iterStream(self, cmd, parse, timeout=None):
+        '''异步迭代cmd对应的数据流，timeout为None时一直等待，否则超时结束迭代'''
+        msg_queue = self.stream_handler.getMsgQueue(cmd)
+        while True:
+            if timeout is None:
+                msg = await msg_queue.get()
+            else:
+                msg = await self.stream_handler.recvMsg(timeout, cmd=cmd)
+                if msg is None:
+                    return
+            data = parse(msg['payload'][2:])
+            self.stream_handler.freeMsg(msg)
+            yield data
+
+    def iterHumanPose(self, timeout=None):
+        '''异步迭代人体Pose数据流，产生(img_idx, pose)'''
+        return self.iterStream(msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                parseHumanPoseStream, timeout)
+
+    def iterCamImg(self, timeout=None):
+        '''异步迭代相机图片流，产生(img_idx, img_data)'''
+        return self.iterStream(msg_pb2.MSG_CMD_STREAM_CAM_IMG,
+                parseCamImgStream, timeout)
+
+
+async def getDevsInfo(*target_ips, target_port=30000, timeout=1):
+    '''在一个事件循环中同时获取多块设备的基础信息和温度'''
+    async def _getDevInfo(target_ip):
+        async with AsyncMsgUdpHandler(('0.0.0.0', 0), (target_ip, target_port),
+                timeout) as msg_handler:
+            agent = AsyncDevAgent(msg_handler)
+            base_info = await agent.getDevBaseInfo()
+            temperature = await agent.getTemperature()
+            return target_ip, base_info, temperature
+    return await asyncio.gather(*[_getDevInfo(ip) for ip in target_ips])
+
+
+if __name__ == '__main__':
+    import fire
+
+    def main(*target_ips, target_port=30000, timeout=1):
+        target_ips = target_ips or ['192.168.181.2']
+        for target_ip, base_info, temperature in asyncio.run(
+                getDevsInfo(*target_ips, target_port=target_port,
+                    timeout=timeout)):
+            print(f"{target_ip}: temperature: {temperature}\n{base_info}")
+
+    fire.Fire(main)
@@ -0,0 +1,160 @@
+#coding: utf-8
+
+import asyncio
+from msg_udp_handler import *
+
+
+class MsgUdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, handler):
+        super(MsgUdpProtocol, self).__init__()
+        self.handler = handler
+
+    def datagram_received(self, data, addr):
+        self.handler.handleDatagram(data, addr)
+
+    def error_received(self, exc):
+        print(f"WARN: udp error: {exc}")
+
+
+class AsyncMsgUdpHandler(MsgUdpHandler):
+    '''基于asyncio的消息收发
+
+    发送接口与MsgUdpHandler一致；接收到的数据报在事件循环中直接重组，完整的消息
+    按cmd分发到各自的队列，recvMsg为协程。使用前需要在事件循环中调用open()。
+    '''
+    def __init__(self,
+            net_local_addr,
+            net_target_addr,
+            socket_timeout=0,
+            msg_queue_size=64,
+            **kwargs):
+        kwargs.setdefault('recv_ring_size', 1)
+        super(AsyncMsgUdpHandler, self).__init__(net_local_addr,
+                net_target_addr, socket_timeout, **kwargs)
+        self.msg_queue_size = msg_queue_size
+        self.transport = None
+        # cmd -> asyncio.Queue，None对应未单独订阅的cmd
+        self.msg_queues = {}
+        # cmd -> callback(msg)，设置了回调的cmd不再进入队列
+        self.msg_callbacks = {}
+        # cmd -> [Future]，等待下一条该cmd的消息，见expectMsg()
+        self.msg_waiters = {}
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.selector.unregister(self.sock)
+        self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: MsgUdpProtocol(self), sock=self.sock)
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def sendData(self, data):
+        self.transport.sendto(data, self.net_target_addr)
+
+    def sendDataBufs(self, bufs):
+        '''传输层没有排队的数据时直接用sendmsg发送，不拼接；socket暂时不可写或
+        已有排队的数据时，拼接后交给传输层排队，保持数据报的顺序'''
+        if self.has_sendmsg and self.transport.get_write_buffer_size() == 0:
+            try:
+                self.sock.sendmsg(bufs, (), 0, self.net_target_addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                print(f"WARN: udp error: {e}")
+                return
+        self.transport.sendto(b''.join(bufs), self.net_target_addr)
+
+    def setMsgCallback(self, cmd, callback):
+        '''在事件循环中直接处理cmd对应的消息，callback为None时取消'''
+        if callback is None:
+            self.msg_callbacks.pop(cmd, None)
+        else:
+            self.msg_callbacks[cmd] = callback
+
+    def expectMsg(self, cmd):
+        '''返回Future，结果为下一条cmd对应的消息（优先于回调和队列），需在发送
+        请求前调用，以免回复先到达'''
+        future = asyncio.get_running_loop().create_future()
+        self.msg_waiters.setdefault(cmd, []).append(future)
+        return future
+
+    def cancelExpect(self, future):
+        for waiters in self.msg_waiters.values():
+            if future in waiters:
+                waiters.remove(future)
+                return True
+        return False
+
+    def getMsgQueue(self, cmd=None):
+        '''获取cmd对应的消息队列，第一次获取时创建（订阅）'''
+        q = self.msg_queues.get(cmd)
+        if q is None:
+            q = asyncio.Queue(self.msg_queue_size)
+            self.msg_queues[cmd] = q
+        return q
+
+    def handleDatagram(self, data, addr):
+        if not self.is_specific_target:
+            self.net_target_addr = addr
+        self.recv_stats['datagrams'] += 1
+        self.recv_stats['bytes'] += len(data)
+        if len(data) < FRAME_HEAD_BYTES:
+            print(f"WARN: frame({len(data)}bytes) too short.")
+            self.recv_stats['short_datagrams'] += 1
+            return
+        frame_head, idx_start = parseMsgFrameHead(data)
+        msg = self.reassembler.addFrame(frame_head, memoryview(data)[idx_start:])
+        if msg is None:
+            return
+        # 按cmd分发消息，队列满时丢弃最旧的消息
+        cmd = MSG_CMD_STRUCT.unpack_from(msg['payload'])[0] \
+                if len(msg['payload']) >= MSG_CMD_BYTES else None
+        waiters = self.msg_waiters.get(cmd)
+        while waiters:
+            future = waiters.pop(0)
+            # 超时的等待已被取消
+            if not future.done():
+                future.set_result(msg)
+                return
+        callback = self.msg_callbacks.get(cmd)
+        if callback is not None:
+            callback(msg)
+            return
+        q = self.msg_queues.get(cmd)
+        if q is None:
+            q = self.getMsgQueue(None)
+        if q.full():
+            self.freeMsg(q.get_nowait())
+            self.recv_stats['queue_dropped_msgs'] += 1
+        q.put_nowait(msg)
+
+    async def recvMsg(self, timeout=None, cmd=None):
+        '''接收一条消息，cmd不为None时只接收该cmd的消息，超时返回None；timeout和
+        socket_timeout都为None时一直等待'''
+        timeout = self.socket_timeout if timeout is None else timeout
+        q = self.getMsgQueue(cmd)
+        if not q.empty():
+            return q.get_nowait()
+        if timeout is not None and timeout <= 0:
+            return None
+        try:
+            return await asyncio.wait_for(q.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def clearSocketRecvBuf(self, timeout=0):
+        for q in self.msg_queues.values():
+            while not q.empty():
+                q.get_nowait()
+        self.reassembler.reset()
@@ -0,0 +1,372 @@
+#coding: utf-8
+'''批量推理
+
+把图片目录、图片或视频逐帧发送给设备，不显示，在流控窗口允许的范围内尽快发送；
+每帧的结果按行写入JSONL文件，最后打印吞吐率和延迟统计。
+'''
+
+import os
+import time
+import json
+import queue
+import threading
+import collections
+import cv2
+import fire
+import imagesize
+import numpy as np
+import os.path as osp
+from queue import Queue
+from loguru import logger
+
+import msg_pb2
+from dev_agent import DevAgent
+from msg_udp_handler import MsgUdpHandler
+from flow_control import FrameCreditWindow, diffImgIdx
+from stream_codec import HumanPoseFrame
+from frame_tracer import FrameTracer
+from channels import RingChannel, POLICY_DROP_OLDEST
+from demo import BaseThread, VideoReader, ImgsReader, ImgSendService, \
+    StreamRecvService, JpegEncodeService, makeJpegParams
+
+
+def poseFrameToRecord(frame:HumanPoseFrame):
+    '''Pose转为可JSON序列化的字典，每个人一项，没有的数据为None'''
+    persons = []
+    hand_bits = frame.getHandDirBits()
+    for i in range(frame.getPersonNum()):
+        persons.append({
+            'box': frame.boxes[i].tolist() if frame.has_box[i] else None,
+            'kps2d': frame.kps2d[i].tolist() if frame.has_kps2d[i] else None,
+            'kps3d': frame.kps3d[i].tolist() if frame.has_kps3d[i] else None,
+            'hand_dir': [bool(x) for x in hand_bits[i].reshape(-1)] \
+                    if frame.has_hand_dir[i] else None,
+        })
+    return {'persons': persons}
+
+
+class BatchInferService(BaseThread):
+    '''发送读取的每一帧并收集结果
+
+    每帧产生一条记录交给write_record：成功时含Pose和延迟；Pose被pose_recv_queue
+    （POLICY_DROP_OLDEST的RingChannel）丢弃时error为'dropped'，超时或被跳过时
+    error为'timeout'。
+    '''
+    def __init__(self,
+            img_read_queue:Queue,
+            img_send_queue:Queue,
+            pose_recv_queue:RingChannel,
+            flow_window:FrameCreditWindow,
+            write_record,
+            get_frame_key,
+            tracer:FrameTracer=None,
+            ):
+        super(BatchInferService, self).__init__()
+        self.img_read_queue = img_read_queue
+        self.img_send_queue = img_send_queue
+        self.pose_recv_queue = pose_recv_queue
+        self.flow_window = flow_window
+        self.write_record = write_record
+        self.get_frame_key = get_frame_key
+        self.tracer = tracer
+        self.latencies = []
+        self.stats = collections.Counter()
+        self.start_time = None
+        self.end_time = None
+        # 接收队列丢弃的Pose对应的img_idx，在接收线程中记录
+        self.dropped_idxs = set()
+        self.pose_drops = 0
+        self.drop_lock = threading.Lock()
+        self.pose_recv_queue.release = self.onPoseDropped
+
+    def _run(self):
+        # img_idx -> 发送时间，按发送先后排序
+        pending = collections.OrderedDict()
+        is_read_end = False
+        while self.isRunning():
+            if is_read_end and len(pending) == 0:
+                break
+            # 窗口有空位时发送下一帧
+            can_send = not is_read_end and self.flow_window.hasCredit()
+            if can_send:
+                try:
+                    frame = self.img_read_queue.get(
+                            timeout=0.005 if pending else 0.1)
+                except queue.Empty:
+                    pass
+                else:
+                    if frame is None:
+                        is_read_end = True
+                    else:
+                        if self.start_time is None:
+                            self.start_time = time.monotonic()
+                        self.flow_window.onSend(frame[0])
+                        pending[frame[0]] = time.monotonic()
+                        if not self.putQueue(self.img_send_queue, frame):
+                            break
+                        self.stats['sent'] += 1
+            # 获取接收到的pose
+            try:
+                img_idx, pose = self.pose_recv_queue.get(
+                        timeout=0.001 if can_send else 0.05)
+            except queue.Empty:
+                pass
+            else:
+                self.handlePose(pending, img_idx, pose)
+            # 超时未收到pose的帧
+            timeout = self.flow_window.ack_timeout
+            while pending:
+                img_idx, send_time = next(iter(pending.items()))
+                if time.monotonic() - send_time <= timeout:
+                    break
+                del pending[img_idx]
+                self.writeMissing(img_idx)
+        self.end_time = time.monotonic()
+
+    def handlePose(self, pending, img_idx, pose):
+        now = time.monotonic()
+        # 更早的帧已不会收到pose
+        for idx in list(pending):
+            if diffImgIdx(idx, img_idx) >= 0:
+                break
+            del pending[idx]
+            self.writeMissing(idx)
+        send_time = pending.pop(img_idx, None)
+        if send_time is None:
+            self.stats['stray_poses'] += 1
+            return
+        latency = now - send_time
+        if self.tracer is not None:
+            self.tracer.finish(img_idx)
+        self.latencies.append(latency)
+        self.stats['received'] += 1
+        record = self.get_frame_key(img_idx)
+        record['latency_ms'] = round(latency * 1000, 3)
+        record.update(poseFrameToRecord(pose))
+        self.write_record(record)
+
+    def onPoseDropped(self, item):
+        '''pose_recv_queue丢弃Pose时调用'''
+        with self.drop_lock:
+            self.dropped_idxs.add(item[0])
+            self.pose_drops += 1
+
+    def isPoseDropped(self, img_idx):
+        # 通道在锁内丢弃并计数，在锁外调用release，等计数的都记录后再判断
+        drops = self.pose_recv_queue.getStats().get('drops', 0)
+        while True:
+            with self.drop_lock:
+                if self.pose_drops >= drops:
+                    if img_idx in self.dropped_idxs:
+                        self.dropped_idxs.remove(img_idx)
+                        return True
+                    return False
+            time.sleep(0.0001)
+
+    def writeMissing(self, img_idx):
+        record = self.get_frame_key(img_idx)
+        if self.isPoseDropped(img_idx):
+            self.stats['dropped'] += 1
+            record['error'] = 'dropped'
+        else:
+            self.stats['missing'] += 1
+            record['error'] = 'timeout'
+        self.write_record(record)
+
+    def getSummary(self):
+        '''帧数、耗时、吞吐率（帧/秒）和延迟分位数（毫秒）'''
+        summary = dict(self.stats)
+        elapsed = 0
+        if self.start_time is not None:
+            end_time = self.end_time or time.monotonic()
+            elapsed = end_time - self.start_time
+        summary['elapsed_s'] = round(elapsed, 3)
+        summary['throughput_fps'] = round(
+                self.stats['received'] / elapsed, 2) if elapsed > 0 else 0
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            for p in [50, 95, 99]:
+                summary['latency_p%d_ms' % p] = round(
+                        float(np.percentile(latencies, p)), 3)
+            summary['latency_max_ms'] = round(float(latencies.max()), 3)
+        return summary
+
+
+def checkImgSize(w, h):
+    '''检查设备输入的图片尺寸，不符合要求时返回原因，否则返回None'''
+    if w % 16 != 0 or h % 16 != 0:
+        return 'the length and width must be multiples of 16'
+    if w * h > 1920*1080:
+        return 'the image size must be less than 1920x1080'
+    return None
+
+
+def listImgs(source):
+    '''列出目录下（或单个）的JPEG图片，跳过尺寸不符合要求的图片'''
+    if osp.isdir(source):
+        img_fpaths = sorted(osp.join(source, x) for x in os.listdir(source) \
+                if osp.splitext(x)[1].lower() in ['.jpg', '.jpeg'])
+    else:
+        img_fpaths = [source]
+    valid_fpaths = []
+    for img_fpath in img_fpaths:
+        error = checkImgSize(*imagesize.get(img_fpath))
+        if error is not None:
+            logger.warning(f'Skip {img_fpath}: {error}')
+        else:
+            valid_fpaths.append(img_fpath)
+    return valid_fpaths
+
+
+def startImgStream(dev_agent:DevAgent, msg_stream_handler:MsgUdpHandler,
+        net_local_stream_port):
+    '''设置设备以外部图片流为输入源并开始运行，返回是否成功'''
+    msg_stream_handler.sendData(b'')
+    with dev_agent.pipeline():
+        dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PAUSE)
+        dev_agent.enableSendHumanPoseStream()
+        dev_agent.disableSendCamImgStream()
+        dev_agent.enableImgStreamSource()
+        dev_agent.setStreamTargetAddr('192.168.181.1', net_local_stream_port)
+    msg_stream_handler.clearSocketRecvBuf(timeout=0.1)
+    return dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PLAY)
+
+
+def runBatchInfer(msg_stream_handler:MsgUdpHandler, media_reader,
+        write_record, get_frame_key, stream_window=0, stream_max_window=8,
+        timeout=2.0, tracer:FrameTracer=None, encode_workers=0,
+        jpeg_params=None):
+    '''发送media_reader读取的所有帧并等待结果，返回统计信息（见getSummary）
+
+    tracer不为None时记录各阶段耗时，media_reader应使用同一个tracer；
+    encode_workers大于0时用线程池并行编码JPEG
+    '''
+    flow_window = FrameCreditWindow(stream_window or None,
+            max_window=stream_max_window, ack_timeout=timeout)
+    img_send_queue = RingChannel(1, name='img_send')
+    pose_recv_queue = RingChannel((stream_window or stream_max_window) + 1,
+            POLICY_DROP_OLDEST, 'pose_recv')
+    stream_recv_service = StreamRecvService(msg_stream_handler, None,
+            pose_recv_queue, flow_window, tracer)
+    img_encoded_queue = img_send_queue
+    services = [media_reader]
+    if encode_workers > 0:
+        img_encoded_queue = RingChannel(encode_workers, name='img_encoded')
+        services.append(JpegEncodeService(img_send_queue, img_encoded_queue,
+                encode_workers, jpeg_params, tracer))
+    img_send_service = ImgSendService(msg_stream_handler, img_encoded_queue,
+            tracer, jpeg_params, flow_window)
+    batch_service = BatchInferService(media_reader.getImgQueue(),
+            img_send_queue, pose_recv_queue, flow_window, write_record,
+            get_frame_key, tracer)
+    services += [img_send_service, stream_recv_service]
+    for service in services + [batch_service]:
+        service.start()
+    try:
+        batch_service.join()
+    except KeyboardInterrupt:
+        batch_service.stop()
+        batch_service.join()
+    for service in services:
+        service.stop()
+    for service in services:
+        service.join()
+    summary = batch_service.getSummary()
+    summary['window'] = flow_window.getStats()['window']
+    summary['pose_drops'] = pose_recv_queue.getStats().get('drops', 0)
+    return summary
+
+
+def main(
+    source                 :str,
+    output                 :str             = 'poses.jsonl',
+    net_local_ip           :str             = '0.0.0.0',
+    net_local_port         :int             = 30000,
+    net_local_stream_port  :int             = 30001,
+    net_target_ip          :str             = '192.168.181.2',
+    net_target_port        :int             = 30000,
+    net_target_stream_port :int             = 30001,
+    stream_window          :int             = 0,
+    stream_max_window      :int             = 8,
+    timeout                :float           = 2.0,
+    trace_path             :str             = None,
+    is_passthrough         :bool            = False,
+    encode_workers         :int             = 0,
+    jpeg_quality           :int             = None,
+    jpeg_sampling          :str             = None,
+    ):
+    '''
+    批量推理
+
+    Args:
+    source: 输入源，图片目录、.jpg图片或.mp4视频
+    output: 结果文件（JSONL），每行一帧，图片以file、视频以frame标识
+    net_local_ip: 本地监听IP
+    net_local_port: 本地监听端口号
+    net_local_stream_port: 本地监听数据流端口号
+    net_target_ip: 目标IP
+    net_target_port: 目标端口号
+    net_target_stream_port: 目标数据流端口号
+    stream_window: 同时在设备上处理的最大帧数，为0时根据延迟自动调整
+    stream_max_window: 自动调整时的最大帧数
+    timeout: 单帧等待结果的超时时间（秒）
+    trace_path: 保存各阶段耗时的Chrome trace（JSON）的文件路径，默认不记录
+    is_passthrough: 输入源为MJPEG编码的视频时，直接发送JPEG数据，不解码再编码
+    encode_workers: 输入源为视频时，并行编码JPEG的线程数，为0时在发送线程中编码
+    jpeg_quality: 发送图片的JPEG质量（0~100），默认为OpenCV的默认值
+    jpeg_sampling: 发送图片的JPEG色度采样，如444、422、420
+    '''
+    tracer = None if trace_path is None else FrameTracer(max_events=100000)
+    # 检查输入源
+    ext = osp.splitext(str(source))[1].lower()
+    if osp.isdir(source) or ext in ['.jpg', '.jpeg']:
+        img_fpaths = listImgs(source)
+        if len(img_fpaths) == 0:
+            logger.error('The input source has no valid JPEG images')
+            exit(1)
+        media_reader = ImgsReader(img_fpaths, tracer=tracer)
+        get_frame_key = lambda idx: {'idx': idx,
+                'file': osp.basename(img_fpaths[idx])}
+    elif osp.isfile(source):
+        media_reader = VideoReader(source, is_pace_video=False,
+                tracer=tracer, is_passthrough=is_passthrough)
+        error = checkImgSize(int(media_reader.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(media_reader.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if error is not None:
+            logger.error(f'Invalid video {source}: {error}')
+            exit(1)
+        get_frame_key = lambda idx: {'idx': idx, 'frame': idx}
+    else:
+        raise ValueError('Invalid input source')
+
+    # 创建Msg Handler
+    net_local_addr = (net_local_ip, net_local_port)
+    net_target_addr = (net_target_ip, net_target_port)
+    net_stream_local_addr = (net_local_ip, net_local_stream_port)
+    net_stream_target_addr = (net_target_ip, net_target_stream_port)
+    msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, 1)
+    msg_stream_handler = MsgUdpHandler(net_stream_local_addr,
+            net_stream_target_addr, 1, recv_buf_bytes=4*1024*1024)
+    dev_agent = DevAgent(msg_handler)
+    if not startImgStream(dev_agent, msg_stream_handler, net_local_stream_port):
+        logger.error('Start device failed')
+        exit(1)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        def _writeRecord(record):
+            f.write(json.dumps(record) + '\n')
+        summary = runBatchInfer(msg_stream_handler, media_reader, _writeRecord,
+                get_frame_key, stream_window, stream_max_window, timeout,
+                tracer, encode_workers,
+                makeJpegParams(jpeg_quality, jpeg_sampling))
+    logger.info(f"Results saved to {output}")
+    logger.info("summary: " + json.dumps(summary))
+    if tracer is not None:
+        for stage, stats in tracer.getStats().items():
+            logger.info(f"trace {stage}: {stats}")
+        tracer.saveChromeTrace(trace_path)
+        logger.info(f"Chrome trace saved to {trace_path}")
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
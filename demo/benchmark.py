@@ -0,0 +1,385 @@
+#coding: utf-8
+'''客户端性能测试
+
+测试项：
+- udp: MsgUdpHandler在本机回环上不同负载大小的收发吞吐率；
+- pose_decode: ReqHumanPoseStream的解码耗时；
+- jpeg: 图片的JPEG编码（ImgSendService）和解码（HumanPoseDisplayer.decodeImg）耗时；
+- draw: vis中Box和关键点的绘制耗时；
+- e2e: 经设备（默认为本机启动的dev_emulator.py）推理的帧率和延迟分位数。
+
+结果保存为JSON，每项为{name, params, metrics}，可用compare比较两次结果。
+'''
+
+import os
+import sys
+import time
+import json
+import socket
+import platform
+import threading
+import subprocess
+import numpy as np
+import os.path as osp
+import cv2
+import google.protobuf
+
+import msg_pb2
+from msg_udp_handler import MsgUdpHandler
+from dev_agent import DevAgent
+from stream_codec import decodeHumanPoseStream, parseHumanPoseStream, \
+    encodeHumanPoseStream
+from dev_emulator import makeSyntheticPose
+from vis import drawBox, drawBoxes, drawKps, drawKpsBatch
+
+
+DEMO_DIR = osp.dirname(osp.abspath(__file__))
+BENCH_IMG_PATH = osp.join(DEMO_DIR, 'images', '1280x720.jpg')
+
+
+def timeIt(func, min_time=0.5, min_runs=10):
+    '''重复调用func至少min_time秒和min_runs次，返回每次耗时（微秒）的统计'''
+    times = []
+    t_end = time.perf_counter() + min_time
+    while len(times) < min_runs or time.perf_counter() < t_end:
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    times = np.array(times) * 1e6
+    return {
+        'runs'   : len(times),
+        'mean_us': round(float(times.mean()), 3),
+        'p50_us' : round(float(np.percentile(times, 50)), 3),
+        'min_us' : round(float(times.min()), 3),
+    }
+
+
+def getFreePort(ip='127.0.0.1'):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def makeResult(name, params, metrics):
+    return {'name': name, 'params': params, 'metrics': metrics}
+
+
+################################################################################
+# udp
+################################################################################
+def benchUdp(payload_sizes=(1024, 64*1024, 256*1024, 1024*1024, 4*1024*1024),
+        duration=1.0, max_in_flight=4, recv_buf_bytes=8*1024*1024):
+    '''本机回环收发，同时最多max_in_flight条消息在途，避免内核缓冲区溢出
+
+    只在确定消息丢失时（后续消息已到达，或发送完成后超过接收超时没有任何数据）
+    才归还其信用，在途消息数不会超过max_in_flight，总字节数不超过接收缓冲区的一半。
+    '''
+    results = []
+    for payload_bytes in payload_sizes:
+        receiver = MsgUdpHandler(('127.0.0.1', 0), None, 0.5,
+                recv_buf_bytes=recv_buf_bytes)
+        in_flight_limit = max(1, min(max_in_flight,
+                recv_buf_bytes // 2 // payload_bytes))
+        sender = MsgUdpHandler(('127.0.0.1', 0),
+                receiver.sock.getsockname(), 0.5)
+        payload = bytearray(payload_bytes)
+        # 已发送、收到和确定丢失的消息数；消息ID从0开始按发送顺序递增
+        state = {'sent': 0, 'recv': 0, 'lost': 0, 'recv_bytes': 0,
+                'running': True}
+        # 消息ID -> 发送完成的时间，用于判断丢失
+        send_times = {}
+        cond = threading.Condition()
+
+        def _inFlight():
+            return state['sent'] - state['recv'] - state['lost']
+
+        def _recv():
+            recv_timeout = 0.1
+            while state['running']:
+                msg = receiver.recvMsg(recv_timeout)
+                with cond:
+                    if msg is None:
+                        # 回环上超过recv_timeout没有任何数据，之前发送完的消息已丢失
+                        deadline = time.perf_counter() - recv_timeout
+                        msg_id = state['recv'] + state['lost']
+                        while msg_id < state['sent'] and \
+                                send_times.get(msg_id, deadline) < deadline:
+                            send_times.pop(msg_id, None)
+                            state['lost'] += 1
+                            msg_id += 1
+                    else:
+                        # 按顺序到达，更早的未收到的消息已丢失
+                        msg_id = msg['last_frame_head']['msg_id']
+                        for idx in range(state['recv'] + state['lost'], msg_id):
+                            send_times.pop(idx, None)
+                            state['lost'] += 1
+                        send_times.pop(msg_id, None)
+                        state['recv'] += 1
+                        state['recv_bytes'] += len(msg['payload'])
+                        receiver.freeMsg(msg)
+                    cond.notify_all()
+
+        recv_thread = threading.Thread(target=_recv, daemon=True)
+        recv_thread.start()
+        t_start = time.perf_counter()
+        t_end = t_start + duration
+        while time.perf_counter() < t_end:
+            with cond:
+                if not cond.wait_for(lambda: _inFlight() < in_flight_limit,
+                        timeout=0.5):
+                    continue
+            msg_id = sender.sendMsgBufs(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM,
+                    [payload])
+            with cond:
+                send_times[msg_id] = time.perf_counter()
+                state['sent'] += 1
+        # 等待在途消息
+        with cond:
+            cond.wait_for(lambda: _inFlight() == 0, timeout=1.0)
+        elapsed = time.perf_counter() - t_start
+        state['running'] = False
+        recv_thread.join()
+        recv_stats = receiver.getRecvStats()
+        results.append(makeResult('udp', {'payload_bytes': payload_bytes,
+                'max_in_flight': in_flight_limit}, {
+            'msgs_per_s' : round(state['recv'] / elapsed, 1),
+            'mb_per_s'   : round(state['recv_bytes'] / elapsed / 1e6, 2),
+            'sent'       : state['sent'],
+            'received'   : state['recv'],
+            'lost'       : state['lost'],
+            'datagrams'  : recv_stats.get('datagrams', 0),
+            'max_batch'  : recv_stats.get('max_batch', 0),
+        }))
+        receiver.sock.close()
+        sender.sock.close()
+    return results
+
+
+################################################################################
+# pose_decode
+################################################################################
+def benchPoseDecode(person_nums=(1, 4), min_time=0.5):
+    results = []
+    for person_num in person_nums:
+        frame = makeSyntheticPose(123, 1280, 720, person_num, t=0)
+        data = encodeHumanPoseStream(frame).SerializeToString()
+        params = {'person_num': person_num, 'msg_bytes': len(data)}
+
+        def _parse():
+            req = msg_pb2.ReqHumanPoseStream()
+            req.ParseFromString(data)
+
+        results.append(makeResult('pose_decode.protobuf', params,
+                timeIt(_parse, min_time)))
+        results.append(makeResult('pose_decode.decodeHumanPoseStream', params,
+                timeIt(lambda: decodeHumanPoseStream(data), min_time)))
+        results.append(makeResult('pose_decode.parseHumanPoseStream', params,
+                timeIt(lambda: parseHumanPoseStream(data), min_time)))
+    return results
+
+
+################################################################################
+# jpeg
+################################################################################
+def loadBenchImg(width=1280, height=720):
+    img = cv2.imread(BENCH_IMG_PATH) if osp.isfile(BENCH_IMG_PATH) else None
+    if img is None:
+        img = np.random.default_rng(0).integers(0, 256, (height, width, 3),
+                dtype=np.uint8)
+    return cv2.resize(img, (width, height))
+
+
+def benchJpeg(sizes=((640, 480), (1280, 720), (1920, 1080)), min_time=0.5):
+    results = []
+    for width, height in sizes:
+        img = loadBenchImg(width, height)
+        _, jpg = cv2.imencode('.jpg', img)
+        params = {'width': width, 'height': height, 'jpeg_bytes': len(jpg)}
+        results.append(makeResult('jpeg.encode', params,
+                timeIt(lambda: cv2.imencode('.jpg', img), min_time)))
+        img_str = jpg.tobytes()
+        results.append(makeResult('jpeg.decode', params,
+                timeIt(lambda: cv2.imdecode(np.frombuffer(img_str,
+                    dtype=np.uint8), cv2.IMREAD_COLOR), min_time)))
+    return results
+
+
+################################################################################
+# draw
+################################################################################
+def benchDraw(person_nums=(1, 4), min_time=0.5):
+    results = []
+    canvas = loadBenchImg(1280, 720)
+    for person_num in person_nums:
+        frame = makeSyntheticPose(0, 1280, 720, person_num, t=0)
+        params = {'person_num': person_num}
+        img = canvas.copy()
+        # 逐人绘制的接口参数为int坐标
+        boxes = [[int(x) for x in b[:4]] + [float(b[4])]
+                for b in frame.boxes.tolist()]
+        kps_list = [[[int(p[0]), int(p[1]), p[2]] for p in kps]
+                for kps in frame.kps2d.tolist()]
+
+        def _drawBox():
+            for box in boxes:
+                drawBox(img, box, box[4])
+
+        def _drawKps():
+            for kps in kps_list:
+                drawKps(img, kps)
+
+        results.append(makeResult('draw.drawBox', params,
+                timeIt(_drawBox, min_time)))
+        results.append(makeResult('draw.drawBoxes', params,
+                timeIt(lambda: drawBoxes(img, frame.boxes), min_time)))
+        results.append(makeResult('draw.drawKps', params,
+                timeIt(_drawKps, min_time)))
+        results.append(makeResult('draw.drawKpsBatch', params,
+                timeIt(lambda: drawKpsBatch(img, frame.kps2d), min_time)))
+    return results
+
+
+################################################################################
+# e2e
+################################################################################
+def startEmulator(fps, latency, queue_size):
+    '''在子进程中启动dev_emulator.py，返回(进程, 控制地址, 数据流地址)'''
+    ctrl_port = getFreePort()
+    stream_port = getFreePort()
+    proc = subprocess.Popen([sys.executable, osp.join(DEMO_DIR, 'dev_emulator.py'),
+            '--net_local_ip', '127.0.0.1',
+            '--net_local_port', str(ctrl_port),
+            '--net_local_stream_port', str(stream_port),
+            '--fps', str(fps), '--latency', str(latency),
+            '--queue_size', str(queue_size), '--stats_interval', '0'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, ('127.0.0.1', ctrl_port), ('127.0.0.1', stream_port)
+
+
+def benchE2E(frame_num=300, emu_fps=60, emu_latency=0.03, emu_queue_size=2,
+        stream_windows=(1, 0), net_target_ip=None, net_target_port=30000,
+        net_target_stream_port=30001):
+    '''net_target_ip为None时在子进程中启动模拟器，否则测试该地址的设备'''
+    from demo import ImgsReader
+    from batch_infer import startImgStream, runBatchInfer
+
+    proc = None
+    if net_target_ip is None:
+        proc, net_target_addr, net_stream_target_addr = startEmulator(
+                emu_fps, emu_latency, emu_queue_size)
+        local_ip = '127.0.0.1'
+    else:
+        net_target_addr = (net_target_ip, net_target_port)
+        net_stream_target_addr = (net_target_ip, net_target_stream_port)
+        local_ip = '0.0.0.0'
+    results = []
+    try:
+        msg_handler = MsgUdpHandler((local_ip, 0), net_target_addr, 1)
+        local_stream_port = getFreePort()
+        msg_stream_handler = MsgUdpHandler((local_ip, local_stream_port),
+                net_stream_target_addr, 1, recv_buf_bytes=4*1024*1024)
+        dev_agent = DevAgent(msg_handler)
+        # 等待设备（模拟器）就绪，端口未打开时请求会立即失败，重试前等待
+        t_end = time.monotonic() + 10
+        retry_delay = 0.05
+        while dev_agent.getDevBaseInfo() is None:
+            if time.monotonic() > t_end:
+                raise RuntimeError("Device is not responding")
+            time.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 1)
+        if not startImgStream(dev_agent, msg_stream_handler,
+                local_stream_port):
+            raise RuntimeError("Start device failed")
+        img_fpaths = [BENCH_IMG_PATH] * frame_num
+        for stream_window in stream_windows:
+            summary = runBatchInfer(msg_stream_handler,
+                    ImgsReader(img_fpaths), lambda record: None,
+                    lambda idx: {'idx': idx}, stream_window=stream_window,
+                    timeout=1.0)
+            params = {'stream_window': stream_window, 'frame_num': frame_num}
+            if proc is not None:
+                params.update({'emu_fps': emu_fps, 'emu_latency': emu_latency})
+            results.append(makeResult('e2e', params, summary))
+        dev_agent.pause()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+################################################################################
+# main
+################################################################################
+BENCHES = {
+    'udp'        : benchUdp,
+    'pose_decode': benchPoseDecode,
+    'jpeg'       : benchJpeg,
+    'draw'       : benchDraw,
+    'e2e'        : benchE2E,
+}
+
+
+def getMeta():
+    return {
+        'time'      : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform'  : platform.platform(),
+        'python'    : platform.python_version(),
+        'numpy'     : np.__version__,
+        'opencv'    : cv2.__version__,
+        'protobuf'  : google.protobuf.__version__,
+        'protobuf_impl': os.getenv('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION',
+            'default'),
+        'cpu_count' : os.cpu_count(),
+    }
+
+
+def run(output='benchmark.json', only=None, **kwargs):
+    '''运行性能测试，结果保存到output
+
+    only: 只运行的测试项，逗号分隔，如"udp,e2e"，默认运行全部
+    其他参数传给e2e，如--net_target_ip 192.168.181.2测试真实设备
+    '''
+    names = list(BENCHES) if only is None else \
+            [x for x in (only.split(',') if isinstance(only, str) else only)]
+    results = []
+    for name in names:
+        print("running %s..." % name)
+        bench = BENCHES[name]
+        results += bench(**kwargs) if name == 'e2e' else bench()
+    report = {'meta': getMeta(), 'results': results}
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for r in results:
+        print("%-36s %-48s %s" % (r['name'], json.dumps(r['params']),
+                json.dumps(r['metrics'])))
+    print("Results saved to %s" % output)
+
+
+def compare(base_path, new_path, threshold=0.1):
+    '''比较两次测试结果，打印变化超过threshold（比例）的指标'''
+    def _load(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        return {(r['name'], json.dumps(r['params'], sort_keys=True)):
+                r['metrics'] for r in report['results']}
+    base, new = _load(base_path), _load(new_path)
+    for key in new:
+        if key not in base:
+            continue
+        for metric, value in new[key].items():
+            base_value = base[key].get(metric)
+            if not isinstance(value, (int, float)) or \
+                    not isinstance(base_value, (int, float)) or base_value == 0:
+                continue
+            change = value / base_value - 1
+            if abs(change) >= threshold:
+                print("%-36s %-40s %-16s %12g -> %12g (%+.1f%%)" % (key[0],
+                        key[1], metric, base_value, value, change * 100))
+
+
+if __name__ == '__main__':
+    import fire
+    fire.Fire({'run': run, 'compare': compare})
@@ -0,0 +1,148 @@
+#coding: utf-8
+'''线程间传递帧的通道
+
+接口与queue.Queue兼容（put/get/put_nowait/get_nowait/full/empty/qsize，失败时抛出
+queue.Full/queue.Empty），用于替换各线程之间的小队列：
+- RingChannel: 有界FIFO，满时阻塞（POLICY_BLOCK）或丢弃最早的（POLICY_DROP_OLDEST）
+- LatestSlot: 只保存最新的一个值，put从不阻塞，覆盖未取走的值
+
+满时丢弃在put的一次加锁内完成，调用方不需要full()/get_nowait()/put（多步操作之间
+可能被其他线程插入）。一个锁、两个条件变量，只在有线程等待时才唤醒。
+每个通道有名称，统计放入、取出和丢弃的个数；丢弃的数据交给release（如归还缓冲区）。
+'''
+
+import time
+import queue
+import threading
+import collections
+
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+
+
+class RingChannel(object):
+    '''有界FIFO通道
+
+    maxsize: 最多保存的个数
+    policy: 满时put的行为，POLICY_BLOCK阻塞等待（可超时，超时抛出queue.Full），
+        POLICY_DROP_OLDEST丢弃最早的一个，不阻塞
+    name: 名称，用于日志和指标
+    release: release(item)处理被丢弃的数据，在锁外调用
+    '''
+    def __init__(self, maxsize, policy=POLICY_BLOCK, name=None, release=None):
+        super(RingChannel, self).__init__()
+        assert maxsize > 0
+        assert policy in [POLICY_BLOCK, POLICY_DROP_OLDEST]
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.release = release
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        # 等待中的线程数，为0时不需要notify
+        self.get_waiters = 0
+        self.put_waiters = 0
+        self.stats = collections.Counter()
+
+    def put(self, item, block=True, timeout=None):
+        dropped = None
+        with self.lock:
+            if len(self.items) >= self.maxsize:
+                if self.policy == POLICY_DROP_OLDEST:
+                    dropped = self.items.popleft()
+                    self.stats['drops'] += 1
+                elif not block:
+                    raise queue.Full
+                else:
+                    self._wait(self.not_full, 'put_waiters',
+                            lambda: len(self.items) < self.maxsize,
+                            timeout, queue.Full)
+            self.items.append(item)
+            self.stats['puts'] += 1
+            if self.get_waiters:
+                self.not_empty.notify()
+        if dropped is not None and self.release is not None:
+            self.release(dropped)
+
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if not self.items:
+                if not block:
+                    raise queue.Empty
+                self._wait(self.not_empty, 'get_waiters',
+                        lambda: self.items, timeout, queue.Empty)
+            item = self.items.popleft()
+            self.stats['gets'] += 1
+            if self.put_waiters:
+                self.not_full.notify()
+            return item
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        '''POLICY_DROP_OLDEST时put不会阻塞，但满时会丢弃数据'''
+        return len(self.items) >= self.maxsize
+
+    def clear(self):
+        '''丢弃所有数据（计入drops），返回丢弃的个数'''
+        with self.lock:
+            items = list(self.items)
+            self.items.clear()
+            self.stats['drops'] += len(items)
+            if self.put_waiters:
+                self.not_full.notify_all()
+        if self.release is not None:
+            for item in items:
+                self.release(item)
+        return len(items)
+
+    def getStats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.items)
+        return stats
+
+    def _wait(self, cond, waiters_name, predicate, timeout, exc):
+        '''持有锁时等待predicate成立，超时抛出exc'''
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        setattr(self, waiters_name, getattr(self, waiters_name) + 1)
+        try:
+            while not predicate():
+                if deadline is None:
+                    cond.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise exc
+                cond.wait(remaining)
+        finally:
+            setattr(self, waiters_name, getattr(self, waiters_name) - 1)
+
+
+class LatestSlot(RingChannel):
+    '''只保存最新的值：put覆盖未取走的值（计入drops），get等待新的值
+
+    用于只关心最新帧的地方，如摄像头读取的图片。
+    '''
+    def __init__(self, name=None, release=None):
+        super(LatestSlot, self).__init__(1, POLICY_DROP_OLDEST, name, release)
+
+
+def getChannelStats(channels):
+    '''名称 -> 统计'''
+    return {channel.name: channel.getStats() for channel in channels}
@@ -7,7 +7,9 @@ import fire
 import numpy as np
 import struct
 import threading
+import collections
 import queue
+import concurrent.futures
 import imagesize
 from typing import Union
 import os.path as osp
@@ -17,8 +19,20 @@ from loguru import logger
 import msg_pb2
 from dev_agent import DevAgent
 from msg_udp_handler import MsgUdpHandler, MSG_GET_CMD_RESPONS
-from vis import drawBox, drawKps, drawActions2
+from msg_dispatcher import MsgDispatcher
+from flow_control import FrameCreditWindow, diffImgIdx
+from pose_recorder import PoseRecordWriter
+from frame_tracer import FrameTracer
+from frame_sync import FrameSynchronizer
+from channels import RingChannel, LatestSlot, POLICY_DROP_OLDEST, \
+    getChannelStats
+from metrics import MetricsRegistry, MetricsServer, TemperaturePoller, \
+    observeTracer
+from vis import drawBoxes, drawKpsBatch, drawActions2
 from fps_helper import FPSHelper
+from stream_codec import decodeCamImgStream, parseRspMediaStream, \
+    decodeHumanPoseStream, HumanPoseFrame, encodeMediaStreamPrefix, \
+    CamImgStreamView, getJpegSize
 
 
 class BaseThread(threading.Thread):
@@ -61,11 +75,12 @@ class BaseThread(threading.Thread):
 
 
 class BaseReader(BaseThread):
-    def __init__(self, img_queue_size):
+    def __init__(self, img_queue_size, tracer:FrameTracer=None):
         super(BaseReader, self).__init__()
         self.img_queue_size = img_queue_size
-        self.img_queue = queue.Queue(img_queue_size)
+        self.img_queue = RingChannel(img_queue_size, name='img_read')
         self.img_put_idx = 0
+        self.tracer = tracer
 
     def getImgQueue(self):
         return self.img_queue
@@ -90,6 +105,8 @@ class BaseReader(BaseThread):
         return frame
 
     def _putFrame(self, frame):
+        if self.tracer is not None:
+            self.tracer.mark(self.img_put_idx, 'read')
         if self.putQueue(self.img_queue, (self.img_put_idx, frame)):
             self.img_put_idx += 1
             return True
@@ -101,6 +118,21 @@ class BaseReader(BaseThread):
 
 
 
+def isJpegData(img:np.ndarray):
+    '''是否为未解码的JPEG数据（以SOI标记开头的uint8数组）'''
+    return img.dtype == np.uint8 and img.size > 2 and \
+            (img.ndim == 1 or img.shape[0] == 1) and \
+            img.flat[0] == 0xFF and img.flat[1] == 0xD8
+
+
+def getJpegData(img_raw):
+    '''待显示图片中的JPEG数据：设备图片流（CamImgStreamView）取其data，
+    图片文件（bytes）和透传的JPEG（memoryview）原样返回'''
+    if isinstance(img_raw, CamImgStreamView):
+        return img_raw.data
+    return img_raw
+
+
 class VideoReader(BaseReader):
     def __init__(self,
             source=0,
@@ -110,15 +142,31 @@ class VideoReader(BaseReader):
             cam_use_mjpg=True,
             cam_loop_open:bool=True,
             img_scale=1.0,
+            is_pace_video:bool=True,
+            tracer:FrameTracer=None,
+            is_passthrough:bool=False,
             ):
-        super(VideoReader, self).__init__(img_queue_size)
+        '''
+        is_pace_video: 输入源为视频文件时，是否按cam_fps读取（否则尽快读取）
+        is_passthrough: 输入源为MJPG摄像头或MJPEG编码的视频时，不解码，直接输出
+            JPEG数据（memoryview），由发送和显示时按需使用；不支持时自动改为解码
+        输入源为摄像头时只保留最新的一帧（LatestSlot），不使用img_queue_size
+        '''
+        super(VideoReader, self).__init__(img_queue_size, tracer)
         self.source = source
         self.cam_size = cam_size
         self.cam_fps = cam_fps
         self.cam_use_mjpg = cam_use_mjpg
         self.cam_loop_open = cam_loop_open
         self.img_scale = img_scale
+        self.is_pace_video = is_pace_video
+        self.is_passthrough = is_passthrough
+        if self.is_passthrough and img_scale != 1.:
+            logger.warning("Passthrough is disabled because img_scale != 1")
+            self.is_passthrough = False
         self.source_is_camera = isinstance(source, int) or source.startswith('/dev/')
+        if self.source_is_camera:
+            self.img_queue = LatestSlot('img_read')
         assert self.cam_fps > 0
         assert self.img_scale > 0
         self.is_opened = False
@@ -143,9 +191,29 @@ class VideoReader(BaseReader):
             cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.cam_size[0])
             cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.cam_size[1])
             cap.set(cv2.CAP_PROP_FPS, self.cam_fps)
+        if self.is_passthrough:
+            self.setPassthrough(cap)
         self.is_opened = True
         return cap
 
+    def setPassthrough(self, cap):
+        '''设置读取未解码的数据，第一帧读取后再检查是否为JPEG'''
+        self.is_passthrough_checked = False
+        if self.source_is_camera:
+            if not self.cam_use_mjpg:
+                logger.warning("Passthrough requires cam_use_mjpg")
+                self.is_passthrough = False
+                return
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        else:
+            fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little')
+            if fourcc.upper() not in [b'MJPG', b'AVRN', b'LJPG', b'JPEG']:
+                logger.warning(f"Passthrough is not supported for codec {fourcc}")
+                self.is_passthrough = False
+                return
+            # FFmpeg后端返回未解码的数据包
+            cap.set(cv2.CAP_PROP_FORMAT, -1)
+
     def isOpened(self):
         return self.is_opened
 
@@ -161,6 +229,8 @@ class VideoReader(BaseReader):
                     continue
             # 获取一帧
             ts = time.time()
+            if self.tracer is not None:
+                self.tracer.mark(self.img_put_idx, 'read_start')
             ret_val, img = self.cap.read()
             if not ret_val:
                 if self.source_is_camera:
@@ -174,30 +244,37 @@ class VideoReader(BaseReader):
                 else:
                     logger.info(f"Read video '{self.source}' finish")
                     break
+            # 直通模式只检查第一帧，不是JPEG时改为解码并重新打开
+            if self.is_passthrough:
+                if not self.is_passthrough_checked:
+                    if not isJpegData(img):
+                        logger.warning(f"'{self.source}' does not output JPEG, disable passthrough")
+                        self.is_passthrough = False
+                        self.cap.release()
+                        self.cap = self.openSource()
+                        continue
+                    self.is_passthrough_checked = True
+                    logger.info(f"Passthrough JPEG from '{self.source}'")
+                img = img.reshape(-1).data
             # 缩放图片
-            if self.img_scale != 1.:
+            elif self.img_scale != 1.:
                 w = round(img.shape[1] * self.img_scale)
                 h = round(img.shape[0] * self.img_scale)
                 img = cv2.resize(img, (w, h))
-            # 如果输入源是摄像头，图片队列满时，弹出最后一帧
-            if self.source_is_camera and self.img_queue.full():
-                try:
-                    self.img_queue.get_nowait()
-                except queue.Empty:
-                    pass
-            # 存入队列
+            # 存入队列（摄像头覆盖未取走的帧）
             if not self._putFrame(img):
                 break
             te = time.time()
             # 睡眠
-            if not self.source_is_camera:
+            if not self.source_is_camera and self.is_pace_video:
                 time.sleep(max(0, 1./self.cam_fps-(te - ts)))
         self.img_queue.put(None)
 
 
 class ImgsReader(BaseReader):
-    def __init__(self, img_fpaths, img_queue_size=2):
-        super(ImgsReader, self).__init__(img_queue_size)
+    def __init__(self, img_fpaths, img_queue_size=2,
+            tracer:FrameTracer=None):
+        super(ImgsReader, self).__init__(img_queue_size, tracer)
         assert img_fpaths
         self.img_fpaths = img_fpaths
         self.img_idx = 0
@@ -207,6 +284,8 @@ class ImgsReader(BaseReader):
             # 读取图片原始数据
             img_fpath = self.img_fpaths[self.img_idx]
             logger.debug(f"read {img_fpath}")
+            if self.tracer is not None:
+                self.tracer.mark(self.img_put_idx, 'read_start')
             self.img_idx += 1
             with open(img_fpath, 'rb') as f:
                 img = f.read()
@@ -216,11 +295,97 @@ class ImgsReader(BaseReader):
         self.img_queue.put(None)
 
 
+def makeJpegParams(quality:int=None, sampling:str=None):
+    '''cv2.imencode的JPEG参数
+
+    quality: 质量0~100，None为OpenCV默认值（95）
+    sampling: 色度采样，'444'、'422'、'420'、'411'或'440'，None为默认值（420）；
+        OpenCV版本不支持时忽略
+    '''
+    params = []
+    if quality is not None:
+        params += [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if sampling is not None:
+        param_id = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR', None)
+        value = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_%s' % sampling, None)
+        if param_id is None or value is None:
+            logger.warning(f"JPEG sampling factor '{sampling}' is not supported by OpenCV {cv2.__version__}")
+        else:
+            params += [param_id, value]
+    return params
+
+
+class JpegEncodeService(BaseThread):
+    '''用线程池并行编码JPEG，按输入顺序（即img_idx顺序）输出
+
+    cv2.imencode编码时释放GIL，多个线程可同时编码。输出队列中为
+    (img_idx, Future)，按提交顺序排列，相当于重排缓冲区：ImgSendService依次等待
+    每帧的编码结果，先编码完的后续帧等待前面的帧。输出队列的大小限制了同时编码的帧数。
+    已编码的数据（非np.ndarray）直接输出。
+    '''
+    def __init__(self, img_in_queue:Queue, img_out_queue:Queue, workers:int=2,
+            jpeg_params=None, tracer:FrameTracer=None, window=300):
+        super(JpegEncodeService, self).__init__()
+        self.img_in_queue = img_in_queue
+        self.img_out_queue = img_out_queue
+        self.workers = workers
+        self.jpeg_params = jpeg_params or []
+        self.tracer = tracer
+        # 最近每帧的编码耗时（秒）
+        self.encode_times = collections.deque(maxlen=window)
+        self.stats = collections.Counter()
+
+    def _run(self):
+        with concurrent.futures.ThreadPoolExecutor(self.workers,
+                thread_name_prefix='jpeg_encode') as pool:
+            while self.isRunning():
+                try:
+                    img_idx, img = self.img_in_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if isinstance(img, np.ndarray):
+                    img = pool.submit(self.encodeImg, img_idx, img)
+                    self.stats['imgs'] += 1
+                if not self.putQueue(self.img_out_queue, (img_idx, img)):
+                    break
+
+    def encodeImg(self, idx, img):
+        if self.tracer is not None:
+            self.tracer.mark(idx, 'encode_start')
+        ts = time.perf_counter()
+        ret, data = cv2.imencode('.jpg', img, self.jpeg_params)
+        self.encode_times.append(time.perf_counter() - ts)
+        if self.tracer is not None:
+            self.tracer.mark(idx, 'encoded')
+        if not ret:
+            raise ValueError(f"Encode img {idx} failed")
+        return data
+
+    def getStats(self):
+        '''提交编码的帧数和最近每帧编码耗时（毫秒）'''
+        stats = dict(self.stats)
+        encode_times = np.array(self.encode_times) * 1000
+        if len(encode_times) > 0:
+            stats['encode_mean_ms'] = round(float(encode_times.mean()), 3)
+            stats['encode_p95_ms'] = round(
+                    float(np.percentile(encode_times, 95)), 3)
+        return stats
+
+
 class ImgSendService(BaseThread):
-    def __init__(self, msg_handler:MsgUdpHandler, img_queue:Queue):
+    def __init__(self, msg_handler:MsgUdpHandler, img_queue:Queue,
+            tracer:FrameTracer=None, jpeg_params=None,
+            flow_window:FrameCreditWindow=None):
+        '''img_queue中的图片可以是np.ndarray（用jpeg_params编码）、JPEG数据或
+        JpegEncodeService输出的Future；编码失败的帧不发送，flow_window不为None时
+        归还其信用（reject）'''
         super(ImgSendService, self).__init__()
         self.msg_handler = msg_handler
         self.img_queue   = img_queue
+        self.tracer      = tracer
+        self.jpeg_params = jpeg_params or []
+        self.flow_window = flow_window
+        self.stats       = collections.Counter()
 
     def _run(self):
         while self.isRunning():
@@ -231,37 +396,76 @@ class ImgSendService(BaseThread):
             self.sendImg(img_idx, img)
 
     def sendImg(self, idx, img):
-        if isinstance(img, np.ndarray):
-            _, img = cv2.imencode('.jpg', img)
-            img = img.tobytes()
-        req = msg_pb2.ReqMediaStream()
-        req.type = msg_pb2.MEDIA_IMAGE_STREAM
-        req.img.idx = idx
-        req.img.pix_fmt = 1
-        req.img.data = img
-        self.msg_handler.sendMsg(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM, req)
+        if isinstance(img, concurrent.futures.Future):
+            try:
+                img = img.result()
+            except Exception as e:
+                logger.error(f"Encode image {idx} failed: {e}")
+                self.stats['encode_errors'] += 1
+                if self.flow_window is not None:
+                    self.flow_window.reject(idx)
+                return
+        else:
+            if self.tracer is not None:
+                self.tracer.mark(idx, 'encode_start')
+            if isinstance(img, np.ndarray):
+                _, img = cv2.imencode('.jpg', img, self.jpeg_params)
+            if self.tracer is not None:
+                self.tracer.mark(idx, 'encoded')
+        # 只编码图片数据之前的protobuf字段，图片数据直接分帧发送，不复制
+        img_data = memoryview(img).cast('B')
+        prefix = encodeMediaStreamPrefix(idx, img_data.nbytes,
+                pix_fmt=msg_pb2.Image.JPEG)
+        self.msg_handler.sendMsgBufs(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM,
+                [prefix, img_data])
+        self.stats['imgs'] += 1
+        self.stats['bytes'] += img_data.nbytes
+        if self.tracer is not None:
+            self.tracer.mark(idx, 'sent')
 
 
 
 class StreamRecvService(BaseThread):
     def __init__(self, msg_handler:MsgUdpHandler, img_queue:Queue,
-            pose_queue:Queue):
+            pose_queue:Queue, flow_window:FrameCreditWindow=None,
+            tracer:FrameTracer=None):
+        '''flow_window不为None时，用收到的Pose和图片流回复确认已发送的图片
+
+        img_queue和pose_queue满时put不能阻塞接收线程，应丢弃数据（如
+        POLICY_DROP_OLDEST的RingChannel，或非阻塞的FrameSynchronizer），
+        丢弃的图片由队列归还缓冲区
+        '''
         super(StreamRecvService, self).__init__()
         self.msg_handler = msg_handler
         self.img_queue   = img_queue
         self.pose_queue  = pose_queue
+        self.flow_window = flow_window
+        self.tracer      = tracer
+        self.stats       = collections.Counter()
 
     def _run(self):
         while self.isRunning():
             msg = self.msg_handler.recvMsg(timeout=1)
             if msg is None:
                 continue
-            self.handleMsg(msg)
+            self.handleAndFreeMsg(msg)
+
+    def registerTo(self, dispatcher:MsgDispatcher):
+        '''由分发线程接收数据流，此时不需要再启动本线程'''
+        for cmd in [msg_pb2.MSG_CMD_STREAM_CAM_IMG,
+                msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM)]:
+            dispatcher.setHandler(cmd, self.handleAndFreeMsg)
+
+    def handleAndFreeMsg(self, msg):
+        if not self.handleMsg(msg):
+            self.msg_handler.freeMsg(msg)
 
     def handleMsg(self, msg):
+        '''处理消息，返回True表示消息缓冲区已转交给其他对象，由其负责归还'''
         cmd = struct.unpack('H', msg['payload'][:2])[0]
         if cmd == msg_pb2.MSG_CMD_STREAM_CAM_IMG:
-            self.handleCamImgMsg(msg)
+            return self.handleCamImgMsg(msg)
         elif cmd == msg_pb2.MSG_CMD_STREAM_HUMAN_POSE:
             self.handleHumanPoseMsg(msg)
         elif cmd == MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM):
@@ -270,72 +474,98 @@ class StreamRecvService(BaseThread):
             print("WARN: Unknown cmd: 0x%04x" % cmd)
 
     def handleCamImgMsg(self, msg):
-        req = msg_pb2.ReqCamImgStream()
-        req.ParseFromString(msg['payload'][2:])
-        img = req.cam_img
         if self.img_queue is None:
-            return
-        if self.img_queue.full():
-            self.img_queue.get_nowait()
-        self.img_queue.put((img.idx, img.data))
+            return False
+        # 只定位图片数据，不复制；显示时解码，丢弃的帧归还缓冲区
+        try:
+            img = decodeCamImgStream(msg['payload'][2:],
+                    release=lambda: self.msg_handler.freeMsg(msg))
+        except Exception as e:
+            self.stats['decode_failures'] += 1
+            logger.warning(f"Decode cam img stream failed: {e}")
+            return False
+        self.stats['cam_imgs'] += 1
+        self.img_queue.put((img.img_idx, img))
+        return True
 
     def handleHumanPoseMsg(self, msg):
-        req = msg_pb2.ReqHumanPoseStream()
-        req.ParseFromString(msg['payload'][2:])
-        # print(f"img idx: {req.img_idx}")
-        boxes = [[b.xmin, b.ymin, b.xmax, b.ymax, b.score] for b in req.boxes]
-        pose = {'boxes': boxes}
-        if len(req.pose2ds) > 0:
-            kps = [[p.x, p.y, p.v] for p in req.pose2ds[0].point]
-            # 添加root节点
-            kps.append([(kps[6][0]+kps[9][0])//2, (kps[6][1]+kps[9][1])//2,
-                    min(kps[6][2], kps[9][2])])
-            pose['kps'] = kps
-        # 调整kps3d坐标系
-        if len(req.pose3ds) > 0:
-            # kps3d = [[p.x, p.y, p.z, p.v] for p in req.pose3ds[0].point]
-            kps3d = [[-p.x, -p.z, -p.y, p.v] for p in req.pose3ds[0].point]
-            pose['kps3d'] = kps3d
-
-        if len(req.hand_dirs) > 0:
-            left_dir = [req.hand_dirs[0].left & (1 << x) for x in range(6)]
-            right_dir = [req.hand_dirs[0].right & (1 << x) for x in range(6)]
-            pose['hand_dir'] = (left_dir, right_dir)
-
-        if self.pose_queue.full():
-            self.pose_queue.get_nowait()
-        self.pose_queue.put((req.img_idx, pose))
+        recv_time = time.monotonic()
+        try:
+            frame = decodeHumanPoseStream(msg['payload'][2:])
+        except Exception as e:
+            self.stats['decode_failures'] += 1
+            logger.warning(f"Decode human pose stream failed: {e}")
+            return
+        self.stats['poses'] += 1
+        if self.tracer is not None:
+            # 解码前不知道img_idx，补记收到的时间
+            self.tracer.mark(frame.img_idx, 'recv', recv_time)
+            self.tracer.mark(frame.img_idx, 'parsed')
+        if self.flow_window is not None:
+            self.flow_window.ack(frame.img_idx)
+        self.pose_queue.put((frame.img_idx, frame))
 
     def handleRspSourceStreamImg(self, msg):
-        rsp = msg_pb2.RspMediaStream()
-        rsp.ParseFromString(msg['payload'][2:])
+        rsp = parseRspMediaStream(msg['payload'][2:])
         if rsp.status != msg_pb2.MSG_STATUS_OK:
             logger.warning(str(rsp))
+            if self.flow_window is not None:
+                self.flow_window.reject(rsp.img_idx)
+        elif self.flow_window is not None:
+            self.flow_window.ack(rsp.img_idx)
+
+
+def drawHandDirs(img, frame:HumanPoseFrame):
+    '''在每个人的Box内绘制左右手方向'''
+    rows = np.flatnonzero(frame.has_hand_dir)
+    for box, (left_dir, right_dir) in zip(frame.boxes[rows].tolist(),
+            frame.getHandDirBits()[rows].tolist()):
+        drawActions2(img, box, left_dir, (200, 0, 0),
+                coord_offset=-20, font_size=1.2, thickness=10)
+        drawActions2(img, box, right_dir, (0, 200, 0),
+                coord_offset=20, font_size=1.2, thickness=10)
+
+
+# 缩小倍数 -> 解码时直接缩小的imdecode参数
+IMREAD_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
 
 class HumanPoseDisplayer(object):
+    '''显示图片和Pose
+
+    从synchronizer取出按img_idx配对的图片和Pose；等待Pose超时的帧只显示图片，
+    等待图片超时的Pose不显示。
+    图片保持为压缩数据，确定要显示时才解码；show_img_w
+    不为None且图片宽度是其2、4、8倍以上时，以1/2、1/4、1/8分辨率解码
+    （IMREAD_REDUCED_COLOR_*），Pose坐标随之缩小。
+    '''
     def __init__(self,
             title:str,
-            img_queue:Queue,
-            pose_queue:Queue,
+            synchronizer:FrameSynchronizer,
             is_show_img:bool,
             cam_img_w:int,
             cam_img_h:int,
             kps_thr:float,
             show_fps:float=None,
             is_draw_fps:bool=True,
-            idx_max_diff=3):
+            tracer:FrameTracer=None,
+            show_img_w:int=None):
         super(HumanPoseDisplayer, self).__init__()
         self.title = title
-        self.img_queue = img_queue
-        self.pose_queue = pose_queue
+        self.synchronizer = synchronizer
         self.is_show_img = is_show_img
         self.cam_img_w = cam_img_w
         self.cam_img_h = cam_img_h
         self.kps_thr = kps_thr
         self.show_fps = show_fps
         self.is_draw_fps = is_draw_fps
-        self.idx_max_diff = idx_max_diff
+        self.tracer = tracer
+        self.show_img_w = show_img_w
         self.last_img = None
         self.last_pose = None
         self.fps_helper_img = FPSHelper()
@@ -344,43 +574,36 @@ class HumanPoseDisplayer(object):
         is_first_frame = True
         while True:
             ts = time.time()
-            # 获取img
-            try:
-                img_idx, img_raw = self.img_queue.get(timeout=1)
-            except queue.Empty:
+            # 获取配对的图片和pose
+            result = self.synchronizer.get(timeout=1)
+            if result is None:
                 if not is_first_frame:
                     key = cv2.waitKey(1)
                     if key in [ord('q'), ord('Q'), 27]:
                         break
                 continue
+            img_idx, img_raw, pose = result
+            if img_raw is None:
+                continue
             self.fps_helper_img.update()
-            # 解码img
-            img = None
-            if self.is_show_img:
-                if isinstance(img_raw, np.ndarray):
-                    img = img_raw
-                else:
-                    img = self.decodeImg(img_raw)
-            if img is None:
-                img = np.zeros((self.cam_img_h, self.cam_img_w, 3), np.uint8)
+            if self.tracer is not None:
+                self.tracer.mark(img_idx, 'show_start')
+            # 只解码要显示的帧
+            img, reduce = self.decodeShowImg(img_raw)
             self.last_img = (img_idx, img)
-            # 获取pose
-            try:
-                self.last_pose = self.pose_queue.get(timeout=1)
-            except queue.Empty:
-                continue
+            self.last_pose = None if pose is None else (img_idx, pose)
             # 绘制
-            if self.last_pose is None:
-                continue
-            img_idx, img = self.last_img
-            pose_idx, pose = self.last_pose
-            if abs(img_idx - pose_idx) < self.idx_max_diff:
-                self.drawPose(img, pose)
+            if pose is not None:
+                self.drawPose(img, pose if reduce == 1 else \
+                        pose.getScaled(1. / reduce))
             if self.is_draw_fps:
                 self.drawFps(img, self.fps_helper_img.fps)
             # 显示
             is_first_frame = False
             cv2.imshow(self.title, img)
+            if self.tracer is not None:
+                self.tracer.mark(img_idx, 'shown')
+                self.tracer.finish(img_idx)
             # 睡眠
             te = time.time()
             wait_time = 1
@@ -392,10 +615,44 @@ class HumanPoseDisplayer(object):
                 break
 
 
-    def decodeImg(self, img_str):
+    def releaseImg(self, img_raw):
+        if isinstance(img_raw, CamImgStreamView):
+            img_raw.release()
+
+    def getImgReduce(self, img_w):
+        '''图片宽度为img_w时，显示时的缩小倍数（1、2、4或8）'''
+        reduce = 1
+        if self.show_img_w:
+            while reduce < 8 and img_w >= self.show_img_w * reduce * 2:
+                reduce *= 2
+        return reduce
+
+    def decodeShowImg(self, img_raw):
+        '''解码（或缩小）要显示的图片并归还缓冲区，返回(图片, 缩小倍数)'''
+        img = None
+        reduce = 1
+        if self.is_show_img:
+            if isinstance(img_raw, np.ndarray):
+                reduce = self.getImgReduce(img_raw.shape[1])
+                img = img_raw if reduce == 1 else cv2.resize(img_raw, None,
+                        fx=1./reduce, fy=1./reduce,
+                        interpolation=cv2.INTER_AREA)
+            else:
+                data = getJpegData(img_raw)
+                size = getJpegSize(data)
+                if size is not None:
+                    reduce = self.getImgReduce(size[0])
+                img = self.decodeImg(data, reduce)
+        self.releaseImg(img_raw)
+        if img is None:
+            reduce = 1
+            img = np.zeros((self.cam_img_h, self.cam_img_w, 3), np.uint8)
+        return img, reduce
+
+    def decodeImg(self, img_str, reduce=1):
         t1 = time.time()
         img_data = np.frombuffer(img_str, dtype=np.uint8)
-        img = cv2.imdecode(img_data, cv2.IMREAD_COLOR)
+        img = cv2.imdecode(img_data, IMREAD_REDUCED_FLAGS[reduce])
         t2 = time.time()
         # print("img decode time: %.1fms" % ((t2-t1)*1000))
         if img is None:
@@ -404,22 +661,14 @@ class HumanPoseDisplayer(object):
         return img
 
 
-    def drawPose(self, img, pose:dict):
-        if img is None or pose is None:
+    def drawPose(self, img, frame:HumanPoseFrame):
+        if img is None or frame is None:
             return
-        if 'boxes' in pose:
-            for b in pose['boxes']:
-                drawBox(img, b, b[-1], thickness=2, text_y_offset=38,
-                        text_color=(30,30,30), text_size=1.5,
-                        text_thickness=3)
-        if 'kps' in pose:
-            drawKps(img, pose['kps'], thr=self.kps_thr)
-        if 'hand_dir' in pose:
-            left_dir, right_dir = pose['hand_dir']
-            drawActions2(img, pose['boxes'][0], left_dir, (200, 0, 0),
-                    coord_offset=-20, font_size=1.2, thickness=10)
-            drawActions2(img, pose['boxes'][0], right_dir, (0, 200, 0),
-                    coord_offset=20, font_size=1.2, thickness=10)
+        drawBoxes(img, frame.boxes[frame.has_box], thickness=2,
+                text_y_offset=38, text_color=(30,30,30), text_size=1.5,
+                text_thickness=3)
+        drawKpsBatch(img, frame.kps2d[frame.has_kps2d], thr=self.kps_thr)
+        drawHandDirs(img, frame)
 
 
     def drawFps(self, img, fps:float, x_offset=10, y_offset=30, font_size=1,
@@ -435,13 +684,52 @@ class HumanPoseDisplayer(object):
         return img
 
 
+class PoseRecordService(BaseThread):
+    '''录制收到的Pose，并原样转发给pose_out_queue（应满时丢弃最早的）'''
+    def __init__(self,
+            pose_in_queue:Queue,
+            pose_out_queue:Queue,
+            writer:PoseRecordWriter,
+            flush_interval:float=1.0,
+            ):
+        super(PoseRecordService, self).__init__()
+        self.pose_in_queue = pose_in_queue
+        self.pose_out_queue = pose_out_queue
+        self.writer = writer
+        self.flush_interval = flush_interval
+
+    def _run(self):
+        last_flush_time = time.monotonic()
+        while self.isRunning():
+            try:
+                pose = self.pose_in_queue.get(timeout=0.1)
+            except queue.Empty:
+                pose = None
+            if pose is not None:
+                self.writer.write(pose[1])
+                self.pose_out_queue.put(pose)
+            # 定期写入当前块，异常退出时最多丢失flush_interval内的数据
+            if time.monotonic() - last_flush_time > self.flush_interval:
+                self.writer.flush()
+                last_flush_time = time.monotonic()
+        self.writer.close()
+        logger.info(f"pose record: {self.writer.path} {self.writer.getStats()}")
+
+
 class MediaSourceService(BaseThread):
+    '''把读取的图片发送给设备，并把图片和对应的Pose配对后送去显示
+
+    在flow_window允许的范围内连续发送多帧，不必等上一帧的Pose返回；已发送的帧
+    按img_idx与收到的Pose配对，flow_window判定丢失、超时或被拒绝的帧和被跳过的帧
+    不显示。已确认的帧一直等待其Pose，显示阻塞期间不会因等待时间过长被丢弃。
+    '''
     def __init__(self,
             img_read_queue:Queue,
             img_send_queue:Queue,
             img_show_queue:Queue,
             pose_recv_queue:Queue,
             pose_show_queue:Queue,
+            flow_window:FrameCreditWindow=None,
             ):
         super(MediaSourceService, self).__init__()
         self.img_read_queue = img_read_queue
@@ -449,29 +737,130 @@ class MediaSourceService(BaseThread):
         self.img_show_queue = img_show_queue
         self.pose_recv_queue = pose_recv_queue
         self.pose_show_queue = pose_show_queue
+        # 默认每次只有一帧在途
+        self.flow_window = FrameCreditWindow(1) if flow_window is None \
+                else flow_window
 
     def _run(self):
-        last_frame = None
+        # 已发送、等待Pose的帧：(img_idx, img)
+        pending = collections.deque()
+        is_read_end = False
         # Loop
         while self.isRunning():
-            # 从读取队列获取一帧
-            frame = self.popQueue(self.img_read_queue)
-            if frame is None and last_frame is None:
+            if is_read_end and len(pending) == 0:
                 break
-            # 存入发送队列
-            if frame is not None:
-                if not self.putQueue(self.img_send_queue, frame):
-                    break
-            # 将上一帧存入显示队列
-            if last_frame is not None:
-                if not self.putQueue(self.img_show_queue, last_frame):
-                    break
-            # 获取接收到的pose
-            pose = self.popQueue(self.pose_recv_queue,
-                    timeout=1 if last_frame is not None else 0.01)
+            # 窗口有空位时发送下一帧
+            can_send = not is_read_end and self.flow_window.hasCredit()
+            if can_send:
+                try:
+                    frame = self.img_read_queue.get(
+                            timeout=0.005 if pending else 0.1)
+                except queue.Empty:
+                    pass
+                else:
+                    if frame is None:
+                        is_read_end = True
+                    else:
+                        # 先记录再发送，以免确认先到达
+                        self.flow_window.onSend(frame[0])
+                        if not self.putQueue(self.img_send_queue, frame):
+                            break
+                        pending.append(frame)
+            # 获取接收到的pose，与等待中的帧配对
+            try:
+                pose = self.pose_recv_queue.get(
+                        timeout=0.001 if can_send else 0.05)
+            except queue.Empty:
+                pose = None
             if pose is not None:
-                self.pose_show_queue.put(pose)
-            last_frame = frame
+                if not self.showPose(pending, pose):
+                    break
+            # 丢弃设备不会再回复的帧；已确认的帧的pose在pose_recv_queue中等待配对
+            dropped = self.flow_window.popDropped()
+            if dropped:
+                dropped = set(dropped)
+                pending = collections.deque(x for x in pending \
+                        if x[0] not in dropped)
+
+    def showPose(self, pending, pose):
+        pose_idx = pose[0]
+        # 更早的帧已不会收到pose
+        while pending and diffImgIdx(pending[0][0], pose_idx) < 0:
+            pending.popleft()
+        if not pending or pending[0][0] != pose_idx:
+            return True
+        frame = pending.popleft()
+        return self.putQueue(self.img_show_queue, frame) and \
+                self.putQueue(self.pose_show_queue, pose)
+
+
+def registerMetrics(registry:MetricsRegistry,
+        msg_stream_handler:MsgUdpHandler,
+        stream_recv_service:StreamRecvService,
+        img_send_service:ImgSendService=None,
+        flow_window:FrameCreditWindow=None,
+        channels=()):
+    '''注册数据流的收发、丢弃和流控指标，均在抓取时从各对象的统计中读取
+
+    channels: 线程之间的RingChannel，按名称（标签queue）注册丢弃数和当前长度
+    '''
+    def _stat(get_stats, key):
+        return lambda: get_stats().get(key, 0)
+
+    recv_stats = lambda: stream_recv_service.stats
+    registry.counter('hpose_poses_received_total', 'Human pose frames received',
+            func=_stat(recv_stats, 'poses'))
+    registry.counter('hpose_cam_imgs_received_total',
+            'Camera images received', func=_stat(recv_stats, 'cam_imgs'))
+    registry.counter('hpose_decode_failures_total',
+            'Stream messages that failed to decode',
+            func=_stat(recv_stats, 'decode_failures'))
+    for channel in channels:
+        registry.counter('hpose_queue_drops_total',
+                'Frames dropped because the consumer queue was full',
+                {'queue': channel.name}, func=_stat(channel.getStats, 'drops'))
+        registry.gauge('hpose_queue_size', 'Frames waiting in the queue',
+                {'queue': channel.name}, func=channel.qsize)
+
+    # 分片和消息的接收统计（见MsgUdpHandler.getRecvStats）
+    udp_stats = msg_stream_handler.getRecvStats
+    for key, help in [
+            ('datagrams', 'UDP datagrams received'),
+            ('bytes', 'UDP payload bytes received'),
+            ('msgs', 'Messages reassembled'),
+            ('dropped_frames', 'Fragments dropped with incomplete messages'),
+            ('dropped_msgs', 'Incomplete messages dropped'),
+            ('timeout_msgs', 'Incomplete messages expired'),
+            ('invalid_frames', 'Fragments with invalid headers'),
+            ('duplicate_frames', 'Duplicate fragments'),
+            ('ring_full', 'Receive ring full events'),
+            ]:
+        registry.counter('hpose_udp_%s_total' % key, help,
+                func=_stat(udp_stats, key))
+    registry.gauge('hpose_udp_partial_msgs', 'Messages being reassembled',
+            func=_stat(udp_stats, 'partial_msgs'))
+
+    if img_send_service is not None:
+        send_stats = lambda: img_send_service.stats
+        registry.counter('hpose_imgs_sent_total', 'Images sent to the device',
+                func=_stat(send_stats, 'imgs'))
+        registry.counter('hpose_img_bytes_sent_total',
+                'Image bytes sent to the device',
+                func=_stat(send_stats, 'bytes'))
+    if flow_window is not None:
+        window_stats = flow_window.getStats
+        for key, help in [
+                ('acks', 'Sent frames acknowledged'),
+                ('rejects', 'Sent frames rejected by the device'),
+                ('losts', 'Sent frames skipped by the device'),
+                ('timeouts', 'Sent frames not acknowledged in time'),
+                ]:
+            registry.counter('hpose_stream_%s_total' % key, help,
+                    func=_stat(window_stats, key))
+        registry.gauge('hpose_stream_window', 'Stream credit window size',
+                func=_stat(window_stats, 'window'))
+        registry.gauge('hpose_stream_in_flight', 'Frames in flight',
+                func=_stat(window_stats, 'in_flight'))
 
 
 def main(
@@ -491,6 +880,19 @@ def main(
     show_fps               :bool            = None,
     is_draw_fps            :bool            = None,
     is_show_img            :bool            = True,
+    net_single_socket      :bool            = False,
+    stream_window          :int             = 0,
+    stream_max_window      :int             = 8,
+    record_path            :str             = None,
+    is_trace               :bool            = False,
+    trace_path             :str             = None,
+    metrics_port           :int             = None,
+    metrics_temp_interval  :float           = 10.,
+    is_passthrough         :bool            = False,
+    show_img_w             :int             = None,
+    encode_workers         :int             = 0,
+    jpeg_quality           :int             = None,
+    jpeg_sampling          :str             = None,
     ):
     '''
     Demo
@@ -499,7 +901,7 @@ def main(
     source: 输入源
         如果输入源（source）为空或None，使用设备摄像头;
         如果输入源为数字，使用主机摄像头;
-        如果输入源为.mp4视频，读取.mp4视频;
+        如果输入源为视频（.mp4、.avi、.mkv、.mov），读取视频;
         如果输入源为.jpg图片，读取.jpg图片;
         如果输入源为目录，读取该目录下所有的.jpg图片。
 
@@ -521,6 +923,24 @@ def main(
     is_draw_fps: 是否渲染FPS到图片，默认为None（输入源为Video时，渲染FPS；输入源为
         图片时，不渲染FPS）
     is_show_img: 是否显示图片
+    net_single_socket: 控制和数据流是否共用一个本地socket（net_local_port），
+        由分发线程接收，忽略net_local_stream_port
+    stream_window: 输入源为视频或图片时，同时在设备上处理（已发送、未收到结果）的
+        最大帧数；为0时根据测得的延迟在1~stream_max_window之间自动调整
+    stream_max_window: 自动调整时的最大帧数
+    record_path: 录制收到的Pose的文件路径（见pose_recorder.py），默认不录制
+    is_trace: 是否记录每帧各阶段的耗时，结束时打印各阶段耗时分位数
+    trace_path: 保存Chrome trace（JSON）的文件路径，不为None时开启is_trace
+    metrics_port: 在本机该端口以Prometheus文本格式提供运行指标（/metrics），
+        默认不提供；开启时同时记录各阶段耗时
+    metrics_temp_interval: 获取设备温度的间隔（秒）
+    is_passthrough: 输入源为主机MJPG摄像头或MJPEG编码的视频时，直接发送JPEG数据，
+        不解码再编码，只在显示时解码
+    show_img_w: 显示的图片宽度（近似），图片宽度是其2、4、8倍以上时以1/2、1/4、1/8
+        分辨率解码，默认按原尺寸显示
+    encode_workers: 并行编码JPEG的线程数，为0时在发送线程中编码
+    jpeg_quality: 发送图片的JPEG质量（0~100），默认为OpenCV的默认值
+    jpeg_sampling: 发送图片的JPEG色度采样，如444、422、420
     '''
     # 检查输入源
     source_type = None
@@ -539,7 +959,7 @@ def main(
                 exit(0)
         elif osp.isfile(source):
             ext = osp.splitext(source)[1].lower()
-            if ext in ['.mp4']:
+            if ext in ['.mp4', '.avi', '.mkv', '.mov']:
                 source_type = 'video'
             elif ext in ['.jpg', '.jpeg']:
                 source_type = 'img'
@@ -548,14 +968,12 @@ def main(
                 raise ValueError('Invalid input source')
     else:
         raise ValueError('Invalid input source')
-    # 输入源为图片时，显示帧率设置为0，不渲染FPS，图片和pose index应一致
-    idx_max_diff = 3
+    # 输入源为图片时，显示帧率设置为0，不渲染FPS
     if source_type == 'img':
         if show_fps is None:
             show_fps = 0
         if is_draw_fps is None:
             is_draw_fps = False
-        idx_max_diff = 1
     else:
         if is_draw_fps is None:
             is_draw_fps = True
@@ -577,83 +995,190 @@ def main(
     net_stream_local_addr = (net_local_ip, net_local_stream_port)
     net_stream_target_addr = (net_target_ip, net_target_stream_port)
 
-    msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, 1)
-    msg_stream_handler = MsgUdpHandler(net_stream_local_addr,
-            net_stream_target_addr, 1)
-    dev_agent = DevAgent(msg_handler)
-
-    # 设置设备属性
-    dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PAUSE)
-    if source_type == 'dev_camera':
-        dev_agent.setCameraParam(cam_idx, cam_img_w, cam_img_h, cam_fps)
-        dev_agent.enableSendCamImgStream()
-        dev_agent.enableCameraSource()
+    msg_dispatcher = None
+    if net_single_socket:
+        # 控制和数据流共用一个socket，由分发线程接收并按cmd分发
+        net_local_stream_port = net_local_port
+        msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, 1,
+                recv_buf_bytes=4*1024*1024)
+        msg_stream_handler = msg_handler.fork(net_stream_target_addr)
+        msg_dispatcher = MsgDispatcher(msg_handler)
+        msg_dispatcher.start()
     else:
-        dev_agent.enableSendHumanPoseStream()
-        dev_agent.disableSendCamImgStream()
-        dev_agent.enableImgStreamSource()
+        msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, 1)
+        msg_stream_handler = MsgUdpHandler(net_stream_local_addr,
+                net_stream_target_addr, 1, recv_buf_bytes=4*1024*1024)
+    dev_agent = DevAgent(msg_handler, msg_dispatcher)
+
+    # 设置设备属性（流水线发送，按顺序执行）
     msg_stream_handler.sendData(b'')
-    dev_agent.setStreamTargetAddr('192.168.181.1', net_local_stream_port)
-    msg_stream_handler.clearSocketRecvBuf(timeout=0.1)
-    dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PLAY)
-
-    logger.info(f"dev status: {dev_agent.getDevStatus()}")
-    logger.info(f"media source: {dev_agent.getMediaSource()}",)
-    logger.info(f"send human pose flag: {dev_agent.isSendHumanPoseStream()}")
-    logger.info(f"stream target addr: {dev_agent.getStreamTargetAddr()}")
-    if source_type == 'dev_camera':
-        logger.info(f"cam param:\n{dev_agent.getCameraParam()}")
-        logger.info(f"cam real param:\n{dev_agent.getCameraRealParam()}")
-        logger.info(f"send cam img flag: {dev_agent.isSendCamImgStream()}")
+    with dev_agent.pipeline():
+        dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PAUSE)
+        if source_type == 'dev_camera':
+            dev_agent.setCameraParam(cam_idx, cam_img_w, cam_img_h, cam_fps)
+            dev_agent.enableSendCamImgStream()
+            dev_agent.enableCameraSource()
+        else:
+            dev_agent.enableSendHumanPoseStream()
+            dev_agent.disableSendCamImgStream()
+            dev_agent.enableImgStreamSource()
+        dev_agent.setStreamTargetAddr('192.168.181.1', net_local_stream_port)
+    if msg_dispatcher is None:
+        msg_stream_handler.clearSocketRecvBuf(timeout=0.1)
+    with dev_agent.pipeline():
+        dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PLAY)
+        infos = [
+            ("dev status: ", dev_agent.getDevStatus()),
+            ("media source: ", dev_agent.getMediaSource()),
+            ("send human pose flag: ", dev_agent.isSendHumanPoseStream()),
+            ("stream target addr: ", dev_agent.getStreamTargetAddr()),
+        ]
+        if source_type == 'dev_camera':
+            infos += [
+                ("cam param:\n", dev_agent.getCameraParam()),
+                ("cam real param:\n", dev_agent.getCameraRealParam()),
+                ("send cam img flag: ", dev_agent.isSendCamImgStream()),
+            ]
+    for info, future in infos:
+        logger.info(f"{info}{future.result()}")
 
     # 创建 Services
-    img_send_queue = Queue(1)
-    img_show_queue = Queue(1)
-    pose_recv_queue = Queue(2)
-    pose_show_queue = Queue(1)
+    tracer = None
+    if is_trace or trace_path is not None or metrics_port is not None:
+        tracer = FrameTracer(max_events=100000 if trace_path else 0)
+    # 线程之间的通道：发送链路满时阻塞（按顺序发送每帧），接收链路满时丢弃最早的
+    # （不阻塞接收线程），各自统计丢弃数
+    channels = []
+    img_send_queue = RingChannel(1, name='img_send')
+    # 显示的图片和pose按img_idx配对；设备摄像头只显示最新的帧，其他输入源按顺序
+    # 显示每帧（MediaSourceService已配对，阻塞等待显示）
+    frame_sync = FrameSynchronizer(is_block=source_type != 'dev_camera',
+            release_img=lambda img: img.release() \
+                    if isinstance(img, CamImgStreamView) else None)
+    img_show_queue = frame_sync.getImgQueue()
+    pose_show_queue = frame_sync.getPoseQueue()
 
     if source_type == 'dev_camera':
-        pose_show_queue = pose_recv_queue
+        pose_recv_queue = pose_show_queue
         stream_recv_service = StreamRecvService(msg_stream_handler,
-                img_show_queue, pose_recv_queue)
+                img_show_queue, pose_recv_queue, tracer=tracer)
     else:
+        # 多帧在途时，显示阻塞期间收到的pose不能被丢弃
+        flow_window = FrameCreditWindow(stream_window or None,
+                max_window=stream_max_window)
+        pose_recv_queue = RingChannel((stream_window or stream_max_window) + 1,
+                POLICY_DROP_OLDEST, 'pose_recv')
         stream_recv_service = StreamRecvService(msg_stream_handler, None,
-                pose_recv_queue)
-        img_send_service = ImgSendService(msg_stream_handler, img_send_queue)
-        media_reader = VideoReader(source, cam_size=(cam_img_w,cam_img_h), cam_fps=cam_fps) \
-                if source_type == 'video' else ImgsReader(img_fpaths)
+                pose_recv_queue, flow_window, tracer)
+        # 并行编码时，编码线程按顺序把每帧的编码结果交给发送线程
+        jpeg_params = makeJpegParams(jpeg_quality, jpeg_sampling)
+        jpeg_encode_service = None
+        img_encoded_queue = img_send_queue
+        if encode_workers > 0:
+            img_encoded_queue = RingChannel(encode_workers, name='img_encoded')
+            channels.append(img_encoded_queue)
+            jpeg_encode_service = JpegEncodeService(img_send_queue,
+                    img_encoded_queue, encode_workers, jpeg_params, tracer)
+        img_send_service = ImgSendService(msg_stream_handler,
+                img_encoded_queue, tracer, jpeg_params, flow_window)
+        if source_type == 'video':
+            media_reader = VideoReader(source, cam_size=(cam_img_w,cam_img_h),
+                    cam_fps=cam_fps, tracer=tracer,
+                    is_passthrough=is_passthrough)
+        else:
+            media_reader = ImgsReader(img_fpaths, tracer=tracer)
         img_read_queue = media_reader.getImgQueue()
         media_service = MediaSourceService(img_read_queue, img_send_queue,
-                img_show_queue, pose_recv_queue, pose_show_queue)
+                img_show_queue, pose_recv_queue, pose_show_queue, flow_window)
+        channels += [img_read_queue, img_send_queue, pose_recv_queue]
+
+    # 录制时StreamRecvService把Pose交给录制线程，再由其转发
+    pose_record_service = None
+    if record_path is not None:
+        pose_out_queue = pose_recv_queue
+        pose_recv_queue = RingChannel(pose_out_queue.maxsize,
+                POLICY_DROP_OLDEST, 'pose_record')
+        channels.append(pose_recv_queue)
+        stream_recv_service.pose_queue = pose_recv_queue
+        pose_record_service = PoseRecordService(pose_recv_queue,
+                pose_out_queue, PoseRecordWriter(record_path))
 
     # 创建显示
     cv2.namedWindow(window_title, cv2.WINDOW_AUTOSIZE)
-    pose_displayer = HumanPoseDisplayer(window_title, img_show_queue,
-            pose_show_queue,
+    pose_displayer = HumanPoseDisplayer(window_title, frame_sync,
             is_show_img, cam_img_w, cam_img_h, kps_thr,
             show_fps=show_fps, is_draw_fps=is_draw_fps,
-            idx_max_diff=idx_max_diff)
+            tracer=tracer, show_img_w=show_img_w)
+
+    # 运行指标
+    metrics_server = None
+    temp_poller = None
+    if metrics_port is not None:
+        registry = MetricsRegistry()
+        if source_type == 'dev_camera':
+            registerMetrics(registry, msg_stream_handler, stream_recv_service,
+                    channels=channels)
+        else:
+            registerMetrics(registry, msg_stream_handler, stream_recv_service,
+                    img_send_service, flow_window, channels)
+        registry.gauge('hpose_display_fps', 'Displayed frames per second',
+                func=lambda: pose_displayer.fps_helper_img.fps)
+        for reason in ['skipped', 'evicted', 'late', 'ready_drops',
+                'pose_timeouts', 'img_timeouts']:
+            registry.counter('hpose_sync_unmatched_total',
+                    'Images or poses not shown as matched pairs',
+                    {'reason': reason},
+                    func=lambda reason=reason: frame_sync.getStats().get(
+                            reason, 0))
+        observeTracer(registry, tracer)
+        temp_poller = TemperaturePoller(dev_agent, registry.gauge(
+                'hpose_device_temperature', 'Device temperature'),
+                metrics_temp_interval)
+        metrics_server = MetricsServer(registry, metrics_port)
+        logger.info(f"metrics: http://{'%s:%d' % metrics_server.getAddr()}/metrics")
 
     # 开始
+    services = []
+    if pose_record_service is not None:
+        services.append(pose_record_service)
     if source_type != 'dev_camera':
-        media_reader.start()
-        media_service.start()
-        img_send_service.start()
-    stream_recv_service.start()
+        services += [media_reader, media_service, img_send_service]
+        if jpeg_encode_service is not None:
+            services.append(jpeg_encode_service)
+    if msg_dispatcher is None:
+        services.append(stream_recv_service)
+    else:
+        stream_recv_service.registerTo(msg_dispatcher)
+    for service in services:
+        service.start()
+    if metrics_server is not None:
+        metrics_server.start()
+        temp_poller.start()
     pose_displayer.show()
 
     # 等待结束
+    if metrics_server is not None:
+        temp_poller.stop()
+        metrics_server.stop()
+    if msg_dispatcher is not None:
+        services.append(msg_dispatcher)
+    for service in services:
+        service.stop()
+    for service in services:
+        service.join()
+    logger.info(f"frame sync: {frame_sync.getStats()}")
+    for name, stats in getChannelStats(channels).items():
+        logger.info(f"queue {name}: {stats}")
     if source_type != 'dev_camera':
-        media_reader.stop()
-        media_service.stop()
-        img_send_service.stop()
-    stream_recv_service.stop()
-
-    if source_type != 'dev_camera':
-        media_reader.join()
-        media_service.join()
-        img_send_service.join()
-    stream_recv_service.join()
+        logger.info(f"stream window: {flow_window.getStats()}")
+        if jpeg_encode_service is not None:
+            logger.info(f"jpeg encode: {jpeg_encode_service.getStats()}")
+    if tracer is not None:
+        for stage, stats in tracer.getStats().items():
+            logger.info(f"trace {stage}: {stats}")
+        if trace_path is not None:
+            tracer.saveChromeTrace(trace_path)
+            logger.info(f"Chrome trace saved to {trace_path}")
 
 
 if __name__ == '__main__':
@@ -20,36 +20,37 @@ import pyqtgraph.opengl as gl
 import msg_pb2
 from dev_agent import DevAgent
 from msg_udp_handler import MsgUdpHandler
-from vis import drawBox, drawKps, drawActions2, drawText
+from vis import drawBoxes, drawKpsBatch, drawText
 from vis import KPS_SKELETONS, KPS_JOINTS
 from fps_helper import FPSHelper
 
 from demo import VideoReader, ImgsReader, ImgSendService, StreamRecvService, \
-    MediaSourceService
+    MediaSourceService, drawHandDirs, getJpegData
+from stream_codec import CamImgStreamView
+from flow_control import FrameCreditWindow
+from frame_sync import FrameSynchronizer
+from channels import RingChannel, POLICY_DROP_OLDEST
 
 
 class HumanPoseWidget(gl.GLViewWidget):
+    '''从synchronizer取出按img_idx配对的图片和Pose并显示，等待Pose超时的帧只显示图片'''
     def __init__(self,
-            img_queue:Queue,
-            pose_queue:Queue,
+            synchronizer:FrameSynchronizer,
             kps_thr:float,
             show_fps:float=None,
             is_draw_fps:bool=True,
             is_show_img:bool=True,
             kps3d_max_height=3000,
             kps3d_z_offset=0.5,
-            idx_max_diff=3,
             parent=None):
         super().__init__(parent)
-        self.img_queue = img_queue
-        self.pose_queue = pose_queue
+        self.synchronizer = synchronizer
         self.kps_thr = kps_thr
         self.show_fps = show_fps
         self.kps3d_max_height = kps3d_max_height
         self.kps3d_z_offset = kps3d_z_offset
         self.is_draw_fps = is_draw_fps
         self.is_show_img = is_show_img
-        self.idx_max_diff = idx_max_diff
         self.initUi()
         self.last_frame = None
         self.last_pose = None
@@ -128,30 +129,23 @@ class HumanPoseWidget(gl.GLViewWidget):
             else:
                 if time.time()-self.last_update_time < 1/self.show_fps:
                     return
-        # 获取img
-        if self.last_frame is None:
-            frame = None
-            while not self.img_queue.empty():
-                frame = self.img_queue.get()
-            if frame is not None:
-                # 解码
-                img_idx, img = frame
-                if isinstance(img, bytes):
-                    img = self.decodeImg(img)
-                self.last_frame = (img_idx, img)
-                self.fps_helper.update()
-        # 获取pose
-        pose = None
-        while not self.pose_queue.empty():
-            pose = self.pose_queue.get()
-        if pose is None:
+        # 获取配对的图片和pose，不等待
+        result = self.synchronizer.get(timeout=0)
+        if result is None or result.img is None:
             return
-        self.last_pose = pose
-        if self.last_frame is None:
+        # 解码
+        img_idx, img, pose = result
+        if not isinstance(img, np.ndarray):
+            img_raw, img = img, self.decodeImg(getJpegData(img))
+            if isinstance(img_raw, CamImgStreamView):
+                img_raw.release()
+        if img is None:
             return
+        self.fps_helper.update()
+        self.last_frame = (img_idx, img)
+        self.last_pose = None if pose is None else (img_idx, pose)
         # 更新
         if self.updateImg():
-            self.last_frame = None
             self.last_update_time = time.time()
 
     def decodeImg(self, img_str):
@@ -233,36 +227,15 @@ class HumanPoseWidget(gl.GLViewWidget):
             return
         img_idx, img = self.last_frame
         img_h, img_w = img.shape[:2]
-        if self.last_pose is None:
-            return
-        pose_idx, pose = self.last_pose
-        # human数据与图片idx相差太远，则不绘制
-        if abs(pose_idx-img_idx) > self.idx_max_diff:
-            return
         # 更新GL变换坐标
         if self.gl_img.data.shape[0] != img_w or \
                 self.gl_img.data.shape[1] != img_h:
             self.updateItemTransform((img_w, img_h))
-        # 绘制Pose
-        if 'boxes' in pose:
-            for b in pose['boxes']:
-                drawBox(img, b, b[-1], thickness=2, text_y_offset=38,
-                        text_color=(30,30,30), text_size=1.5,
-                        text_thickness=3)
-        if 'kps' in pose:
-            drawKps(img, pose['kps'])
-        if 'kps3d' in pose:
-            kps3d = self.fixKps3d(pose['kps3d'], pose['kps'],
-                    (img.shape[1], img.shape[0]))
-            self.updatePose3d(kps3d)
-        else:
+        if self.last_pose is None:
+            # 等待Pose超时，只显示图片
             self.resetPose3d()
-        if 'hand_dir' in pose:
-            left_dir, right_dir = pose['hand_dir']
-            drawActions2(img, pose['boxes'][0], left_dir, (200, 0, 0),
-                    coord_offset=-20, font_size=1.2, thickness=10)
-            drawActions2(img, pose['boxes'][0], right_dir, (0, 200, 0),
-                    coord_offset=20, font_size=1.2, thickness=10)
+        else:
+            self.drawPose(img, self.last_pose[1])
         # 绘制fps到图像
         if self.is_draw_fps:
             drawText(img, "%.1f" % self.fps_helper.fps, 10, 30)
@@ -273,6 +246,21 @@ class HumanPoseWidget(gl.GLViewWidget):
             self.gl_img.setData(img_rgba)
         return True
 
+    def drawPose(self, img, pose):
+        drawBoxes(img, pose.boxes[pose.has_box], thickness=2,
+                text_y_offset=38, text_color=(30,30,30), text_size=1.5,
+                text_thickness=3)
+        drawKpsBatch(img, pose.kps2d[pose.has_kps2d])
+        # 3d骨骼只显示第一个同时有2d和3d关键点的人
+        rows = np.flatnonzero(pose.has_kps3d & pose.has_kps2d)
+        if len(rows) > 0:
+            kps3d = self.fixKps3d(pose.kps3d[rows[0]], pose.kps2d[rows[0]],
+                    (img.shape[1], img.shape[0]))
+            self.updatePose3d(kps3d)
+        else:
+            self.resetPose3d()
+        drawHandDirs(img, pose)
+
 
 def main(
     source                 :Union[str, int] = '',
@@ -293,6 +281,8 @@ def main(
     is_show_img            :bool            = True,
     kps3d_max_height      :float            = 2000.,
     kps3d_z_offset         :float           = 0.5,
+    stream_window          :int             = 0,
+    stream_max_window      :int             = 8,
     ):
     '''
     3D Demo
@@ -325,6 +315,9 @@ def main(
     is_show_img: 是否显示图片
     kps3d_max_height: 3d骨骼最大高度
     kps3d_z_offset: 3d骨骼里图片的距离（图片最大的一边*kps3d_z_offset）
+    stream_window: 输入源为视频或图片时，同时在设备上处理（已发送、未收到结果）的
+        最大帧数；为0时根据测得的延迟在1~stream_max_window之间自动调整
+    stream_max_window: 自动调整时的最大帧数
     '''
     # 检查输入源
     source_type = None
@@ -352,14 +345,12 @@ def main(
                 raise ValueError('Invalid input source')
     else:
         raise ValueError('Invalid input source')
-    # 输入源为图片时，显示帧率设置为0，不渲染FPS，图片和pose index应一致
-    idx_max_diff = 3
+    # 输入源为图片时，显示帧率设置为0，不渲染FPS
     if source_type == 'img':
         if show_fps is None:
             show_fps = 0
         if is_draw_fps is None:
             is_draw_fps = False
-        idx_max_diff = 1
     else:
         if is_draw_fps is None:
             is_draw_fps = True
@@ -383,63 +374,78 @@ def main(
 
     msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, 1)
     msg_stream_handler = MsgUdpHandler(net_stream_local_addr,
-            net_stream_target_addr, 1)
+            net_stream_target_addr, 1, recv_buf_bytes=4*1024*1024)
     dev_agent = DevAgent(msg_handler)
 
-    # 设置设备属性
-    dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PAUSE)
-    if source_type == 'dev_camera':
-        dev_agent.setCameraParam(cam_idx, cam_img_w, cam_img_h, cam_fps)
-        dev_agent.enableSendCamImgStream()
-        dev_agent.enableCameraSource()
-    else:
-        dev_agent.enableSendHumanPoseStream()
-        dev_agent.disableSendCamImgStream()
-        dev_agent.enableImgStreamSource()
+    # 设置设备属性（流水线发送，按顺序执行）
     msg_stream_handler.sendData(b'')
-    dev_agent.setStreamTargetAddr('192.168.181.1', net_local_stream_port)
+    with dev_agent.pipeline():
+        dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PAUSE)
+        if source_type == 'dev_camera':
+            dev_agent.setCameraParam(cam_idx, cam_img_w, cam_img_h, cam_fps)
+            dev_agent.enableSendCamImgStream()
+            dev_agent.enableCameraSource()
+        else:
+            dev_agent.enableSendHumanPoseStream()
+            dev_agent.disableSendCamImgStream()
+            dev_agent.enableImgStreamSource()
+        dev_agent.setStreamTargetAddr('192.168.181.1', net_local_stream_port)
     msg_stream_handler.clearSocketRecvBuf(timeout=0.1)
-    dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PLAY)
-
-    logger.info(f"dev status: {dev_agent.getDevStatus()}")
-    logger.info(f"media source: {dev_agent.getMediaSource()}",)
-    logger.info(f"send human pose flag: {dev_agent.isSendHumanPoseStream()}")
-    logger.info(f"stream target addr: {dev_agent.getStreamTargetAddr()}")
-    if source_type == 'dev_camera':
-        logger.info(f"cam param:\n{dev_agent.getCameraParam()}")
-        logger.info(f"cam real param:\n{dev_agent.getCameraRealParam()}")
-        logger.info(f"send cam img flag: {dev_agent.isSendCamImgStream()}")
+    with dev_agent.pipeline():
+        dev_agent.setDevStatus(msg_pb2.DEV_STATUS_PLAY)
+        infos = [
+            ("dev status: ", dev_agent.getDevStatus()),
+            ("media source: ", dev_agent.getMediaSource()),
+            ("send human pose flag: ", dev_agent.isSendHumanPoseStream()),
+            ("stream target addr: ", dev_agent.getStreamTargetAddr()),
+        ]
+        if source_type == 'dev_camera':
+            infos += [
+                ("cam param:\n", dev_agent.getCameraParam()),
+                ("cam real param:\n", dev_agent.getCameraRealParam()),
+                ("send cam img flag: ", dev_agent.isSendCamImgStream()),
+            ]
+    for info, future in infos:
+        logger.info(f"{info}{future.result()}")
 
     # 创建 Services
-    img_send_queue = Queue(1)
-    img_show_queue = Queue(1)
-    pose_recv_queue = Queue(2)
-    pose_show_queue = Queue(1)
+    img_send_queue = RingChannel(1, name='img_send')
+    # 显示的图片和pose按img_idx配对；设备摄像头只显示最新的帧，其他输入源按顺序
+    # 显示每帧
+    frame_sync = FrameSynchronizer(is_block=source_type != 'dev_camera',
+            release_img=lambda img: img.release() \
+                    if isinstance(img, CamImgStreamView) else None)
+    img_show_queue = frame_sync.getImgQueue()
+    pose_show_queue = frame_sync.getPoseQueue()
 
     if source_type == 'dev_camera':
-        pose_show_queue = pose_recv_queue
+        pose_recv_queue = pose_show_queue
         stream_recv_service = StreamRecvService(msg_stream_handler,
                 img_show_queue, pose_recv_queue)
     else:
+        # 多帧在途时，显示阻塞期间收到的pose不能被丢弃
+        flow_window = FrameCreditWindow(stream_window or None,
+                max_window=stream_max_window)
+        pose_recv_queue = RingChannel((stream_window or stream_max_window) + 1,
+                POLICY_DROP_OLDEST, 'pose_recv')
         stream_recv_service = StreamRecvService(msg_stream_handler, None,
-                pose_recv_queue)
+                pose_recv_queue, flow_window)
         img_send_service = ImgSendService(msg_stream_handler, img_send_queue)
         media_reader = VideoReader(source, cam_size=(cam_img_w,cam_img_h), cam_fps=cam_fps) \
                 if source_type == 'video' else ImgsReader(img_fpaths)
         img_read_queue = media_reader.getImgQueue()
         media_service = MediaSourceService(img_read_queue, img_send_queue,
-                img_show_queue, pose_recv_queue, pose_show_queue)
+                img_show_queue, pose_recv_queue, pose_show_queue, flow_window)
 
     # 创建显示
     app = pg.mkQApp(window_title)
-    cw = HumanPoseWidget(img_show_queue, pose_show_queue,
+    cw = HumanPoseWidget(frame_sync,
             kps_thr=kps_thr,
             kps3d_max_height=kps3d_max_height,
             kps3d_z_offset=kps3d_z_offset,
             show_fps=show_fps,
             is_draw_fps=is_draw_fps,
-            is_show_img=is_show_img,
-            idx_max_diff=idx_max_diff)
+            is_show_img=is_show_img)
     cw.setWindowTitle(window_title)
     cw.show()
 
@@ -1,33 +1,174 @@
 #coding: utf-8
 
+import time
 import struct
+import contextlib
+import concurrent.futures
+from concurrent.futures import Future
 import msg_pb2
 from msg_udp_handler import *
+from msg_request_tracker import MsgRequestTracker, mapFuture
+from msg_dispatcher import MsgDispatcher
+from prop_cache import PropCache
+
+
+def getRspValue(rsp, field, convert=None):
+    if rsp is None:
+        return None
+    value = getattr(rsp, field)
+    return value if convert is None else convert(value)
 
 
 class DevAgent(object):
-    def __init__(self, msg_handler:MsgUdpHandler):
+    def __init__(self, msg_handler:MsgUdpHandler,
+            dispatcher:MsgDispatcher=None, use_prop_cache=False):
+        '''dispatcher不为None时，由分发线程接收回复，msg_handler只用于发送
+
+        use_prop_cache为True时缓存获取到的属性，有效期内不再请求设备，见PropCache；
+        设置属性后读回的是请求的值而不是设备上的值，需要确认设备状态时不要启用
+        '''
         self.msg_handler = msg_handler
+        self.dispatcher = dispatcher
+        # 等待回复的属性请求，按req_msg_id匹配回复
+        self.req_tracker = MsgRequestTracker()
+        # 流水线模式下已发送的请求，见pipeline()
+        self.pipeline_futures = None
+        self.prop_cache = PropCache() if use_prop_cache else None
+        # 分发线程可能已在运行，初始化完成后再注册
+        if dispatcher is not None:
+            for cmd in [msg_pb2.MSG_CMD_GET_PROPERTY, msg_pb2.MSG_CMD_SET_PROPERTY]:
+                dispatcher.setHandler(MSG_GET_CMD_RESPONS(cmd),
+                        self.handleRspMsg)
 
     ############################################################################
-    # Get Prop
+    # Request
     ############################################################################
-    def getProp(self, prop_id, timeout=None, **args):
-        # 发送获取属性的消息
-        self.msg_handler.sendGetPropMsg(prop_id, **args)
-        # 接收消息
-        msg = self.msg_handler.recvMsg(timeout)
-        if msg is None:
+    def getTimeout(self, timeout=None):
+        return self.msg_handler.socket_timeout if timeout is None else timeout
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        '''流水线模式
+
+        with 内的getProp/setProp/get*/set*请求立即发送，不等待回复，返回Future；
+        退出with时统一接收回复，所有请求只需约一个往返时间。例如：
+
+            with dev_agent.pipeline():
+                dev_agent.pause()
+                f = dev_agent.getTemperature()
+            print(f.result())
+        '''
+        self.pipeline_futures = []
+        try:
+            yield self
+        finally:
+            futures, self.pipeline_futures = self.pipeline_futures, None
+            self.waitRsps(futures)
+
+    def waitResult(self, future):
+        '''等待请求完成并返回结果，流水线模式下直接返回future'''
+        if self.pipeline_futures is not None:
+            self.pipeline_futures.append(future)
+            return future
+        self.waitRsps([future])
+        return future.result()
+
+    def waitRsps(self, futures):
+        '''接收回复，直到futures全部完成（成功或超时）'''
+        while not all(f.done() for f in futures):
+            deadline = self.req_tracker.getNextDeadline()
+            if deadline is None:
+                break
+            remain_time = max(0, deadline - time.monotonic())
+            if self.dispatcher is not None:
+                concurrent.futures.wait(futures, remain_time)
+            else:
+                msg = self.msg_handler.recvMsg(remain_time)
+                if msg is not None:
+                    self.handleRspMsg(msg)
+            self.req_tracker.expire()
+
+    def requestMsg(self, cmd, proto_obj=None, timeout=None):
+        '''发送没有req_msg_id的请求并等待其回复消息，超时返回None'''
+        timeout = self.getTimeout(timeout)
+        if self.dispatcher is None:
+            self.msg_handler.sendMsg(cmd, proto_obj)
+            return self.msg_handler.recvMsg(timeout)
+        future = self.dispatcher.expectMsg(MSG_GET_CMD_RESPONS(cmd))
+        self.msg_handler.sendMsg(cmd, proto_obj)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.dispatcher.cancelExpect(future)
             return None
-        # 解析cmd
+
+    def handleRspMsg(self, msg):
+        '''解析属性回复消息，完成req_msg_id对应的请求'''
         cmd = struct.unpack('H', msg['payload'][:2])[0]
-        if cmd != MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_GET_PROPERTY):
-            print("ERROR: Would cmd(%04x) but got cmd(%04x)" % \
-                (msg_pb2.MSG_CMD_GET_PROPERTY, cmd))
-            return None
-        # 解析proto
-        rsp = msg_pb2.RspGetProp()
+        if cmd == MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_GET_PROPERTY):
+            rsp = msg_pb2.RspGetProp()
+        elif cmd == MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_SET_PROPERTY):
+            rsp = msg_pb2.RspSetProp()
+        else:
+            print("WARN: Drop unexpected cmd(%04x)" % cmd)
+            self.msg_handler.freeMsg(msg)
+            return False
         rsp.ParseFromString(msg['payload'][2:])
+        self.msg_handler.freeMsg(msg)
+        if not self.req_tracker.resolve(rsp.req_msg_id, rsp,
+                key=(cmd, rsp.prop_id)):
+            print("WARN: Drop stray rsp cmd(%04x) prop(%04x) req_msg_id(%d)" % \
+                    (cmd, rsp.prop_id, rsp.req_msg_id))
+            return False
+        return True
+
+    def invalidatePropCache(self, prop_id=None):
+        '''使属性缓存失效，prop_id为None时清空，例如设备被其他客户端修改后'''
+        if self.prop_cache is not None:
+            self.prop_cache.invalidate(prop_id)
+
+    def getPropCacheStats(self):
+        '''属性缓存的命中、未命中等次数，未启用缓存时返回空字典'''
+        return {} if self.prop_cache is None else self.prop_cache.getStats()
+
+    ############################################################################
+    # Get Prop
+    ############################################################################
+    def requestGetProp(self, prop_id, timeout=None, **args):
+        '''发送获取属性的消息，返回Future，结果为RspGetProp，失败为None
+
+        属性在缓存中且未过期时不发送消息，返回已完成的Future
+        '''
+        if self.prop_cache is not None:
+            rsp = self.prop_cache.get(prop_id, args)
+            if rsp is not None:
+                future = self.req_tracker.future_factory()
+                future.set_result(rsp)
+                return future
+        def _parse(rsp):
+            rsp = self.checkGetPropRsp(rsp, prop_id)
+            if rsp is not None and self.prop_cache is not None:
+                self.prop_cache.put(rsp, args)
+            return rsp
+        futures = []
+        def _track(msg_id):
+            futures.append(self.req_tracker.add(msg_id,
+                key=(MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_GET_PROPERTY), prop_id),
+                timeout=self.getTimeout(timeout), parse=_parse))
+        self.msg_handler.sendGetPropMsg(prop_id, on_send=_track, **args)
+        return futures[0]
+
+    def getProp(self, prop_id, timeout=None, **args):
+        future = self.requestGetProp(prop_id, timeout, **args)
+        return self.waitResult(future)
+
+    def getProps(self, prop_ids, timeout=None):
+        '''同时获取多个属性，返回RspGetProp列表（失败的为None）'''
+        with self.pipeline():
+            futures = [self.getProp(prop_id, timeout) for prop_id in prop_ids]
+        return [f.result() for f in futures]
+
+    def checkGetPropRsp(self, rsp, prop_id):
         # 检查状态和属性ID
         if rsp.status != msg_pb2.MSG_STATUS_OK:
             print("ERROR: Got prop(%04x) failed! status: %04x" % \
@@ -39,124 +180,142 @@ class DevAgent(object):
             return None
         return rsp
 
+    def getPropValue(self, prop_id, field, convert=None, **args):
+        '''获取属性，返回回复中field字段的值，失败返回None'''
+        rsp = self.getProp(prop_id, **args)
+        if isinstance(rsp, Future):
+            return mapFuture(rsp,
+                    lambda rsp: getRspValue(rsp, field, convert))
+        return getRspValue(rsp, field, convert)
+
     def getDevStatus(self):
         '''获取设备状态'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_DEVICE_STATUS)
-        return None if rsp is None else rsp.dev_status
+        return self.getPropValue(msg_pb2.MSG_PROP_DEVICE_STATUS, 'dev_status')
 
     def getDevBaseInfo(self):
         '''获取设备基本信息'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_DEVICE_BASE_INFO)
-        return None if rsp is None else rsp.dev_base_info
+        return self.getPropValue(msg_pb2.MSG_PROP_DEVICE_BASE_INFO,
+                'dev_base_info')
 
     def getTemperature(self):
         '''获取温度'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_TEMPERATURE)
-        return None if rsp is None else rsp.temperature
+        return self.getPropValue(msg_pb2.MSG_PROP_TEMPERATURE, 'temperature')
 
     def getAppNewVersion(self):
         '''获取App新版本'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_APP_NEW_VERSION)
-        return None if rsp is None else rsp.app_new_version
+        return self.getPropValue(msg_pb2.MSG_PROP_APP_NEW_VERSION,
+                'app_new_version')
 
     def getAppVersions(self):
         '''获取App所有版本'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_APP_VERSIONS)
-        return None if rsp is None else [x for x in rsp.app_versions]
+        return self.getPropValue(msg_pb2.MSG_PROP_APP_VERSIONS,
+                'app_versions', list)
 
     def getMediaSource(self):
         '''获取媒体输入源'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_MEDIA_SOURCE)
-        return None if rsp is None else rsp.media_source
+        return self.getPropValue(msg_pb2.MSG_PROP_MEDIA_SOURCE, 'media_source')
 
     def getCameraParam(self):
         '''获取相机参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_CAM_PARAM)
-        return None if rsp is None else rsp.cam_param
+        return self.getPropValue(msg_pb2.MSG_PROP_CAM_PARAM, 'cam_param')
 
     def getCameraRealParam(self):
         '''获取相机实际运行参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_CAM_REAL_PARAM)
-        return None if rsp is None else rsp.cam_param_real
+        return self.getPropValue(msg_pb2.MSG_PROP_CAM_REAL_PARAM,
+                'cam_param_real')
 
     def getCameraCtrl(self, _id):
         '''获取相机Ctrl'''
         cam_ctrl = {'id': _id}
-        rsp = self.getProp(msg_pb2.MSG_PROP_CAM_CTRL, cam_ctrl=cam_ctrl)
-        return None if rsp is None else rsp.cam_ctrl
+        return self.getPropValue(msg_pb2.MSG_PROP_CAM_CTRL,
+                'cam_ctrl', cam_ctrl=cam_ctrl)
 
     def isSendCamImgStream(self):
         '''是否发送图片流'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_ENABLE_CAM_IMG_STREAM)
-        return None if rsp is None else rsp.is_send_cam_img_stream
+        return self.getPropValue(msg_pb2.MSG_PROP_ENABLE_CAM_IMG_STREAM,
+                'is_send_cam_img_stream')
 
     def isEnableAi(self):
         '''是否使能AI'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_ENABLE_AI)
-        return None if rsp is None else rsp.is_enable_ai
+        return self.getPropValue(msg_pb2.MSG_PROP_ENABLE_AI, 'is_enable_ai')
 
     def getStreamTargetAddr(self):
         '''获取数据流目标地址'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_STREAM_TARGET_ADDR)
-        return None if rsp is None else rsp.stream_target_addr
+        return self.getPropValue(msg_pb2.MSG_PROP_STREAM_TARGET_ADDR,
+                'stream_target_addr')
 
     def isSendHumanPoseStream(self):
         '''是否发送HumanPose'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_ENABLE_HUMAN_POSE_STREAM)
-        return None if rsp is None else rsp.is_send_human_pose_stream
+        return self.getPropValue(msg_pb2.MSG_PROP_ENABLE_HUMAN_POSE_STREAM,
+                'is_send_human_pose_stream')
 
     def getHumanBoxModelParam(self):
         '''获取HumanBox模型参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_HUMAN_BOX_MODEL_PARAM)
-        return None if rsp is None else rsp.human_box_model_param
+        return self.getPropValue(msg_pb2.MSG_PROP_HUMAN_BOX_MODEL_PARAM,
+                'human_box_model_param')
 
     def getHumanPose3dModelParam(self):
         '''获取HumanPose3d模型参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_HUMAN_POSE3D_MODEL_PARAM)
-        return None if rsp is None else rsp.human_pose3d_model_param
+        return self.getPropValue(msg_pb2.MSG_PROP_HUMAN_POSE3D_MODEL_PARAM,
+                'human_pose3d_model_param')
 
     def getHumanBoxTrackParam(self):
         '''获取HumanBox追踪参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_HUMAN_BOX_TRACK_PARAM)
-        return None if rsp is None else rsp.human_box_track_param
+        return self.getPropValue(msg_pb2.MSG_PROP_HUMAN_BOX_TRACK_PARAM,
+                'human_box_track_param')
 
     def getHumanPose2DFilterParam(self):
         '''获取HumanPose2D过滤器参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_HUMAN_POSE2D_FILTER_PARAM)
-        return None if rsp is None else rsp.human_pose2d_filter_param
+        return self.getPropValue(msg_pb2.MSG_PROP_HUMAN_POSE2D_FILTER_PARAM,
+                'human_pose2d_filter_param')
 
     def getHandActionClsParam(self):
         '''获取手部动作分类参数'''
-        rsp = self.getProp(msg_pb2.MSG_PROP_HUMAN_HAND_ACTION_CLS_PARAM)
-        return None if rsp is None else rsp.hand_action_cls_param
+        return self.getPropValue(msg_pb2.MSG_PROP_HUMAN_HAND_ACTION_CLS_PARAM,
+                'hand_action_cls_param')
 
     ############################################################################
     # Set Prop
     ############################################################################
+    def requestSetProp(self, proto_obj, timeout=None):
+        '''发送设置属性的消息，返回Future，结果为是否设置成功'''
+        prop_id = proto_obj.prop_id
+        if self.prop_cache is not None:
+            # 设置完成前缓存的值已不可信；设置成功后用设置的值更新缓存
+            self.prop_cache.invalidate(prop_id)
+        def _parse(rsp):
+            ok = self.checkSetPropRsp(rsp, prop_id)
+            if ok and self.prop_cache is not None:
+                self.prop_cache.update(proto_obj)
+            return ok
+        futures = []
+        def _track(msg_id):
+            futures.append(self.req_tracker.add(msg_id,
+                key=(MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_SET_PROPERTY), prop_id),
+                timeout=self.getTimeout(timeout), parse=_parse,
+                timeout_result=False))
+        self.msg_handler.sendSetPropMsg(proto_obj, on_send=_track)
+        return futures[0]
+
     def setProp(self, proto_obj, timeout=None):
-        # 发送设置属性的消息
-        self.msg_handler.sendSetPropMsg(proto_obj)
-        # 获取消息
-        msg = self.msg_handler.recvMsg(timeout)
-        if msg is None:
-            return False
-        # 解析cmd
-        cmd = struct.unpack('H', msg['payload'][:2])[0]
-        if cmd != MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_SET_PROPERTY):
-            print("ERROR: Would cmd(%04x) but got cmd(%04x)" % \
-                (msg_pb2.MSG_CMD_SET_PROPERTY, cmd))
-            return False
-        # 解析proto
-        rsp = msg_pb2.RspSetProp()
-        rsp.ParseFromString(msg['payload'][2:])
+        future = self.requestSetProp(proto_obj, timeout)
+        return self.waitResult(future)
+
+    def setProps(self, proto_objs, timeout=None):
+        '''同时设置多个属性，返回每个属性是否设置成功'''
+        with self.pipeline():
+            futures = [self.setProp(req, timeout) for req in proto_objs]
+        return [f.result() for f in futures]
+
+    def checkSetPropRsp(self, rsp, prop_id):
         # 检查状态和属性ID
         if rsp.status != msg_pb2.MSG_STATUS_OK:
             print("ERROR: Got prop(%04x) failed! status: %04x" % \
-                    (proto_obj.prop_id, rsp.status))
+                    (prop_id, rsp.status))
             return False
-        if rsp.prop_id != proto_obj.prop_id:
+        if rsp.prop_id != prop_id:
             print("ERROR: Would prop(%04x) but got prop(%04x)" % \
-                    (proto_obj.prop_id, rsp.prop_id))
+                    (prop_id, rsp.prop_id))
             return False
         return True
 
@@ -321,36 +480,50 @@ class DevAgent(object):
         '''切换软件版本号'''
         req = msg_pb2.ReqSwitchAppVersion()
         req.app_version = version
-        self.msg_handler.sendMsg(msg_pb2.MSG_CMD_SWITCH_APP_VERSION, req)
-        msg_ret = self.msg_handler.recvMsg(1);
+        msg_ret = self.requestMsg(msg_pb2.MSG_CMD_SWITCH_APP_VERSION, req, 1)
+        return self.parseSwitchAppVersionRsp(msg_ret, version)
+
+    def parseSwitchAppVersionRsp(self, msg_ret, version):
         if msg_ret is None:
             return False
         cmd = struct.unpack('H', msg_ret['payload'][:2])[0]
         if cmd != MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_SWITCH_APP_VERSION):
             print("ERROR: Would cmd(%04x) but got cmd(%04x)" % \
                 (msg_pb2.MSG_CMD_SWITCH_APP_VERSION, cmd))
+            self.msg_handler.freeMsg(msg_ret)
             return False
         rsp = msg_pb2.RspSwitchAppVersion()
         rsp.ParseFromString(msg_ret['payload'][2:])
+        self.msg_handler.freeMsg(msg_ret)
         if rsp.app_version != version:
             return False
-        return rsp.status == msg_pb2.MSG_STATUS_OK
+        if rsp.status != msg_pb2.MSG_STATUS_OK:
+            return False
+        self.invalidatePropCache()
+        return True
 
     def rebootSystem(self):
         '''重启设备'''
-        self.msg_handler.sendMsg(msg_pb2.MSG_CMD_REBOOT_SYSTEM)
-        msg_ret = self.msg_handler.recvMsg(1);
+        msg_ret = self.requestMsg(msg_pb2.MSG_CMD_REBOOT_SYSTEM, timeout=1)
+        return self.parseRebootSystemRsp(msg_ret)
+
+    def parseRebootSystemRsp(self, msg_ret):
         if msg_ret is None:  # 超时代表重启成功
+            self.invalidatePropCache()
             return True
         cmd = struct.unpack('H', msg_ret['payload'][:2])[0]
         if cmd != MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_REBOOT_SYSTEM):
             print("ERROR: Would cmd(%04x) but got cmd(%04x)" % \
                 (msg_pb2.MSG_CMD_REBOOT_SYSTEM, cmd))
+            self.msg_handler.freeMsg(msg_ret)
             return False
         rsp = msg_pb2.RspRebootSystem()
         rsp.ParseFromString(msg_ret['payload'][2:])
-        return rsp.status == msg_pb2.MSG_STATUS_OK
-
+        self.msg_handler.freeMsg(msg_ret)
+        if rsp.status != msg_pb2.MSG_STATUS_OK:
+            return False
+        self.invalidatePropCache()
+        return True
 
 if __name__ == '__main__':
     import os
@@ -0,0 +1,550 @@
+#coding: utf-8
+'''设备模拟器
+
+在本机模拟HumanPose加速板，实现msg.proto中的协议，用于没有硬件时测试和压测
+dev_agent.py、demo.py和udp_proxy.py：
+
+- 控制端口：获取/设置属性（保存在内存中）、切换版本、重启；
+- 数据流端口：接收输入源图片流，回复RspMediaStream，输出人体Pose；
+- 输入源为摄像头时，按相机参数的帧率生成图片并发送相机图片流。
+
+推理按固定的速度（fps）串行处理，每帧从收到到输出至少经过latency秒，等待推理的
+帧超过queue_size时丢弃。Pose为合成的（随时间摆动手臂），或循环回放录制文件
+（见pose_recorder.py）。数据流发送到属性STREAM_TARGET_ADDR的端口，IP默认为
+控制消息的来源IP，因为客户端设置的通常是加速板网络中的主机IP。
+'''
+
+import time
+import struct
+import threading
+import collections
+import numpy as np
+import cv2
+
+import msg_pb2
+from msg_udp_handler import MsgUdpHandler, MSG_GET_CMD_RESPONS
+from prop_cache import PROP_FIELDS, SETTABLE_PROP_FIELDS
+from stream_codec import KPS_NUM, KPS_DEV_NUM, KPS_ROOT_PARENTS, \
+    HumanPoseFrame, encodeHumanPoseStream, getJpegSize
+
+
+# 合成Pose的模板：AI Challenger 14个关键点，x相对人体中心，y从头顶向下，
+# 单位为人体高度
+SYNTHETIC_KPS = np.array([
+    [-0.12, 0.17],  # 0 右肩
+    [-0.18, 0.32],  # 1 右肘
+    [-0.20, 0.45],  # 2 右腕
+    [ 0.12, 0.17],  # 3 左肩
+    [ 0.18, 0.32],  # 4 左肘
+    [ 0.20, 0.45],  # 5 左腕
+    [-0.08, 0.50],  # 6 右髋
+    [-0.09, 0.72],  # 7 右膝
+    [-0.10, 0.95],  # 8 右踝
+    [ 0.08, 0.50],  # 9 左髋
+    [ 0.09, 0.72],  # 10 左膝
+    [ 0.10, 0.95],  # 11 左踝
+    [ 0.00, 0.00],  # 12 头顶
+    [ 0.00, 0.15],  # 13 脖子
+], dtype=np.float32)
+# 输出消息的统计名称
+OUTPUT_STAT_NAMES = {
+    MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM): 'acks',
+    msg_pb2.MSG_CMD_STREAM_CAM_IMG: 'cam_imgs',
+    msg_pb2.MSG_CMD_STREAM_HUMAN_POSE: 'poses',
+}
+
+# 3d Pose的人体高度（毫米）
+SYNTHETIC_HEIGHT_MM = 1700
+
+
+def makeSyntheticPose(img_idx, width, height, person_num=1, t=None):
+    '''合成一帧Pose：person_num个人横向排开，手臂随时间t（秒）上下摆动'''
+    t = time.monotonic() if t is None else t
+    n = person_num
+    kps = np.repeat(SYNTHETIC_KPS[None], n, axis=0)
+    phase = t * np.pi + np.arange(n)
+    # 手腕和手肘在肩下方和头顶之间摆动，左右手相反
+    lift = (0.5 + 0.5 * np.sin(phase))[:, None]
+    kps[:, [1, 2], 1] -= np.array([0.1, 0.4]) * lift
+    kps[:, [4, 5], 1] -= np.array([0.1, 0.4]) * (1 - lift)
+    person_h = 0.8 * height
+    centers = width * (np.arange(n) + 1) / (n + 1) + \
+            0.02 * width * np.sin(phase * 0.5)
+    kps2d = np.zeros((n, KPS_NUM, 3), dtype=np.float32)
+    kps2d[:, :KPS_DEV_NUM, 0] = centers[:, None] + kps[:, :, 0] * person_h
+    kps2d[:, :KPS_DEV_NUM, 1] = 0.1 * height + kps[:, :, 1] * person_h
+    kps2d[:, :KPS_DEV_NUM, 2] = 0.9
+    kps2d[:, :, :2] = np.floor(kps2d[:, :, :2])
+    kp_a = kps2d[:, KPS_ROOT_PARENTS[0]]
+    kp_b = kps2d[:, KPS_ROOT_PARENTS[1]]
+    kps2d[:, KPS_DEV_NUM, :2] = np.floor_divide(kp_a[:, :2] + kp_b[:, :2], 2)
+    kps2d[:, KPS_DEV_NUM, 2] = np.minimum(kp_a[:, 2], kp_b[:, 2])
+
+    boxes = np.zeros((n, 5), dtype=np.float32)
+    boxes[:, :2] = kps2d[:, :KPS_DEV_NUM, :2].min(axis=1) - 10
+    boxes[:, 2:4] = kps2d[:, :KPS_DEV_NUM, :2].max(axis=1) + 10
+    boxes[:, :4] = np.clip(boxes[:, :4], 0, [width - 1, height - 1] * 2)
+    boxes[:, 4] = 0.95
+
+    # 3d Pose以root为原点（显示坐标系，单位毫米）
+    root = (kps[:, 6] + kps[:, 9]) / 2
+    kps3d = np.zeros((n, KPS_NUM, 4), dtype=np.float32)
+    kps3d[:, :KPS_DEV_NUM, 0] = (kps[:, :, 0] - root[:, None, 0]) * \
+            SYNTHETIC_HEIGHT_MM
+    kps3d[:, :KPS_DEV_NUM, 2] = (root[:, None, 1] - kps[:, :, 1]) * \
+            SYNTHETIC_HEIGHT_MM
+    kps3d[:, :, :3] = np.trunc(kps3d[:, :, :3])
+    kps3d[:, :, 3] = 0.9
+
+    # 手腕高于肩时为向上
+    hand_dirs = np.zeros((n, 2), dtype=np.uint32)
+    hand_dirs[:, 0] = np.where(kps[:, 5, 1] < kps[:, 3, 1], msg_pb2.DIR_UP, 0)
+    hand_dirs[:, 1] = np.where(kps[:, 2, 1] < kps[:, 0, 1], msg_pb2.DIR_UP, 0)
+
+    has = np.ones(n, dtype=bool)
+    return HumanPoseFrame(img_idx, boxes, has, kps2d, has.copy(), kps3d,
+            has.copy(), hand_dirs, has.copy())
+
+
+def makeCameraImgs(width, height, num=30):
+    '''生成num张循环播放的JPEG图片（移动的圆）'''
+    imgs = []
+    for i in range(num):
+        img = np.full((height, width, 3), 64, dtype=np.uint8)
+        x = int(width * (0.1 + 0.8 * i / num))
+        cv2.circle(img, (x, height // 2), max(4, height // 10),
+                (0, 200, 255), -1)
+        cv2.putText(img, "EMULATOR", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                (255, 255, 255), 2)
+        _, jpg = cv2.imencode('.jpg', img)
+        imgs.append(jpg.tobytes())
+    return imgs
+
+
+def makeDefaultProps():
+    '''设备属性的初始值，保存在RspGetProp的对应字段中'''
+    props = msg_pb2.RspGetProp()
+    props.dev_status = msg_pb2.DEV_STATUS_PAUSE
+    info = props.dev_base_info
+    info.product_model = 'HumanPose Emulator'
+    info.device_uid = 'EMULATOR-0000'
+    info.hardware_version = '0.0.0'
+    info.software_version = '1.0.0'
+    info.protocol_version = '1.2.1'
+    props.app_versions.append('1.0.0')
+    props.media_source.type = msg_pb2.MEDIA_CAMERA
+    props.cam_param.idx = 0
+    props.cam_param.width = 1280
+    props.cam_param.height = 720
+    props.cam_param.fps = 30
+    props.cam_param.pix_fmt = msg_pb2.CameraParam.JPEG
+    props.cam_param_real.CopyFrom(props.cam_param)
+    props.is_enable_ai = True
+    props.is_send_human_pose_stream = True
+    props.stream_target_addr.ip = '192.168.181.1'
+    props.stream_target_addr.port = 30001
+    props.human_box_model_param.thr = 0.5
+    props.human_box_model_param.iou_thr = 0.45
+    props.human_pose3d_model_param.kps_thr = 0.3
+    return props
+
+
+class DevEmulator(object):
+    '''模拟设备，start()后在后台线程中运行'''
+    def __init__(self,
+            net_local_ip='0.0.0.0',
+            net_local_port=31000,
+            net_local_stream_port=31001,
+            fps=30.,
+            latency=0.05,
+            queue_size=2,
+            person_num=1,
+            pose_path=None,
+            stream_target_ip=None,
+            ):
+        '''
+        fps: 推理速度（帧/秒）
+        latency: 从收到图片到输出结果的最短时间（秒），实际不小于1/fps
+        queue_size: 等待推理的最大帧数，超过时丢弃
+        person_num: 合成Pose的人数
+        pose_path: 回放的Pose录制文件，为None时合成Pose
+        stream_target_ip: 数据流目标IP，为None时使用控制消息的来源IP
+        '''
+        super(DevEmulator, self).__init__()
+        self.ctrl_handler = MsgUdpHandler((net_local_ip, net_local_port),
+                None, 0.2)
+        self.stream_handler = MsgUdpHandler(
+                (net_local_ip, net_local_stream_port), None, 0.2,
+                recv_buf_bytes=8*1024*1024)
+        # 数据流的发送共用一个消息ID序列，目标地址在发送时指定
+        self.stream_sender = self.stream_handler.fork(None)
+        self.stream_send_lock = threading.Lock()
+        self.fps = fps
+        self.latency = latency
+        self.queue_size = queue_size
+        self.person_num = person_num
+        self.stream_target_ip = stream_target_ip
+        self.pose_reader = None
+        self.pose_iter = None
+        if pose_path is not None:
+            from pose_recorder import PoseRecordReader
+            self.pose_reader = PoseRecordReader(pose_path)
+
+        self.lock = threading.Lock()
+        self.props = makeDefaultProps()
+        # 相机Ctrl：id -> value
+        self.cam_ctrls = {}
+        self.host_ip = None
+        self.busy_until = 0
+        # 待输出的结果：(输出时间, [(cmd, proto_obj, addr)])，按输出时间排序
+        self.outputs = collections.deque()
+        self.output_cond = threading.Condition()
+        self.cam_imgs = {}
+        self.cmd_handlers = {
+            msg_pb2.MSG_CMD_GET_PROPERTY: self.handleGetProp,
+            msg_pb2.MSG_CMD_SET_PROPERTY: self.handleSetProp,
+            msg_pb2.MSG_CMD_SWITCH_APP_VERSION: self.handleSwitchAppVersion,
+            msg_pb2.MSG_CMD_REBOOT_SYSTEM: self.handleRebootSystem,
+        }
+        self.is_running = False
+        self.threads = []
+        self.stats = collections.Counter()
+
+    def getCtrlAddr(self):
+        return self.ctrl_handler.sock.getsockname()
+
+    def getStreamAddr(self):
+        return self.stream_handler.sock.getsockname()
+
+    def start(self):
+        self.is_running = True
+        for target in [self.runCtrl, self.runStreamRecv, self.runOutput,
+                self.runCamera]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.is_running = False
+        with self.output_cond:
+            self.output_cond.notify_all()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def getStats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    ############################################################################
+    # 控制消息
+    ############################################################################
+    def runCtrl(self):
+        while self.is_running:
+            msg = self.ctrl_handler.recvMsg(0.2)
+            if msg is None:
+                continue
+            self.host_ip = self.ctrl_handler.net_target_addr[0]
+            msg_id = msg['last_frame_head']['msg_id']
+            cmd = struct.unpack('H', msg['payload'][:2])[0]
+            data = bytes(msg['payload'][2:])
+            self.ctrl_handler.freeMsg(msg)
+            with self.lock:
+                self.stats['ctrl_msgs'] += 1
+            handler = self.cmd_handlers.get(cmd)
+            if handler is None:
+                print("WARN: Unknown cmd: 0x%04x" % cmd)
+                continue
+            rsp = handler(data, msg_id)
+            self.ctrl_handler.sendRspMsg(cmd, rsp)
+            if cmd == msg_pb2.MSG_CMD_REBOOT_SYSTEM:
+                self.reset()
+
+    def reset(self):
+        '''恢复属性的初始值，丢弃未输出的结果'''
+        with self.lock:
+            self.props = makeDefaultProps()
+            self.cam_ctrls.clear()
+        with self.output_cond:
+            self.outputs.clear()
+
+    def handleGetProp(self, data, msg_id):
+        req = msg_pb2.ReqGetProp()
+        req.ParseFromString(data)
+        rsp = msg_pb2.RspGetProp()
+        rsp.prop_id = req.prop_id
+        rsp.req_msg_id = msg_id
+        field = PROP_FIELDS.get(req.prop_id)
+        with self.lock:
+            self.stats['get_props'] += 1
+            if field is None:
+                rsp.status = msg_pb2.MSG_STATUS_INVALID_PROP
+                return rsp
+            if req.prop_id == msg_pb2.MSG_PROP_TEMPERATURE:
+                self.props.temperature = 45 + 5 * np.sin(time.time() / 60)
+            if req.prop_id == msg_pb2.MSG_PROP_CAM_CTRL:
+                rsp.cam_ctrl.id = req.cam_ctrl.id
+                rsp.cam_ctrl.value = self.cam_ctrls.get(req.cam_ctrl.id, 0)
+            else:
+                copyPropValue(self.props, rsp, field)
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        return rsp
+
+    def handleSetProp(self, data, msg_id):
+        req = msg_pb2.ReqSetProp()
+        req.ParseFromString(data)
+        rsp = msg_pb2.RspSetProp()
+        rsp.prop_id = req.prop_id
+        rsp.req_msg_id = msg_id
+        field = SETTABLE_PROP_FIELDS.get(req.prop_id)
+        with self.lock:
+            self.stats['set_props'] += 1
+            if field is None:
+                rsp.status = msg_pb2.MSG_STATUS_INVALID_PROP
+                return rsp
+            if req.prop_id == msg_pb2.MSG_PROP_CAM_PARAM and \
+                    (req.cam_param.width <= 0 or req.cam_param.height <= 0 or
+                    req.cam_param.fps < 0):
+                rsp.status = msg_pb2.MSG_STATUS_INVALID_PARAM
+                return rsp
+            if req.prop_id == msg_pb2.MSG_PROP_CAM_CTRL:
+                self.cam_ctrls[req.cam_ctrl.id] = req.cam_ctrl.value
+            else:
+                copyPropValue(req, self.props, field)
+            if req.prop_id == msg_pb2.MSG_PROP_CAM_PARAM:
+                self.props.cam_param_real.CopyFrom(req.cam_param)
+                if self.props.cam_param_real.fps == 0:
+                    self.props.cam_param_real.fps = 30
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        return rsp
+
+    def handleSwitchAppVersion(self, data, msg_id):
+        req = msg_pb2.ReqSwitchAppVersion()
+        req.ParseFromString(data)
+        rsp = msg_pb2.RspSwitchAppVersion()
+        rsp.app_version = req.app_version
+        with self.lock:
+            if req.app_version in self.props.app_versions:
+                rsp.status = msg_pb2.MSG_STATUS_OK
+            else:
+                rsp.status = msg_pb2.MSG_STATUS_INVALID_PARAM
+        return rsp
+
+    def handleRebootSystem(self, data, msg_id):
+        rsp = msg_pb2.RspRebootSystem()
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        return rsp
+
+    ############################################################################
+    # 数据流
+    ############################################################################
+    def sendStream(self, cmd, proto_obj, addr):
+        with self.stream_send_lock:
+            self.stream_sender.net_target_addr = addr
+            self.stream_sender.sendMsg(cmd, proto_obj)
+
+    def getStreamTargetAddr(self):
+        '''数据流目标地址，未设置端口时返回None'''
+        addr = self.props.stream_target_addr
+        if addr.port == 0:
+            return None
+        ip = self.stream_target_ip or self.host_ip or addr.ip
+        return (ip, addr.port)
+
+    def runStreamRecv(self):
+        while self.is_running:
+            msg = self.stream_handler.recvMsg(0.2)
+            if msg is None:
+                continue
+            addr = self.stream_handler.net_target_addr
+            cmd = struct.unpack('H', msg['payload'][:2])[0]
+            if cmd != msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM:
+                print("WARN: Unknown stream cmd: 0x%04x" % cmd)
+                self.stream_handler.freeMsg(msg)
+                continue
+            req = msg_pb2.ReqMediaStream()
+            req.ParseFromString(msg['payload'][2:])
+            self.stream_handler.freeMsg(msg)
+            self.handleMediaStream(req, addr)
+
+    def handleMediaStream(self, req, addr):
+        rsp = msg_pb2.RspMediaStream()
+        rsp.type = req.type
+        rsp.img_idx = req.img.idx
+        with self.lock:
+            self.stats['media_frames'] += 1
+            is_accepted = self.props.dev_status == msg_pb2.DEV_STATUS_PLAY and \
+                    self.props.media_source.type == msg_pb2.MEDIA_IMAGE_STREAM
+        if is_accepted:
+            size = (req.img.width, req.img.height)
+            if size[0] <= 0 or size[1] <= 0:
+                size = getJpegSize(req.img.data) or (1280, 720)
+            rsp.status = msg_pb2.MSG_STATUS_OK
+            is_accepted = self.scheduleFrame(req.img.idx, size, ack=(rsp, addr))
+        if not is_accepted:
+            # 未开始或设备忙时立即回复失败
+            rsp.status = msg_pb2.MSG_STATUS_FAILED
+            self.sendStream(MSG_GET_CMD_RESPONS(
+                    msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM), rsp, addr)
+
+    def nextPose(self, img_idx, size):
+        if self.pose_reader is None:
+            return makeSyntheticPose(img_idx, size[0], size[1],
+                    self.person_num)
+        # 循环回放录制的Pose
+        for _ in range(2):
+            if self.pose_iter is None:
+                self.pose_iter = self.pose_reader.iterFrames()
+            try:
+                _, frame = next(self.pose_iter)
+                frame.img_idx = img_idx
+                return frame
+            except StopIteration:
+                self.pose_iter = None
+        return makeSyntheticPose(img_idx, size[0], size[1], self.person_num)
+
+    def scheduleFrame(self, img_idx, size, ack=None, cam_img=None):
+        '''按推理速度和延迟安排一帧的输出，设备忙时丢弃，返回是否接受
+
+        ack: (RspMediaStream, 地址)，推理完成时回复
+        cam_img: 相机图片的JPEG数据，推理完成时与Pose一起发送
+        '''
+        now = time.monotonic()
+        service_time = 1. / self.fps
+        with self.lock:
+            # 排在前面的帧数（含正在推理的帧）
+            frames_ahead = (self.busy_until - now) / service_time
+            if frames_ahead > self.queue_size + 1e-6:
+                self.stats['drops'] += 1
+                return False
+            self.busy_until = max(now, self.busy_until) + service_time
+            done_time = max(self.busy_until, now + self.latency)
+            target_addr = self.getStreamTargetAddr()
+            is_send_img = cam_img is not None and \
+                    self.props.is_send_cam_img_stream
+            is_send_pose = self.props.is_enable_ai and \
+                    self.props.is_send_human_pose_stream
+            self.stats['frames'] += 1
+            pose = self.nextPose(img_idx, size) if is_send_pose else None
+        items = []
+        if ack is not None:
+            items.append((MSG_GET_CMD_RESPONS(
+                    msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM), ack[0], ack[1]))
+        if target_addr is not None:
+            if is_send_img:
+                req = msg_pb2.ReqCamImgStream()
+                req.cam_img.idx = img_idx
+                req.cam_img.pix_fmt = msg_pb2.Image.JPEG
+                req.cam_img.width, req.cam_img.height = size
+                req.cam_img.data = cam_img
+                items.append((msg_pb2.MSG_CMD_STREAM_CAM_IMG, req, target_addr))
+            if pose is not None:
+                items.append((msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                        encodeHumanPoseStream(pose), target_addr))
+        with self.output_cond:
+            self.outputs.append((done_time, items))
+            self.output_cond.notify()
+        return True
+
+    def runOutput(self):
+        while self.is_running:
+            with self.output_cond:
+                now = time.monotonic()
+                if not self.outputs or self.outputs[0][0] > now:
+                    wait_time = 0.2 if not self.outputs else \
+                            self.outputs[0][0] - now
+                    self.output_cond.wait(wait_time)
+                    continue
+                _, items = self.outputs.popleft()
+            for cmd, proto_obj, addr in items:
+                self.sendStream(cmd, proto_obj, addr)
+            with self.lock:
+                for cmd, _, _ in items:
+                    self.stats[OUTPUT_STAT_NAMES[cmd]] += 1
+
+    def runCamera(self):
+        '''输入源为摄像头且设备运行时，按相机帧率产生图片'''
+        img_idx = 0
+        next_time = time.monotonic()
+        while self.is_running:
+            with self.lock:
+                is_playing = \
+                        self.props.dev_status == msg_pb2.DEV_STATUS_PLAY and \
+                        self.props.media_source.type == msg_pb2.MEDIA_CAMERA
+                cam_param = msg_pb2.CameraParam()
+                cam_param.CopyFrom(self.props.cam_param_real)
+            if not is_playing:
+                time.sleep(0.05)
+                next_time = time.monotonic()
+                continue
+            size = (cam_param.width, cam_param.height)
+            if size not in self.cam_imgs:
+                self.cam_imgs[size] = makeCameraImgs(*size)
+            imgs = self.cam_imgs[size]
+            self.scheduleFrame(img_idx, size, cam_img=imgs[img_idx % len(imgs)])
+            img_idx = (img_idx + 1) & 0xFFFFFFFF
+            next_time += 1. / (cam_param.fps or 30)
+            now = time.monotonic()
+            if next_time < now:
+                next_time = now
+            time.sleep(next_time - now)
+
+
+def copyPropValue(src, dst, field):
+    value = getattr(src, field)
+    if hasattr(value, 'CopyFrom'):
+        getattr(dst, field).CopyFrom(value)
+    elif field == 'app_versions':
+        del getattr(dst, field)[:]
+        getattr(dst, field).extend(value)
+    else:
+        setattr(dst, field, value)
+
+
+def main(
+    net_local_ip          :str   = '0.0.0.0',
+    net_local_port        :int   = 31000,
+    net_local_stream_port :int   = 31001,
+    fps                   :float = 30,
+    latency               :float = 0.05,
+    queue_size            :int   = 2,
+    person_num            :int   = 1,
+    pose_path             :str   = None,
+    stream_target_ip      :str   = None,
+    stats_interval        :float = 5,
+    ):
+    '''
+    设备模拟器
+
+    Args:
+    net_local_ip: 监听IP
+    net_local_port: 控制端口号
+    net_local_stream_port: 数据流端口号
+    fps: 推理速度（帧/秒）
+    latency: 从收到图片到输出结果的最短时间（秒）
+    queue_size: 等待推理的最大帧数，超过时丢弃
+    person_num: 合成Pose的人数
+    pose_path: 回放的Pose录制文件（见pose_recorder.py），默认合成Pose
+    stream_target_ip: 数据流目标IP，默认为控制消息的来源IP
+    stats_interval: 打印统计信息的间隔（秒），为0时不打印
+    '''
+    emulator = DevEmulator(net_local_ip, net_local_port, net_local_stream_port,
+            fps, latency, queue_size, person_num, pose_path, stream_target_ip)
+    emulator.start()
+    print("emulator listening on %s (stream %s)" % (
+            emulator.getCtrlAddr(), emulator.getStreamAddr()))
+    try:
+        while True:
+            time.sleep(stats_interval or 1)
+            if stats_interval:
+                print("stats: %s" % emulator.getStats())
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    emulator.join()
+
+
+if __name__ == '__main__':
+    import fire
+    fire.Fire(main)
@@ -0,0 +1,224 @@
+#coding: utf-8
+'''设备配置文件
+
+配置文件为JSON或YAML，键为MsgProp属性名（可省略MSG_PROP_前缀），值为ReqSetProp中
+对应字段的值，消息类型的字段可只写需要修改的子字段，例如：
+
+    {
+        "MSG_PROP_CAM_PARAM": {"width": 1280, "height": 720, "fps": 30},
+        "MSG_PROP_HUMAN_BOX_MODEL_PARAM": {"thr": 0.5},
+        "MSG_PROP_CAM_CTRL": [{"id": 9963776, "value": 128}],
+        "MSG_PROP_ENABLE_AI": true,
+        "MSG_PROP_DEVICE_STATUS": "DEV_STATUS_PLAY"
+    }
+
+应用配置时先用一次流水线请求读取这些属性的当前值，只设置与当前值不同的属性，
+设置同样在一次流水线请求中完成，按配置文件中的顺序发送。
+'''
+
+import time
+import json
+from google.protobuf import json_format
+import msg_pb2
+from dev_agent import DevAgent
+from prop_cache import SETTABLE_PROP_FIELDS
+
+
+def parsePropName(name):
+    '''属性名（如MSG_PROP_CAM_PARAM或CAM_PARAM）转为属性ID'''
+    if isinstance(name, int):
+        return name
+    if not name.startswith('MSG_PROP_'):
+        name = 'MSG_PROP_' + name
+    try:
+        return msg_pb2.MsgProp.Value(name)
+    except ValueError:
+        raise ValueError("Unknown prop: %s" % name) from None
+
+
+def getPropName(prop_id, args=None):
+    name = msg_pb2.MsgProp.Name(prop_id)
+    if args and 'cam_ctrl' in args:
+        name += '[%d]' % args['cam_ctrl']['id']
+    return name
+
+
+def loadProfile(path):
+    '''读取配置文件，.yaml/.yml需要安装PyYAML'''
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def saveProfile(profile, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            yaml.safe_dump(profile, f, sort_keys=False, allow_unicode=True)
+        else:
+            json.dump(profile, f, indent=4, ensure_ascii=False)
+
+
+def makeProfileItems(profile:dict):
+    '''展开配置，返回[(prop_id, args, value)]，args为获取属性时的额外参数'''
+    items = []
+    for name, value in profile.items():
+        prop_id = parsePropName(name)
+        if prop_id not in SETTABLE_PROP_FIELDS:
+            raise ValueError("Prop %s is not settable" % name)
+        if prop_id == msg_pb2.MSG_PROP_CAM_CTRL:
+            # 相机Ctrl按id获取和设置，值为列表
+            for cam_ctrl in (value if isinstance(value, list) else [value]):
+                items.append((prop_id, {'cam_ctrl': {'id': cam_ctrl['id']}},
+                        cam_ctrl))
+        else:
+            items.append((prop_id, {}, value))
+    return items
+
+
+def makeSetPropReq(prop_id, value, rsp=None):
+    '''生成设置属性的请求，value合并到当前值rsp上（rsp为None时合并到默认值）'''
+    field = SETTABLE_PROP_FIELDS[prop_id]
+    req = msg_pb2.ReqSetProp()
+    req.prop_id = prop_id
+    if rsp is not None:
+        cur_value = getattr(rsp, field)
+        if hasattr(cur_value, 'CopyFrom'):
+            getattr(req, field).CopyFrom(cur_value)
+        else:
+            setattr(req, field, cur_value)
+    json_format.ParseDict({field: value}, req)
+    return req
+
+
+def messageToDict(msg):
+    try:
+        return json_format.MessageToDict(msg, preserving_proto_field_name=True,
+                including_default_value_fields=True)
+    except TypeError:  # protobuf>=5.26
+        return json_format.MessageToDict(msg, preserving_proto_field_name=True,
+                always_print_fields_with_no_presence=True)
+
+
+def applyProfile(dev_agent:DevAgent, profile:dict, dry_run=False):
+    '''应用配置，只设置与当前值不同的属性
+
+    profile: 配置字典或配置文件路径
+    dry_run: 为True时只读取和比较，不设置
+    返回报告：changed/unchanged为属性名列表，failed为读取或设置失败的属性名列表，
+    timings为各阶段耗时（秒）
+    '''
+    timings = {}
+    t_start = t = time.monotonic()
+    def _lap(phase):
+        nonlocal t
+        now = time.monotonic()
+        timings[phase] = now - t
+        t = now
+
+    if isinstance(profile, str):
+        profile = loadProfile(profile)
+    items = makeProfileItems(profile)
+    _lap('load')
+
+    # 读取当前值，不使用缓存
+    for prop_id in set(item[0] for item in items):
+        dev_agent.invalidatePropCache(prop_id)
+    with dev_agent.pipeline():
+        futures = [dev_agent.getProp(prop_id, **args)
+                for prop_id, args, _ in items]
+    rsps = [f.result() for f in futures]
+    _lap('read')
+
+    changed, unchanged, failed = [], [], []
+    reqs = []
+    for (prop_id, args, value), rsp in zip(items, rsps):
+        name = getPropName(prop_id, args)
+        if rsp is None:
+            # 读取失败时按有变化处理
+            failed.append(name)
+        req = makeSetPropReq(prop_id, value, rsp)
+        field = SETTABLE_PROP_FIELDS[prop_id]
+        if rsp is not None and getattr(req, field) == getattr(rsp, field):
+            unchanged.append(name)
+        else:
+            changed.append(name)
+            reqs.append((name, req))
+    _lap('diff')
+
+    if not dry_run and len(reqs) > 0:
+        results = dev_agent.setProps([req for _, req in reqs])
+        for (name, _), ok in zip(reqs, results):
+            if not ok and name not in failed:
+                failed.append(name)
+    _lap('apply')
+    timings['total'] = time.monotonic() - t_start
+
+    return {
+        'changed'  : changed,
+        'unchanged': unchanged,
+        'failed'   : failed,
+        'timings'  : timings,
+    }
+
+
+def dumpProfile(dev_agent:DevAgent, prop_ids=None):
+    '''读取设备当前的可设置属性，返回配置字典（不含相机Ctrl）'''
+    if prop_ids is None:
+        # 设备状态放在最后，应用配置时先修改参数再开始运行
+        prop_ids = [prop_id for prop_id in SETTABLE_PROP_FIELDS
+                if prop_id not in [msg_pb2.MSG_PROP_CAM_CTRL,
+                    msg_pb2.MSG_PROP_DEVICE_STATUS]]
+        prop_ids.append(msg_pb2.MSG_PROP_DEVICE_STATUS)
+    prop_ids = [parsePropName(prop_id) for prop_id in prop_ids]
+    for prop_id in prop_ids:
+        dev_agent.invalidatePropCache(prop_id)
+    profile = {}
+    for prop_id, rsp in zip(prop_ids, dev_agent.getProps(prop_ids)):
+        if rsp is None:
+            print("WARN: Get prop %s failed" % getPropName(prop_id))
+            continue
+        field = SETTABLE_PROP_FIELDS[prop_id]
+        value = messageToDict(rsp).get(field)
+        if value is not None:
+            profile[getPropName(prop_id)] = value
+    return profile
+
+
+if __name__ == '__main__':
+    import os
+    import fire
+    from msg_udp_handler import MsgUdpHandler
+
+    net_local_ip = os.getenv('LOCAL_IP', '0.0.0.0')
+    net_local_port = int(os.getenv('LOCAL_PORT', 20000))
+    net_target_ip = os.getenv('TARGET_IP', '192.168.181.2')
+    net_target_port = int(os.getenv('TARGET_PORT', 30000))
+    socket_timeout = int(os.getenv('TIMEOUT', 1))
+    net_local_addr  = (net_local_ip, net_local_port)
+    net_target_addr = (net_target_ip, net_target_port)
+
+    msg_handler = MsgUdpHandler(net_local_addr, net_target_addr, socket_timeout)
+    dev_agent = DevAgent(msg_handler)
+
+    def apply(profile_path, dry_run=False):
+        '''应用配置文件，只设置有变化的属性'''
+        report = applyProfile(dev_agent, profile_path, dry_run)
+        print("changed: %s" % report['changed'])
+        print("unchanged: %s" % report['unchanged'])
+        if len(report['failed']) > 0:
+            print("failed: %s" % report['failed'])
+        print("timings: " + ', '.join('%s %.1fms' % (k, v * 1000)
+                for k, v in report['timings'].items()))
+
+    def dump(profile_path=None, *prop_names):
+        '''读取设备当前配置，profile_path为None时打印'''
+        profile = dumpProfile(dev_agent, prop_names or None)
+        if profile_path is None:
+            print(json.dumps(profile, indent=4, ensure_ascii=False))
+        else:
+            saveProfile(profile, profile_path)
+
+    fire.Fire({'apply': apply, 'dump': dump})
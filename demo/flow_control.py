@@ -0,0 +1,175 @@
+#coding: utf-8
+
+import time
+import threading
+import collections
+
+
+IMG_IDX_MOD = 1 << 32
+
+
+def diffImgIdx(a, b):
+    '''图片下标a-b，考虑uint32回绕，结果在[-2^31, 2^31)内'''
+    return (a - b + (IMG_IDX_MOD >> 1)) % IMG_IDX_MOD - (IMG_IDX_MOD >> 1)
+
+
+class FrameCreditWindow(object):
+    '''发送图片流的信用窗口
+
+    同时最多有window帧已发送、未确认；设备回复的RspMediaStream.img_idx或人体Pose
+    的img_idx作为确认，归还信用。设备按顺序处理图片，确认某帧时更早的未确认帧视为
+    丢失；超过ack_timeout未确认的帧也视为丢失。设备回复失败时用reject归还信用。
+
+    window为None时按测得的往返时间自适应调整窗口（类似TCP Vegas）：
+    估计设备上排队的帧数 queued = window * (1 - min_rtt / rtt)，
+    每确认一个窗口的帧调整一次，queued < alpha时加1，queued > beta时减1。
+    这样设备始终有下一帧可处理，又不会堆积过多帧增加延迟。
+
+    不会再被确认的帧（丢失、超时、被拒绝）记录在dropped中，由popDropped取出，
+    最多保留max_dropped个。
+    '''
+    def __init__(self, window=None, min_window=1, max_window=8,
+            ack_timeout=1.0, alpha=0.5, beta=1.5, rtt_samples=300,
+            max_dropped=1024):
+        super(FrameCreditWindow, self).__init__()
+        self.is_adaptive = window is None
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = min(2, max_window) if window is None else window
+        self.ack_timeout = ack_timeout
+        self.alpha = alpha
+        self.beta = beta
+        # img_idx -> 发送时间，按发送先后排序
+        self.in_flight = collections.OrderedDict()
+        # 最近的往返时间（约10秒），用于估计min_rtt
+        self.rtts = collections.deque(maxlen=rtt_samples)
+        self.period_rtt_sum = 0
+        self.period_acks = 0
+        self.dropped = collections.deque(maxlen=max_dropped)
+        self.cond = threading.Condition()
+        self.stats = collections.Counter()
+
+    def hasCredit(self):
+        with self.cond:
+            self._expire(time.monotonic())
+            return len(self.in_flight) < self.window
+
+    def waitCredit(self, timeout=None):
+        '''等待可发送的信用，超时返回False'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if len(self.in_flight) < self.window:
+                    return True
+                # 最早发送的帧超时后也会归还信用
+                wait_time = next(iter(self.in_flight.values())) + \
+                        self.ack_timeout - now
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait_time = min(wait_time, deadline - now)
+                self.cond.wait(max(0, wait_time))
+
+    def onSend(self, img_idx, now=None):
+        '''记录已发送的帧，需在发送前调用，以免确认先于记录到达'''
+        now = time.monotonic() if now is None else now
+        with self.cond:
+            self.in_flight[img_idx] = now
+            self.stats['sent'] += 1
+
+    def ack(self, img_idx, now=None):
+        '''确认img_idx，返回是否为在途的帧（重复确认返回False）'''
+        now = time.monotonic() if now is None else now
+        with self.cond:
+            send_time = self.in_flight.pop(img_idx, None)
+            if send_time is None:
+                self.stats['dup_acks'] += 1
+                return False
+            self.stats['acks'] += 1
+            # 更早发送的帧已不会被确认
+            for idx in list(self.in_flight):
+                if diffImgIdx(idx, img_idx) >= 0:
+                    break
+                del self.in_flight[idx]
+                self.dropped.append(idx)
+                self.stats['losts'] += 1
+            rtt = now - send_time
+            self.rtts.append(rtt)
+            self.period_rtt_sum += rtt
+            self.period_acks += 1
+            if self.is_adaptive and self.period_acks >= self.window:
+                self._adjustWindow()
+            self.cond.notify_all()
+            return True
+
+    def reject(self, img_idx):
+        '''设备拒绝了img_idx（如忙时回复失败），归还信用但不作为往返时间样本，
+        自适应时窗口减1，返回是否为在途的帧'''
+        with self.cond:
+            if self.in_flight.pop(img_idx, None) is None:
+                return False
+            self.dropped.append(img_idx)
+            self.stats['rejects'] += 1
+            if self.is_adaptive and self.window > self.min_window:
+                self.window -= 1
+                self.stats['window_decs'] += 1
+                self.period_rtt_sum = 0
+                self.period_acks = 0
+            self.cond.notify_all()
+            return True
+
+    def _adjustWindow(self):
+        min_rtt = min(self.rtts)
+        rtt = self.period_rtt_sum / self.period_acks
+        self.period_rtt_sum = 0
+        self.period_acks = 0
+        if rtt <= 0:
+            return
+        queued = self.window * (1 - min_rtt / rtt)
+        if queued < self.alpha and self.window < self.max_window:
+            self.window += 1
+            self.stats['window_incs'] += 1
+        elif queued > self.beta and self.window > self.min_window:
+            self.window -= 1
+            self.stats['window_decs'] += 1
+
+    def expire(self, now=None):
+        '''使超时未确认的帧失效，返回失效帧的img_idx列表'''
+        now = time.monotonic() if now is None else now
+        with self.cond:
+            return self._expire(now)
+
+    def _expire(self, now):
+        expired = []
+        while self.in_flight:
+            idx, send_time = next(iter(self.in_flight.items()))
+            if now - send_time < self.ack_timeout:
+                break
+            del self.in_flight[idx]
+            expired.append(idx)
+        if expired:
+            self.dropped.extend(expired)
+            self.stats['timeouts'] += len(expired)
+            self.cond.notify_all()
+        return expired
+
+    def popDropped(self):
+        '''取出不会再被确认的帧的img_idx列表（丢失、超时或被拒绝），先使超时的帧失效'''
+        with self.cond:
+            self._expire(time.monotonic())
+            dropped = list(self.dropped)
+            self.dropped.clear()
+            return dropped
+
+    def getStats(self):
+        '''窗口大小、在途帧数、往返时间（秒）及发送、确认、丢失次数'''
+        with self.cond:
+            stats = dict(self.stats)
+            stats['window'] = self.window
+            stats['in_flight'] = len(self.in_flight)
+            if self.rtts:
+                stats['min_rtt'] = min(self.rtts)
+                stats['last_rtt'] = self.rtts[-1]
+        return stats
@@ -0,0 +1,186 @@
+#coding: utf-8
+'''按img_idx配对图片和Pose'''
+
+import time
+import queue
+import threading
+import collections
+
+from flow_control import diffImgIdx
+
+
+SyncResult = collections.namedtuple('SyncResult', ['img_idx', 'img', 'pose'])
+
+
+class SyncInputQueue(object):
+    '''FrameSynchronizer的输入端，提供生产者使用的Queue接口，put的数据为(img_idx, 数据)
+
+    不缓存数据：full()总是False，get_nowait()总是抛出queue.Empty；
+    阻塞模式下put超时抛出queue.Full。
+    '''
+    def __init__(self, synchronizer, is_img):
+        super(SyncInputQueue, self).__init__()
+        self.synchronizer = synchronizer
+        self.is_img = is_img
+        self.maxsize = synchronizer.max_frames
+
+    def put(self, item, block=True, timeout=None):
+        img_idx, data = item
+        if not self.synchronizer.put(self.is_img, img_idx, data, block,
+                timeout):
+            raise queue.Full
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def full(self):
+        return False
+
+    def empty(self):
+        return True
+
+    def get_nowait(self):
+        raise queue.Empty
+
+
+class FrameSynchronizer(object):
+    '''按img_idx（考虑uint32回绕）配对图片和Pose
+
+    图片和Pose各保留最近max_frames个未配对的数据。输出按img_idx顺序：
+    - 配对成功：SyncResult(img_idx, img, pose)
+    - 超时：等待超过timeout秒仍未配对，另一项为None
+    某帧配对成功时，更早的未配对数据（设备跳过的帧）直接丢弃，不再输出。
+
+    未取走的输出最多max_ready个。is_block为True时，输出已满则put阻塞（按顺序
+    显示每帧，如图片和视频输入源）；否则丢弃最早的输出（只显示最新的帧，如设备
+    摄像头）。丢弃的图片交给release_img处理（如归还缓冲区）。
+    '''
+    def __init__(self, max_frames=8, timeout=0.5, max_ready=1,
+            is_block=False, release_img=None):
+        super(FrameSynchronizer, self).__init__()
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.max_ready = max_ready
+        self.is_block = is_block
+        self.release_img = release_img
+        # img_idx -> (接收时间, 数据)，按接收先后排序
+        self.imgs = collections.OrderedDict()
+        self.poses = collections.OrderedDict()
+        self.ready = collections.deque()
+        # 最后输出的img_idx，更早的数据到达时直接丢弃
+        self.last_idx = None
+        self.cond = threading.Condition()
+        self.stats = collections.Counter()
+        self.img_queue = SyncInputQueue(self, True)
+        self.pose_queue = SyncInputQueue(self, False)
+
+    def getImgQueue(self):
+        return self.img_queue
+
+    def getPoseQueue(self):
+        return self.pose_queue
+
+    def put(self, is_img, img_idx, data, block=True, timeout=None):
+        '''放入图片或Pose，阻塞模式下超时返回False'''
+        with self.cond:
+            if self.is_block and block:
+                if not self.cond.wait_for(
+                        lambda: len(self.ready) < self.max_ready, timeout):
+                    return False
+            if self.last_idx is not None and \
+                    diffImgIdx(img_idx, self.last_idx) <= 0:
+                self.stats['late'] += 1
+                self._drop(is_img, data)
+                return True
+            items, others = (self.imgs, self.poses) if is_img else \
+                    (self.poses, self.imgs)
+            other = others.pop(img_idx, None)
+            if other is None:
+                old = items.pop(img_idx, None)
+                if old is not None:
+                    self._drop(is_img, old[1])
+                items[img_idx] = (time.monotonic(), data)
+                if len(items) > self.max_frames:
+                    _, (_, old_data) = items.popitem(last=False)
+                    self.stats['evicted'] += 1
+                    self._drop(is_img, old_data)
+                return True
+            # 配对成功，更早的数据不会再配对
+            self._skipBefore(img_idx)
+            img, pose = (data, other[1]) if is_img else (other[1], data)
+            self.stats['matched'] += 1
+            self._emit(SyncResult(img_idx, img, pose))
+            return True
+
+    def get(self, timeout=None):
+        '''取出下一个输出，timeout秒内没有时返回None'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if self.ready:
+                    result = self.ready.popleft()
+                    self.cond.notify_all()
+                    return result
+                # 等到有新的输出或最早的数据超时
+                wait_time = self._nextExpireTime()
+                if wait_time is not None:
+                    wait_time -= now
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait_time = deadline - now if wait_time is None else \
+                            min(wait_time, deadline - now)
+                self.cond.wait(None if wait_time is None else max(0, wait_time))
+
+    def getStats(self):
+        with self.cond:
+            stats = dict(self.stats)
+            stats['pending_imgs'] = len(self.imgs)
+            stats['pending_poses'] = len(self.poses)
+        return stats
+
+    def _drop(self, is_img, data):
+        if is_img and self.release_img is not None:
+            self.release_img(data)
+
+    def _emit(self, result):
+        self.last_idx = result.img_idx
+        self.ready.append(result)
+        while len(self.ready) > self.max_ready:
+            old = self.ready.popleft()
+            self.stats['ready_drops'] += 1
+            if old.img is not None:
+                self._drop(True, old.img)
+        self.cond.notify_all()
+
+    def _skipBefore(self, img_idx):
+        for is_img, items in [(True, self.imgs), (False, self.poses)]:
+            for idx in [x for x in items if diffImgIdx(x, img_idx) < 0]:
+                _, data = items.pop(idx)
+                self.stats['skipped'] += 1
+                self._drop(is_img, data)
+
+    def _nextExpireTime(self):
+        times = [next(iter(items.values()))[0] + self.timeout \
+                for items in [self.imgs, self.poses] if items]
+        return min(times) if times else None
+
+    def _expire(self, now):
+        '''按img_idx顺序输出超时未配对的数据，阻塞模式下不超过max_ready个'''
+        while not self.is_block or len(self.ready) < self.max_ready:
+            expired = [(idx, is_img) \
+                    for is_img, items in [(True, self.imgs), (False, self.poses)]
+                    for idx, (t, _) in items.items() if now - t > self.timeout]
+            if not expired:
+                return
+            # 最早的一个超时数据，以及在它之前的所有数据
+            img_idx = min(expired, key=lambda x: diffImgIdx(x[0],
+                    expired[0][0]))[0]
+            self._skipBefore(img_idx)
+            img = self.imgs.pop(img_idx, (None, None))[1]
+            pose = self.poses.pop(img_idx, (None, None))[1]
+            # pose为None时为等待Pose超时，否则为等待图片超时
+            self.stats['pose_timeouts' if pose is None else 'img_timeouts'] += 1
+            self._emit(SyncResult(img_idx, img, pose))
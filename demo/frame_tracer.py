@@ -0,0 +1,138 @@
+#coding: utf-8
+'''逐帧耗时跟踪
+
+每帧以img_idx为键，在流水线各环节的边界记录单调时钟时间点，相邻时间点之差为
+该阶段的耗时。各阶段保留最近的若干个耗时，用于统计p50/p95/p99；可选记录完成帧的
+事件，导出为Chrome trace格式（chrome://tracing 或 https://ui.perfetto.dev 打开）。
+'''
+
+import json
+import time
+import threading
+import collections
+import numpy as np
+
+
+# 时间点，按流水线顺序
+TRACE_POINTS = [
+    'read_start',       # 开始读取（摄像头/视频/图片文件）
+    'read',             # 读取完成，存入队列
+    'encode_start',     # 发送线程取出，开始编码
+    'encoded',          # JPEG编码完成
+    'sent',             # 发送完成
+    'recv',             # 收到Pose消息
+    'parsed',           # Pose解析完成
+    'show_start',       # 显示线程取出Pose，开始绘制
+    'shown',            # 显示完成
+]
+
+# 阶段：(名称, 开始时间点, 结束时间点)
+TRACE_STAGES = [
+    ('capture', 'read_start', 'read'),
+    ('read_queue', 'read', 'encode_start'),
+    ('encode', 'encode_start', 'encoded'),
+    ('send', 'encoded', 'sent'),
+    ('device', 'sent', 'recv'),         # 链路+设备推理
+    ('parse', 'recv', 'parsed'),
+    ('show_queue', 'parsed', 'show_start'),
+    ('draw', 'show_start', 'shown'),
+]
+
+
+class FrameTracer(object):
+    '''记录每帧各阶段的耗时
+
+    mark在各线程中调用，某阶段的结束时间点到达时记录该阶段的耗时；finish时记录
+    从第一个到最后一个时间点的总耗时（total），并移除该帧。未finish的帧（被丢弃的
+    帧）最多保留max_pending个，超出时移除最早的。
+
+    window: 每个阶段保留的最近耗时个数
+    max_events: 导出Chrome trace时最多保留的完成帧数，为0时不记录事件
+    '''
+    def __init__(self, window=300, max_pending=256, max_events=0):
+        super(FrameTracer, self).__init__()
+        self.window = window
+        self.max_pending = max_pending
+        self.start_time = time.monotonic()
+        # img_idx -> {时间点: 时间}
+        self.traces = collections.OrderedDict()
+        self.durations = {name: collections.deque(maxlen=window) \
+                for name, _, _ in TRACE_STAGES + [('total', None, None)]}
+        self.events = collections.deque(maxlen=max_events) \
+                if max_events > 0 else None
+        # 结束时间点 -> [(阶段名称, 开始时间点)]
+        self.stages_by_end = collections.defaultdict(list)
+        for name, start, end in TRACE_STAGES:
+            self.stages_by_end[end].append((name, start))
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.observer = None
+
+    def setObserver(self, observer):
+        '''observer(阶段名称, 耗时)在记录每个耗时时调用（持有锁），应尽快返回'''
+        self.observer = observer
+
+    def mark(self, img_idx, point, t=None):
+        '''记录img_idx到达point的时间'''
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            trace = self.traces.get(img_idx)
+            if trace is None:
+                trace = self.traces[img_idx] = {}
+                if len(self.traces) > self.max_pending:
+                    self.traces.popitem(last=False)
+                    self.stats['evicted'] += 1
+            trace[point] = t
+            for name, start in self.stages_by_end.get(point, ()):
+                start_time = trace.get(start)
+                if start_time is not None:
+                    self.durations[name].append(t - start_time)
+                    if self.observer is not None:
+                        self.observer(name, t - start_time)
+
+    def finish(self, img_idx):
+        '''该帧已处理完成'''
+        with self.lock:
+            trace = self.traces.pop(img_idx, None)
+            if not trace:
+                return
+            self.stats['finished'] += 1
+            times = trace.values()
+            total = max(times) - min(times)
+            self.durations['total'].append(total)
+            if self.observer is not None:
+                self.observer('total', total)
+            if self.events is not None:
+                self.events.append((img_idx, trace))
+
+    def getStats(self):
+        '''各阶段最近耗时的个数和分位数（毫秒），没有数据的阶段不列出'''
+        with self.lock:
+            durations = {name: np.array(d) * 1000 \
+                    for name, d in self.durations.items() if d}
+        stats = {}
+        for name, d in durations.items():
+            p50, p95, p99 = np.percentile(d, [50, 95, 99])
+            stats[name] = {'count': len(d), 'p50_ms': round(float(p50), 3),
+                    'p95_ms': round(float(p95), 3),
+                    'p99_ms': round(float(p99), 3)}
+        return stats
+
+    def getChromeTrace(self):
+        '''把记录的完成帧转为Chrome trace异步事件，每帧（id为img_idx）一行'''
+        with self.lock:
+            events = list(self.events or [])
+        trace_events = []
+        for img_idx, trace in events:
+            for name, start, end in TRACE_STAGES:
+                if start not in trace or end not in trace:
+                    continue
+                for ph, t in [('b', trace[start]), ('e', trace[end])]:
+                    trace_events.append({'name': name, 'cat': 'frame',
+                            'ph': ph, 'id': img_idx, 'pid': 0, 'tid': 0,
+                            'ts': round((t - self.start_time) * 1e6, 1)})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def saveChromeTrace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.getChromeTrace(), f)
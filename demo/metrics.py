@@ -0,0 +1,230 @@
+#coding: utf-8
+'''运行指标
+
+计数器、仪表和直方图，通过本地HTTP端口以Prometheus文本格式提供（GET /metrics）。
+
+热路径上只做整数加法（每个指标只由一个线程更新，不加锁）；已有统计（如
+MsgUdpHandler.getRecvStats）用func在抓取时读取，不增加热路径开销。
+'''
+
+import bisect
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 默认直方图分桶（秒），覆盖0.5ms~2s的延迟
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+        0.5, 1.0, 2.0)
+
+
+def formatLabels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+            .replace('"', '\\"').replace('\n', '\\n')) for k, v in items)
+
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class Counter(object):
+    '''只增的计数，func不为None时在抓取时调用func获取值'''
+    TYPE = 'counter'
+
+    def __init__(self, name, help, labels=None, func=None):
+        super(Counter, self).__init__()
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.func = func
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def get(self):
+        return self.value if self.func is None else self.func()
+
+    def collect(self):
+        value = self.get()
+        if value is None:
+            return []
+        return [(self.name, self.labels, value)]
+
+
+class Gauge(Counter):
+    '''可增可减的值'''
+    TYPE = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, n=1):
+        self.value -= n
+
+
+class Histogram(object):
+    '''按分桶统计观测值的分布'''
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__()
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = sorted(buckets)
+        # 最后一个为+Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def collect(self):
+        samples = []
+        cum = 0
+        for le, n in zip(self.buckets + [float('inf')], list(self.counts)):
+            cum += n
+            samples.append((self.name + '_bucket', dict(self.labels,
+                    le=formatValue(float(le))), cum))
+        samples.append((self.name + '_sum', self.labels, float(self.sum)))
+        samples.append((self.name + '_count', self.labels, cum))
+        return samples
+
+
+class MetricsRegistry(object):
+    '''指标注册表，同名、不同标签的指标属于同一组'''
+    def __init__(self):
+        super(MetricsRegistry, self).__init__()
+        # name -> [metric]
+        self.metrics = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            family = self.metrics.setdefault(metric.name, [])
+            if family and family[0].TYPE != metric.TYPE:
+                raise ValueError("Metric '%s' registered as %s" % (
+                        metric.name, family[0].TYPE))
+            family.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=None, func=None):
+        return self.register(Counter(name, help, labels, func))
+
+    def gauge(self, name, help, labels=None, func=None):
+        return self.register(Gauge(name, help, labels, func))
+
+    def histogram(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        '''Prometheus文本格式'''
+        with self.lock:
+            families = [(name, list(family)) \
+                    for name, family in self.metrics.items()]
+        lines = []
+        for name, family in families:
+            lines.append('# HELP %s %s' % (name, family[0].help))
+            lines.append('# TYPE %s %s' % (name, family[0].TYPE))
+            for metric in family:
+                try:
+                    samples = metric.collect()
+                except Exception as e:
+                    print("WARN: collect metric %s failed: %s" % (name, e))
+                    continue
+                for sample_name, labels, value in samples:
+                    lines.append('%s%s %s' % (sample_name,
+                            formatLabels(labels), formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    '''在后台线程中提供GET /metrics，默认只监听本机'''
+    def __init__(self, registry:MetricsRegistry, port, host='127.0.0.1'):
+        super(MetricsServer, self).__init__()
+        self.registry = registry
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ['/', '/metrics']:
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type',
+                        'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                daemon=True)
+
+    def getAddr(self):
+        return self.httpd.server_address
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def join(self):
+        self.thread.join()
+
+
+class TemperaturePoller(threading.Thread):
+    '''定期通过DevAgent.getTemperature获取设备温度，设置到gauge
+
+    获取失败时gauge为None（抓取时不输出）。
+    '''
+    def __init__(self, dev_agent, gauge:Gauge, interval=10.):
+        super(TemperaturePoller, self).__init__(daemon=True)
+        self.dev_agent = dev_agent
+        self.gauge = gauge
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.gauge.set(self.dev_agent.getTemperature())
+            except Exception as e:
+                print("WARN: get temperature failed: %s" % e)
+                self.gauge.set(None)
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def observeTracer(registry:MetricsRegistry, tracer,
+        name='hpose_stage_latency_seconds', buckets=DEFAULT_BUCKETS):
+    '''为FrameTracer的每个阶段创建直方图（标签stage），记录其耗时'''
+    histograms = {}
+    def _observe(stage, duration):
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = registry.histogram(name,
+                    'Per-frame latency of each pipeline stage',
+                    {'stage': stage}, buckets)
+        histogram.observe(duration)
+    tracer.setObserver(_observe)
+    return histograms
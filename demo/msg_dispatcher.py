@@ -0,0 +1,104 @@
+#coding: utf-8
+
+import threading
+import collections
+from concurrent.futures import Future
+from msg_udp_handler import MsgUdpHandler, MSG_CMD_STRUCT, MSG_CMD_BYTES
+
+
+class MsgDispatcher(threading.Thread):
+    '''消息分发线程
+
+    独占MsgUdpHandler的接收，每条消息只解析一次cmd，然后按cmd交给注册的处理函数
+    或等待该cmd的Future。控制请求的回复和数据流可以共用一个socket，在接收数据流时
+    也能进行控制请求，互不抢占消息。
+
+    处理函数在分发线程中调用，参数为消息，需尽快返回；消息缓冲区由处理函数负责
+    归还（msg_handler.freeMsg）。处理函数抛出的异常（如回复解析失败）被打印并计数，
+    不会终止分发线程。
+    '''
+    def __init__(self, msg_handler:MsgUdpHandler, recv_timeout=0.2):
+        super(MsgDispatcher, self).__init__(daemon=True)
+        self.msg_handler = msg_handler
+        self.recv_timeout = recv_timeout
+        self.is_running = False
+        # cmd -> handler(msg)
+        self.handlers = {}
+        # cmd -> [Future]，等待下一条该cmd的消息
+        self.waiters = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        # 已打印过警告的未知cmd，每个cmd只打印一次
+        self.unknown_cmds = set()
+
+    def isRunning(self):
+        return self.is_running
+
+    def start(self):
+        self.is_running = True
+        super(MsgDispatcher, self).start()
+
+    def stop(self):
+        self.is_running = False
+
+    def setHandler(self, cmd, handler):
+        '''注册cmd的处理函数，handler为None时取消注册'''
+        with self.lock:
+            if handler is None:
+                self.handlers.pop(cmd, None)
+            else:
+                self.handlers[cmd] = handler
+
+    def expectMsg(self, cmd):
+        '''返回Future，结果为下一条cmd对应的消息（优先于处理函数）'''
+        future = Future()
+        with self.lock:
+            self.waiters[cmd].append(future)
+        return future
+
+    def cancelExpect(self, future):
+        with self.lock:
+            for waiters in self.waiters.values():
+                if future in waiters:
+                    waiters.remove(future)
+                    return True
+        return False
+
+    def run(self):
+        while self.is_running:
+            msg = self.msg_handler.recvMsg(self.recv_timeout)
+            if msg is None:
+                continue
+            self.dispatch(msg)
+
+    def dispatch(self, msg):
+        payload = msg['payload']
+        if len(payload) < MSG_CMD_BYTES:
+            self.stats['invalid_msgs'] += 1
+            self.msg_handler.freeMsg(msg)
+            return
+        cmd = MSG_CMD_STRUCT.unpack_from(payload)[0]
+        self.stats[cmd] += 1
+        with self.lock:
+            waiters = self.waiters.get(cmd)
+            future = waiters.popleft() if waiters else None
+            handler = self.handlers.get(cmd) if future is None else None
+        if future is not None:
+            future.set_result(msg)
+        elif handler is not None:
+            try:
+                handler(msg)
+            except Exception as e:
+                print("WARN: Handle cmd 0x%04x failed: %r" % (cmd, e))
+                self.stats['handler_errors'] += 1
+        else:
+            if cmd not in self.unknown_cmds:
+                self.unknown_cmds.add(cmd)
+                print("WARN: Unknown cmd: 0x%04x" % cmd)
+            self.stats['unknown_msgs'] += 1
+            self.msg_handler.freeMsg(msg)
+
+    def getStats(self):
+        '''各cmd收到的消息个数，以及未知/无效消息和处理失败的个数；未知cmd的警告
+        只打印一次，之后只计数'''
+        return dict(self.stats)
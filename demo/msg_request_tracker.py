@@ -0,0 +1,126 @@
+#coding: utf-8
+
+import time
+import threading
+import collections
+from concurrent.futures import Future
+
+
+def mapFuture(future, func, future_factory=Future):
+    '''返回一个新的Future，结果为func(future.result())；future或func抛出的异常
+    设置到新的Future上'''
+    new_future = future_factory()
+    def _done(f):
+        if new_future.done():
+            return
+        if f.cancelled():
+            new_future.cancel()
+            return
+        try:
+            result = func(f.result())
+        except Exception as e:
+            new_future.set_exception(e)
+            return
+        new_future.set_result(result)
+    future.add_done_callback(_done)
+    return new_future
+
+
+class MsgRequestTracker(object):
+    '''请求跟踪器
+
+    记录已发送、等待回复的请求，按回复中的req_msg_id完成对应请求的Future，每个
+    请求单独超时。迟到的或未知的回复只计数并丢弃，不会影响后续请求。
+
+    设备回复的req_msg_id为0时可能是旧固件未填写，不能只按msg_id匹配：给出key时，
+    按key匹配最早发送的同类请求（包括msg_id为0的请求）。
+    '''
+    def __init__(self, default_timeout=1.0, future_factory=Future):
+        super(MsgRequestTracker, self).__init__()
+        self.default_timeout = default_timeout
+        self.future_factory = future_factory
+        # msg_id -> request，按发送先后排序
+        self.requests = collections.OrderedDict()
+        self.stats = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, msg_id, key=None, timeout=None, parse=None,
+            timeout_result=None):
+        '''添加请求，返回Future
+
+        parse: 对回复的处理函数，其返回值作为Future的结果，为None时结果为回复本身
+        timeout_result: 超时时Future的结果
+        '''
+        timeout = self.default_timeout if timeout is None else timeout
+        future = self.future_factory()
+        request = {
+            'key'           : key,
+            'future'        : future,
+            'deadline'      : time.monotonic() + timeout,
+            'parse'         : parse,
+            'timeout_result': timeout_result,
+        }
+        with self.lock:
+            self.requests[msg_id] = request
+            self.stats['requests'] += 1
+        return future
+
+    def resolve(self, req_msg_id, rsp, key=None):
+        '''用回复完成请求，找不到对应请求时返回False'''
+        with self.lock:
+            if req_msg_id == 0 and key is not None:
+                request = None
+                for msg_id, r in self.requests.items():
+                    if r['key'] == key:
+                        request = self.requests.pop(msg_id)
+                        break
+            else:
+                request = self.requests.pop(req_msg_id, None)
+            if request is None:
+                self.stats['unmatched_rsps'] += 1
+                return False
+            self.stats['rsps'] += 1
+        parse = request['parse']
+        result = rsp if parse is None else parse(rsp)
+        if not request['future'].done():
+            request['future'].set_result(result)
+        return True
+
+    def expire(self, now=None):
+        '''使超时的请求以timeout_result完成，返回超时请求的个数'''
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            for msg_id, request in list(self.requests.items()):
+                if request['deadline'] <= now:
+                    expired.append(self.requests.pop(msg_id))
+            self.stats['timeouts'] += len(expired)
+        for request in expired:
+            if not request['future'].done():
+                request['future'].set_result(request['timeout_result'])
+        return len(expired)
+
+    def discard(self, future):
+        '''放弃等待future对应的请求，之后到达的回复将被丢弃'''
+        with self.lock:
+            for msg_id, request in self.requests.items():
+                if request['future'] is future:
+                    del self.requests[msg_id]
+                    self.stats['timeouts'] += 1
+                    return True
+        return False
+
+    def getNextDeadline(self):
+        '''最早超时的请求的截止时间，没有请求时返回None'''
+        with self.lock:
+            if not self.requests:
+                return None
+            return min(r['deadline'] for r in self.requests.values())
+
+    def getPendingNum(self):
+        return len(self.requests)
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self.requests)
+        return stats
@@ -1,6 +1,10 @@
+import copy
+import time
 import socket
+import threading
 import struct
-import select
+import selectors
+import collections
 import msg_pb2
 
 
@@ -9,6 +13,12 @@ FRAME_HEAD_BYTES  = 4*4
 MSG_CMD_FORMAT    = 'H'
 MSG_CMD_BYTES     = 2
 
+# IPv4 UDP数据报负载的最大字节数
+UDP_PAYLOAD_MAX_BYTES = 65507
+
+FRAME_HEAD_STRUCT = struct.Struct(FRAME_HEAD_FORMAT)
+MSG_CMD_STRUCT    = struct.Struct(MSG_CMD_FORMAT)
+
 
 def MSG_GET_CMD_RESPONS(cmd):
     return cmd | 0x8000
@@ -22,8 +32,8 @@ def printFrameHead(frame_head):
 
 
 def parseMsgFrameHead(buf, idx_start=0):
-    idx_end = idx_start + 16
-    values = struct.unpack(FRAME_HEAD_FORMAT, buf[idx_start:idx_end])
+    idx_end = idx_start + FRAME_HEAD_BYTES
+    values = FRAME_HEAD_STRUCT.unpack_from(buf, idx_start)
     frame_head = {
         'frame_len'  : values[0],
         'frame_idx'  : values[1],
@@ -33,15 +43,209 @@ def parseMsgFrameHead(buf, idx_start=0):
     return frame_head, idx_end
 
 
+class MsgBufferPool(object):
+    '''消息缓冲区池
+
+    复用重组消息用的bytearray，避免每条消息都重新分配大块内存。
+    '''
+    def __init__(self, max_free_bufs=8):
+        super(MsgBufferPool, self).__init__()
+        self.max_free_bufs = max_free_bufs
+        self.free_bufs = []
+
+    def get(self, size):
+        '''获取容量不小于size的缓冲区，优先复用容量最小的空闲缓冲区'''
+        best_i = None
+        for i, buf in enumerate(self.free_bufs):
+            if len(buf) >= size and \
+                    (best_i is None or len(buf) < len(self.free_bufs[best_i])):
+                best_i = i
+        if best_i is None:
+            return bytearray(size)
+        return self.free_bufs.pop(best_i)
+
+    def put(self, buf):
+        if buf is None or len(self.free_bufs) >= self.max_free_bufs:
+            return
+        self.free_bufs.append(buf)
+
+
+class MsgReassembler(object):
+    '''消息重组器
+
+    按msg_id缓存未接收完整的消息，按frame_idx把分帧直接写入预分配的缓冲区，允许
+    不同消息的分帧交错和分帧乱序。未完成的消息表有上限，超时、超长或超出上限的
+    消息会被丢弃并计数。
+
+    返回的消息中payload为缓冲区的memoryview，使用完后可调用freeMsg归还缓冲区；
+    不归还时缓冲区由GC回收，不会被复用。
+
+    frame_payload_max_bytes为接收的每帧负载的上限，超过的帧视为无效。
+    '''
+    def __init__(self,
+            frame_payload_max_bytes,
+            payload_max_bytes=1024*1024*16,
+            max_partial_msgs=8,
+            partial_timeout=1.0,
+            buf_pool:MsgBufferPool=None):
+        super(MsgReassembler, self).__init__()
+        self.frame_payload_max_bytes = frame_payload_max_bytes
+        self.payload_max_bytes = payload_max_bytes
+        self.max_partial_msgs = max_partial_msgs
+        self.partial_timeout = partial_timeout
+        self.buf_pool = MsgBufferPool() if buf_pool is None else buf_pool
+        self.frame_total_max = -(-payload_max_bytes // frame_payload_max_bytes)
+        # msg_id -> 未完成的消息，按首帧到达的先后排序
+        self.partials = collections.OrderedDict()
+        self.stats = collections.Counter()
+
+    def reset(self):
+        for msg_id in list(self.partials):
+            self.dropPartial(msg_id)
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['partial_msgs'] = len(self.partials)
+        return stats
+
+    def freeMsg(self, msg):
+        '''归还消息的缓冲区，调用后不可再访问msg['payload']'''
+        buf = msg.pop('buf', None)
+        if buf is not None:
+            msg['payload'].release()
+            self.buf_pool.put(buf)
+
+    def _makeMsg(self, frame_head, buf, payload_bytes):
+        return {
+            'last_frame_head': frame_head,
+            'payload': memoryview(buf)[:payload_bytes],
+            'buf': buf,
+        }
+
+    def addFrame(self, frame_head, frame_payload, now=None):
+        '''添加一帧，消息接收完整时返回消息，否则返回None
+
+        frame_payload 可以是接收缓冲区的memoryview，数据会被复制到消息缓冲区，
+        调用返回后即可复用接收缓冲区。
+        '''
+        now = time.monotonic() if now is None else now
+        self.stats['frames'] += 1
+        self.expire(now)
+        msg_id = frame_head['msg_id']
+        frame_idx = frame_head['frame_idx']
+        frame_total = frame_head['frame_total']
+        frame_payload_bytes = len(frame_payload)
+        # 检查帧头
+        if frame_total == 0 or frame_total > self.frame_total_max or \
+                frame_idx == 0 or frame_idx > frame_total or \
+                frame_payload_bytes > self.frame_payload_max_bytes:
+            self.stats['invalid_frames'] += 1
+            return None
+        # 只有一帧的消息无需缓存
+        if frame_total == 1:
+            buf = self.buf_pool.get(frame_payload_bytes)
+            buf[:frame_payload_bytes] = frame_payload
+            self.stats['msgs'] += 1
+            return self._makeMsg(frame_head, buf, frame_payload_bytes)
+
+        partial = self.partials.get(msg_id)
+        if partial is not None and partial['frame_total'] != frame_total:
+            # msg_id相同但帧总数不同，旧消息已不可能完整
+            self.dropPartial(msg_id)
+            partial = None
+        if partial is None:
+            if len(self.partials) >= self.max_partial_msgs:
+                self.dropPartial(next(iter(self.partials)))
+            buf = self.buf_pool.get(frame_total * self.frame_payload_max_bytes)
+            partial = {
+                'frame_total'  : frame_total,
+                'buf'          : buf,
+                'view'         : memoryview(buf),
+                'recv_flags'   : bytearray(frame_total),
+                'recv_num'     : 0,
+                # 发送方每帧负载的字节数（除最后一帧外各帧相同），收到非最后一帧时确定
+                'stride'       : None,
+                # 在stride确定前收到的最后一帧
+                'last_payload' : None,
+                'payload_bytes': None,
+                'first_time'   : now,
+                'last_frame_head': None,
+            }
+            self.partials[msg_id] = partial
+
+        if partial['recv_flags'][frame_idx-1]:
+            self.stats['duplicate_frames'] += 1
+            return None
+        stride = partial['stride']
+        if frame_idx < frame_total:
+            if stride is None:
+                stride = partial['stride'] = frame_payload_bytes
+            elif frame_payload_bytes != stride:
+                self.stats['invalid_frames'] += 1
+                return None
+        partial['recv_flags'][frame_idx-1] = 1
+        partial['recv_num'] += 1
+        # 将负载写入消息缓冲区
+        view = partial['view']
+        if frame_idx < frame_total:
+            offset = (frame_idx - 1) * stride
+            view[offset:offset+stride] = frame_payload
+        else:
+            partial['last_frame_head'] = frame_head
+            if stride is None:
+                partial['last_payload'] = bytes(frame_payload)
+            else:
+                self._putLastPayload(partial, frame_payload)
+        if partial['last_payload'] is not None and stride is not None:
+            self._putLastPayload(partial, partial['last_payload'])
+            partial['last_payload'] = None
+        # 判断消息接收完毕
+        if partial['recv_num'] < frame_total:
+            return None
+        del self.partials[msg_id]
+        partial['view'].release()
+        self.stats['msgs'] += 1
+        return self._makeMsg(partial['last_frame_head'], partial['buf'],
+                partial['payload_bytes'])
+
+    def _putLastPayload(self, partial, frame_payload):
+        offset = (partial['frame_total'] - 1) * partial['stride']
+        partial['payload_bytes'] = offset + len(frame_payload)
+        partial['view'][offset:partial['payload_bytes']] = frame_payload
+
+    def expire(self, now=None):
+        '''丢弃超时未接收完整的消息'''
+        now = time.monotonic() if now is None else now
+        while self.partials:
+            msg_id, partial = next(iter(self.partials.items()))
+            if now - partial['first_time'] < self.partial_timeout:
+                break
+            self.stats['timeout_msgs'] += 1
+            self.dropPartial(msg_id)
+
+    def dropPartial(self, msg_id):
+        partial = self.partials.pop(msg_id)
+        partial['view'].release()
+        self.buf_pool.put(partial['buf'])
+        self.stats['dropped_msgs'] += 1
+        self.stats['dropped_frames'] += partial['recv_num']
+
+
 class MsgUdpHandler(object):
     def __init__(self,
             net_local_addr,
             net_target_addr,
             socket_timeout=0,
             frame_max_bytes=65000,
-            payload_max_bytes=1024*1024*16):
+            payload_max_bytes=1024*1024*16,
+            max_partial_msgs=8,
+            partial_timeout=1.0,
+            recv_ring_size=32,
+            recv_buf_bytes=None):
         super(MsgUdpHandler, self).__init__()
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if recv_buf_bytes is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buf_bytes)
         sock.bind(net_local_addr)
         self.sock = sock
         self.is_specific_target = net_target_addr != None
@@ -51,44 +255,115 @@ class MsgUdpHandler(object):
         self.frame_payload_max_bytes = frame_max_bytes - FRAME_HEAD_BYTES
         self.payload_max_bytes = payload_max_bytes
         self.msg_id = 0
+        self.has_sendmsg = hasattr(sock, 'sendmsg')
+        # 同一目标的消息分帧不能交错，多线程发送时需加锁
+        self.send_lock = threading.Lock()
+        # 对方的分帧大小可能与frame_max_bytes不同，接收时按UDP数据报的上限检查
+        self.reassembler = MsgReassembler(
+                UDP_PAYLOAD_MAX_BYTES - FRAME_HEAD_BYTES,
+                payload_max_bytes, max_partial_msgs, partial_timeout)
+        # 接收缓冲区环，每次唤醒时把内核中就绪的数据报全部读到这里，再由重组器
+        # 复制到消息缓冲区
+        self.recv_ring = [bytearray(65536) for _ in range(max(1, recv_ring_size))]
+        self.recv_ring_views = [memoryview(buf) for buf in self.recv_ring]
+        self.recv_ring_lens = [0] * len(self.recv_ring)
+        # 已接收完整、等待recvMsg取走的消息
+        self.ready_msgs = collections.deque()
+        self.recv_stats = collections.Counter()
+        # 后续数据报以非阻塞方式读取，socket本身保持阻塞，避免发送时EAGAIN
+        self.recv_nowait_flags = getattr(socket, 'MSG_DONTWAIT', None)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def fork(self, net_target_addr):
+        '''返回共用同一socket、发送到net_target_addr的handler
+
+        新handler有独立的消息ID和发送锁，只用于发送；接收仍由原handler（或分发
+        线程）负责。
+        '''
+        handler = copy.copy(self)
+        handler.is_specific_target = True
+        handler.net_target_addr = net_target_addr
+        handler.msg_id = 0
+        handler.send_lock = threading.Lock()
+        return handler
 
     def sendData(self, data):
         self.sock.sendto(data, self.net_target_addr)
 
-    def sendMsg(self, cmd, proto_obj=None):
+    def sendDataBufs(self, bufs):
+        '''将多个缓冲区作为一个数据报发送，支持sendmsg的平台上不拼接数据'''
+        if self.has_sendmsg:
+            self.sock.sendmsg(bufs, (), 0, self.net_target_addr)
+        else:
+            self.sock.sendto(b''.join(bufs), self.net_target_addr)
+
+    def sendMsg(self, cmd, proto_obj=None, on_send=None):
         # 负载序列化
         payload = b'' if proto_obj is None else proto_obj.SerializeToString()
-        payload = struct.pack(MSG_CMD_FORMAT, cmd) + payload
+        return self.sendMsgBufs(cmd, [payload], on_send)
+
+    def sendMsgBufs(self, cmd, bufs, on_send=None):
+        '''发送消息，消息负载由bufs中的缓冲区依次拼接而成
+
+        bufs 中可以是bytes、bytearray、memoryview或numpy数组等支持缓冲区协议的
+        对象，分帧时只切分memoryview，不复制负载。返回消息ID。
+        on_send: 发送第一帧前以消息ID调用，用于在回复到达前登记请求
+        '''
+        views = [memoryview(MSG_CMD_STRUCT.pack(cmd))]
+        for buf in bufs:
+            view = memoryview(buf)
+            if view.ndim != 1 or view.itemsize != 1:
+                view = view.cast('B')
+            if view.nbytes > 0:
+                views.append(view)
         # 计算帧数
-        frame_total = self.calcMsgFrameNum(len(payload))
+        total_bytes = sum(view.nbytes for view in views)  # 负载总字节数
+        frame_total = self.calcMsgFrameNum(total_bytes)
+        with self.send_lock:
+            msg_id = self.msg_id
+            self.msg_id = (self.msg_id + 1) & 0xFFFFFFFF
+            if on_send is not None:
+                on_send(msg_id)
+            self._sendFrames(views, total_bytes, frame_total, msg_id)
+        return msg_id
+
+    def _sendFrames(self, views, total_bytes, frame_total, msg_id):
         # 分段发送消息
-        total_bytes     = len(payload)  # 负载总字节数
-        send_bytes      = 0             # 已发送负载的字节数
+        view_idx  = 0  # 当前缓冲区下标
+        view_pos  = 0  # 当前缓冲区已发送的字节数
         for i in range(frame_total):
-            # 负载剩余的字节数
-            remain_bytes = total_bytes - send_bytes
             # 当前帧可发送负载的字节数
-            frame_payload_bytes = min(remain_bytes, self.frame_payload_max_bytes)
-            # 发送一帧数据
-            frame_head = struct.pack('IIII',
+            frame_payload_bytes = min(total_bytes, self.frame_payload_max_bytes)
+            total_bytes -= frame_payload_bytes
+            frame_head = FRAME_HEAD_STRUCT.pack(
                     FRAME_HEAD_BYTES+frame_payload_bytes,  # 当前帧长度
                     i+1,          # 帧序号
                     frame_total,  # 帧总数
-                    self.msg_id,  # 消息ID
+                    msg_id,       # 消息ID
                     )
-            frame = frame_head + payload[send_bytes:send_bytes+frame_payload_bytes]
-            self.sendData(frame)
-            send_bytes += frame_payload_bytes
-        self.msg_id += 1
+            # 收集当前帧的负载片段
+            frame_bufs = [frame_head]
+            while frame_payload_bytes > 0:
+                view = views[view_idx]
+                n = min(view.nbytes - view_pos, frame_payload_bytes)
+                frame_bufs.append(view[view_pos:view_pos+n])
+                frame_payload_bytes -= n
+                view_pos += n
+                if view_pos == view.nbytes:
+                    view_idx += 1
+                    view_pos = 0
+            # 发送一帧数据
+            self.sendDataBufs(frame_bufs)
 
     def sendRspMsg(self, cmd, proto_obj):
         cmd = MSG_GET_CMD_RESPONS(cmd)
-        self.sendMsg(cmd, proto_obj)
+        return self.sendMsg(cmd, proto_obj)
 
-    def sendSetPropMsg(self, proto_obj):
-        self.sendMsg(msg_pb2.MSG_CMD_SET_PROPERTY, proto_obj)
+    def sendSetPropMsg(self, proto_obj, on_send=None):
+        return self.sendMsg(msg_pb2.MSG_CMD_SET_PROPERTY, proto_obj, on_send)
 
-    def sendGetPropMsg(self, prop_id, **args):
+    def sendGetPropMsg(self, prop_id, on_send=None, **args):
         req = msg_pb2.ReqGetProp()
         req.prop_id = prop_id
         for k in args:
@@ -98,58 +373,91 @@ class MsgUdpHandler(object):
                 for _k in v:
                     setattr(proto_v, _k, v[_k])
             else:
-                setattr(proto_v, k, v)
-        self.sendMsg(msg_pb2.MSG_CMD_GET_PROPERTY, req)
+                setattr(req, k, v)
+        return self.sendMsg(msg_pb2.MSG_CMD_GET_PROPERTY, req, on_send)
 
     def recvMsg(self, timeout=None):
+        if self.ready_msgs:
+            return self.ready_msgs.popleft()
         timeout = self.socket_timeout if timeout is None else timeout
-        last_frame_head = None
-        payload = b''
-        is_first = True
+        # timeout为None时一直等待
+        time_end = None if timeout is None else time.monotonic() + timeout
 
         while True:
             # print("INFO: waitting to recv...")
-            rd_list, _, _ = select.select([self.sock], [], [], timeout)
-            if self.sock not in rd_list:
+            remain_time = None if time_end is None else \
+                    max(0, time_end - time.monotonic())
+            if not self.selector.select(remain_time):
                 # print(f"WARN: recv timeout({timeout}s)")
                 return None
-            buf, addr_client = self.sock.recvfrom(65536)
-            if not self.is_specific_target:
-                self.net_target_addr = addr_client
-            # print(f"INFO: recv bytes: {len(buf)}")
-            # 这里省去 buf 的检查
-            frame_head, idx_start = parseMsgFrameHead(buf)
-            # printFrameHead(frame_head)
+            self.recvFrames()
+            if self.ready_msgs:
+                return self.ready_msgs.popleft()
 
-            if is_first:
-                is_first = False
-                if frame_head['frame_idx'] != 1:
-                    print("ERROR: first frame idx not 1")
-                    return
-                if frame_head['frame_total'] == 0:
-                    print("ERROR: frame_total wes 0")
-                    return
-            else:
-                if frame_head['msg_id'] != last_frame_head['msg_id'] or \
-                    frame_head['frame_total'] != last_frame_head['frame_total'] or \
-                    frame_head['frame_idx'] != last_frame_head['frame_idx'] + 1:
-                    print("ERROR: frame head wes mismatch last frame head."
-                        f"msg_id({frame_head['msg_id']}, {last_frame_head['msg_id']}) "
-                        f"frame_total({frame_head['frame_total']}, {last_frame_head['frame_total']}) "
-                        f"frame_idx({frame_head['frame_idx']}, {last_frame_head['frame_idx']})")
-                    return
-            last_frame_head = frame_head
-            payload += buf[idx_start:]
-            if len(payload) > self.payload_max_bytes:
-                print(f"ERROR: payload({len(payload)}bytes) too long.")
-            # 判断消息接收完毕
-            if frame_head['frame_idx'] == frame_head['frame_total']:
+    def _recvFrameNowait(self, buf):
+        if self.recv_nowait_flags is not None:
+            try:
+                return self.sock.recvfrom_into(buf, 0, self.recv_nowait_flags)
+            except (BlockingIOError, InterruptedError):
+                return None
+        if not self.selector.select(0):
+            return None
+        return self.sock.recvfrom_into(buf)
+
+    def recvFrames(self):
+        '''读取socket中所有就绪的数据报（最多一环），并交给重组器
+
+        调用前socket应处于可读状态。返回读取的数据报个数。
+        '''
+        ring = self.recv_ring
+        ring_lens = self.recv_ring_lens
+        # 先尽快把内核缓冲区中的数据报读出，避免内核缓冲区溢出
+        recv_num = 0
+        recv_bytes, addr_client = self.sock.recvfrom_into(ring[0])
+        while True:
+            ring_lens[recv_num] = recv_bytes
+            recv_num += 1
+            if recv_num == len(ring):
+                self.recv_stats['ring_full'] += 1
                 break
-        msg = {
-            'last_frame_head': last_frame_head,
-            'payload': payload
-        }
-        return msg
+            ret = self._recvFrameNowait(ring[recv_num])
+            if ret is None:
+                break
+            recv_bytes, addr_client = ret
+        if not self.is_specific_target:
+            self.net_target_addr = addr_client
+        self.recv_stats['wakeups'] += 1
+        self.recv_stats['datagrams'] += recv_num
+        self.recv_stats['max_batch'] = max(self.recv_stats['max_batch'],
+                recv_num)
+        # 解析帧头，重组消息
+        now = time.monotonic()
+        for i in range(recv_num):
+            recv_bytes = ring_lens[i]
+            self.recv_stats['bytes'] += recv_bytes
+            # print(f"INFO: recv bytes: {recv_bytes}")
+            if recv_bytes < FRAME_HEAD_BYTES:
+                print(f"WARN: frame({recv_bytes}bytes) too short.")
+                self.recv_stats['short_datagrams'] += 1
+                continue
+            frame_head, idx_start = parseMsgFrameHead(ring[i])
+            # printFrameHead(frame_head)
+            msg = self.reassembler.addFrame(frame_head,
+                    self.recv_ring_views[i][idx_start:recv_bytes], now)
+            if msg is not None:
+                self.ready_msgs.append(msg)
+        return recv_num
+
+    def freeMsg(self, msg):
+        '''归还recvMsg返回的消息缓冲区，调用后不可再访问msg['payload']'''
+        self.reassembler.freeMsg(msg)
+
+    def getRecvStats(self):
+        '''接收统计：数据报/字节数、唤醒次数、单次最多读取数及重组丢弃情况'''
+        stats = self.reassembler.getStats()
+        stats.update(self.recv_stats)
+        stats['ready_msgs'] = len(self.ready_msgs)
+        return stats
 
     def calcMsgFrameNum(self, payload_bytes):
         frame_full_num = payload_bytes // self.frame_payload_max_bytes
@@ -160,7 +468,8 @@ class MsgUdpHandler(object):
 
     def clearSocketRecvBuf(self, timeout=0):
         while True:
-            rd_list, _, _ = select.select([self.sock], [], [], timeout)
-            if self.sock not in rd_list:
-                return None
-            self.sock.recvfrom(65536)
\ No newline at end of file
+            if not self.selector.select(timeout):
+                break
+            self.sock.recvfrom_into(self.recv_ring[0])
+        self.ready_msgs.clear()
+        self.reassembler.reset()
\ No newline at end of file
@@ -0,0 +1,368 @@
+#coding: utf-8
+'''人体Pose录制文件
+
+文件由文件头、若干个定长的块和索引组成，均为小端：
+
+    文件头（64字节）: magic 'HPOSEREC', version, chunk_frames, max_persons, kps_num,
+        time_origin
+    块（chunk_size字节，位于64 + i * chunk_size）:
+        块头（32字节）: magic 'CHNK', frame_num, t_start, t_end
+        按列存放chunk_frames帧的数据，每列按8字节对齐，见getRecordColumns
+    索引（关闭时写入）: magic 'HPOSEIDX', chunk_num, 每块的(frame_num, t_start, t_end)
+    文件尾（16字节）: 索引位置, magic 'HPOSEEND'
+
+时间戳为单调时钟（time.monotonic()）的秒数，不减小，块内和块之间均有序，读取时
+按时间二分查找；time_origin + 时间戳为对应的系统时间（版本1的时间戳为系统时间，
+time_origin为0）。
+每帧占固定宽度，超过max_persons的人不保存。写入时只在内存中保留当前块，
+周期性覆盖写入当前块；异常退出时没有索引，读取时扫描块头。
+读取时用内存映射，返回的数组为文件的视图，不把整个文件读入内存。
+'''
+
+import os
+import time
+import struct
+import collections
+import numpy as np
+
+from stream_codec import KPS_NUM, HumanPoseFrame
+
+
+FILE_MAGIC = b'HPOSEREC'
+INDEX_MAGIC = b'HPOSEIDX'
+END_MAGIC = b'HPOSEEND'
+CHUNK_MAGIC = b'CHNK'
+FILE_VERSION = 2
+FILE_HEADER = struct.Struct('<8sIIIId')
+FILE_HEADER_SIZE = 64
+CHUNK_HEADER = struct.Struct('<4sIdd')
+CHUNK_HEADER_SIZE = 32
+INDEX_HEADER = struct.Struct('<8sQ')
+INDEX_ENTRY_DTYPE = np.dtype([('frame_num', '<u4'), ('reserved', '<u4'),
+        ('t_start', '<f8'), ('t_end', '<f8')])
+FILE_TRAILER = struct.Struct('<Q8s')
+
+# 每人数据的标志位
+FLAG_BOX = 1
+FLAG_KPS2D = 2
+FLAG_KPS3D = 4
+FLAG_HAND_DIR = 8
+
+
+def getRecordColumns(max_persons, kps_num=KPS_NUM):
+    '''每帧的列：(列名, dtype, 每帧的形状)'''
+    return [
+        ('timestamp',  np.dtype('<f8'), ()),
+        ('img_idx',    np.dtype('<u4'), ()),
+        ('person_num', np.dtype('<u2'), ()),
+        ('boxes',      np.dtype('<f4'), (max_persons, 5)),
+        ('kps2d',      np.dtype('<f4'), (max_persons, kps_num, 3)),
+        ('kps3d',      np.dtype('<f4'), (max_persons, kps_num, 4)),
+        ('hand_dirs',  np.dtype('<u4'), (max_persons, 2)),
+        ('flags',      np.dtype('u1'),  (max_persons, )),
+    ]
+
+
+def getChunkLayout(chunk_frames, max_persons, kps_num=KPS_NUM):
+    '''返回(块大小, [(列名, dtype, 形状, 块内偏移)])'''
+    offset = CHUNK_HEADER_SIZE
+    layout = []
+    for name, dtype, shape in getRecordColumns(max_persons, kps_num):
+        shape = (chunk_frames, ) + shape
+        layout.append((name, dtype, shape, offset))
+        size = dtype.itemsize * int(np.prod(shape))
+        offset += (size + 7) // 8 * 8
+    return offset, layout
+
+
+def makeColumnViews(buf, base, layout):
+    '''buf为uint8数组，返回从base开始的块中各列的视图'''
+    columns = {}
+    for name, dtype, shape, offset in layout:
+        size = dtype.itemsize * int(np.prod(shape))
+        start = base + offset
+        columns[name] = buf[start:start + size].view(dtype).reshape(shape)
+    return columns
+
+
+def sliceColumns(columns, start, end):
+    return {name: col[start:end] for name, col in columns.items()}
+
+
+def toPoseFrame(columns, row):
+    '''列数据中的一帧转为HumanPoseFrame，数组为视图'''
+    n = int(columns['person_num'][row])
+    flags = columns['flags'][row, :n]
+    return HumanPoseFrame(int(columns['img_idx'][row]),
+            columns['boxes'][row, :n], (flags & FLAG_BOX) != 0,
+            columns['kps2d'][row, :n], (flags & FLAG_KPS2D) != 0,
+            columns['kps3d'][row, :n], (flags & FLAG_KPS3D) != 0,
+            columns['hand_dirs'][row, :n], (flags & FLAG_HAND_DIR) != 0)
+
+
+class PoseRecordWriter(object):
+    '''录制人体Pose，每次写入一帧HumanPoseFrame
+
+    time_origin: 时间戳为0时对应的系统时间，默认为time.time() - time.monotonic()，
+        即默认的时间戳（time.monotonic()）对应的系统时间
+    '''
+    def __init__(self, path, chunk_frames=256, max_persons=4, kps_num=KPS_NUM,
+            time_origin=None):
+        super(PoseRecordWriter, self).__init__()
+        assert chunk_frames > 0 and max_persons > 0
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.max_persons = max_persons
+        self.chunk_size, self.layout = getChunkLayout(chunk_frames,
+                max_persons, kps_num)
+        # 当前块的缓冲区及各列视图
+        self.chunk_buf = np.zeros(self.chunk_size, dtype=np.uint8)
+        self.columns = makeColumnViews(self.chunk_buf, 0, self.layout)
+        self.frame_num = 0
+        self.is_dirty = False
+        self.last_timestamp = None
+        self.time_origin = time.time() - time.monotonic() \
+                if time_origin is None else time_origin
+        # 已写完的块的索引
+        self.index = []
+        self.stats = collections.Counter()
+        self.file = open(path, 'wb')
+        header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, chunk_frames,
+                max_persons, kps_num, self.time_origin)
+        self.file.write(header.ljust(FILE_HEADER_SIZE, b'\0'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, frame:HumanPoseFrame, timestamp=None):
+        '''写入一帧，timestamp默认为time.monotonic()，不能小于上一帧的时间戳'''
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            raise ValueError("Timestamp %f is earlier than the last one %f" % \
+                    (timestamp, self.last_timestamp))
+        self.last_timestamp = timestamp
+        row = self.frame_num
+        cols = self.columns
+        n = frame.getPersonNum()
+        if n > self.max_persons:
+            self.stats['truncated_persons'] += n - self.max_persons
+            n = self.max_persons
+        cols['timestamp'][row] = timestamp
+        cols['img_idx'][row] = frame.img_idx
+        cols['person_num'][row] = n
+        cols['boxes'][row, :n] = frame.boxes[:n]
+        cols['kps2d'][row, :n] = frame.kps2d[:n]
+        cols['kps3d'][row, :n] = frame.kps3d[:n]
+        cols['hand_dirs'][row, :n] = frame.hand_dirs[:n]
+        cols['flags'][row, :n] = \
+                frame.has_box[:n] * FLAG_BOX | \
+                frame.has_kps2d[:n] * FLAG_KPS2D | \
+                frame.has_kps3d[:n] * FLAG_KPS3D | \
+                frame.has_hand_dir[:n] * FLAG_HAND_DIR
+        # 之前的帧可能留有更多人的数据
+        for name in ['boxes', 'kps2d', 'kps3d', 'hand_dirs', 'flags']:
+            cols[name][row, n:] = 0
+        self.frame_num += 1
+        self.is_dirty = True
+        self.stats['frames'] += 1
+        if self.frame_num == self.chunk_frames:
+            self._writeChunk()
+            self.index.append((self.frame_num, self._getChunkTimeRange()))
+            self.frame_num = 0
+
+    def _getChunkTimeRange(self):
+        timestamps = self.columns['timestamp'][:self.frame_num]
+        return float(timestamps[0]), float(timestamps[-1])
+
+    def _writeChunk(self):
+        '''把当前块写入其在文件中的位置（未写满的块之后会被覆盖）'''
+        t_start, t_end = self._getChunkTimeRange()
+        self.chunk_buf[:CHUNK_HEADER_SIZE] = np.frombuffer(
+                CHUNK_HEADER.pack(CHUNK_MAGIC, self.frame_num, t_start, t_end)
+                .ljust(CHUNK_HEADER_SIZE, b'\0'), dtype=np.uint8)
+        self.file.seek(FILE_HEADER_SIZE + len(self.index) * self.chunk_size)
+        self.file.write(self.chunk_buf)
+        self.is_dirty = False
+        self.stats['chunk_writes'] += 1
+
+    def flush(self):
+        '''写入当前未满的块'''
+        if self.is_dirty and self.frame_num > 0:
+            self._writeChunk()
+        self.file.flush()
+
+    def close(self):
+        '''写入剩余数据和索引'''
+        if self.file is None:
+            return
+        index = list(self.index)
+        if self.frame_num > 0:
+            self._writeChunk()
+            index.append((self.frame_num, self._getChunkTimeRange()))
+        index_offset = FILE_HEADER_SIZE + len(index) * self.chunk_size
+        entries = np.zeros(len(index), dtype=INDEX_ENTRY_DTYPE)
+        for i, (frame_num, (t_start, t_end)) in enumerate(index):
+            entries[i] = (frame_num, 0, t_start, t_end)
+        self.file.seek(index_offset)
+        self.file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(index)))
+        self.file.write(entries.tobytes())
+        self.file.write(FILE_TRAILER.pack(index_offset, END_MAGIC))
+        self.file.truncate()
+        self.file.close()
+        self.file = None
+
+    def getStats(self):
+        return dict(self.stats)
+
+
+class PoseRecordReader(object):
+    '''读取人体Pose录制文件
+
+    文件被内存映射，getChunk/iterRange返回的数组均为文件的视图，只有访问到的
+    部分会被读入内存；readRange把时间范围内的数据复制为连续数组。
+    '''
+    def __init__(self, path):
+        super(PoseRecordReader, self).__init__()
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(self.data) < FILE_HEADER_SIZE:
+            raise ValueError("Invalid pose record file: %s" % path)
+        # 版本1的文件头没有time_origin，对应位置为0
+        magic, version, chunk_frames, max_persons, kps_num, time_origin = \
+                FILE_HEADER.unpack_from(self.data, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError("Invalid pose record file: %s" % path)
+        if version not in [1, FILE_VERSION]:
+            raise ValueError("Unsupported pose record version: %d" % version)
+        self.time_origin = time_origin
+        self.chunk_frames = chunk_frames
+        self.max_persons = max_persons
+        self.kps_num = kps_num
+        self.chunk_size, self.layout = getChunkLayout(chunk_frames,
+                max_persons, kps_num)
+        self.index = self._loadIndex()
+        if self.index is None:
+            self.index = self._scanChunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # 视图仍被引用时，映射在其释放后关闭
+        self.data = None
+
+    def _loadIndex(self):
+        if len(self.data) < FILE_HEADER_SIZE + FILE_TRAILER.size:
+            return None
+        index_offset, magic = FILE_TRAILER.unpack_from(self.data,
+                len(self.data) - FILE_TRAILER.size)
+        if magic != END_MAGIC:
+            return None
+        magic, chunk_num = INDEX_HEADER.unpack_from(self.data, index_offset)
+        if magic != INDEX_MAGIC:
+            return None
+        start = index_offset + INDEX_HEADER.size
+        end = start + chunk_num * INDEX_ENTRY_DTYPE.itemsize
+        return self.data[start:end].view(INDEX_ENTRY_DTYPE)
+
+    def _scanChunks(self):
+        '''没有索引时（录制未正常结束）扫描块头'''
+        entries = []
+        offset = FILE_HEADER_SIZE
+        while offset + self.chunk_size <= len(self.data):
+            magic, frame_num, t_start, t_end = \
+                    CHUNK_HEADER.unpack_from(self.data, offset)
+            if magic != CHUNK_MAGIC or frame_num == 0:
+                break
+            entries.append((frame_num, 0, t_start, t_end))
+            offset += self.chunk_size
+        return np.array(entries, dtype=INDEX_ENTRY_DTYPE)
+
+    def getChunkNum(self):
+        return len(self.index)
+
+    def getFrameNum(self):
+        return int(self.index['frame_num'].sum())
+
+    def getTimeRange(self):
+        '''返回(最早, 最晚)时间戳，没有数据时返回None'''
+        if len(self.index) == 0:
+            return None
+        return float(self.index['t_start'][0]), float(self.index['t_end'][-1])
+
+    def toWallTime(self, timestamp):
+        '''时间戳转为系统时间（time.time()）'''
+        return self.time_origin + timestamp
+
+    def getChunk(self, chunk_idx):
+        '''返回块中各列的视图，字典的值为(frame_num, ...)数组'''
+        base = FILE_HEADER_SIZE + chunk_idx * self.chunk_size
+        columns = makeColumnViews(self.data, base, self.layout)
+        return sliceColumns(columns, 0, int(self.index['frame_num'][chunk_idx]))
+
+    def iterRange(self, t_start=None, t_end=None):
+        '''按块返回时间在[t_start, t_end)内的各列视图'''
+        chunk_idxs = np.arange(len(self.index))
+        if t_start is not None:
+            chunk_idxs = chunk_idxs[self.index['t_end'] >= t_start]
+        if t_end is not None:
+            chunk_idxs = chunk_idxs[self.index['t_start'][chunk_idxs] < t_end]
+        for chunk_idx in chunk_idxs:
+            columns = self.getChunk(chunk_idx)
+            timestamps = columns['timestamp']
+            start = 0 if t_start is None else \
+                    int(np.searchsorted(timestamps, t_start, 'left'))
+            end = len(timestamps) if t_end is None else \
+                    int(np.searchsorted(timestamps, t_end, 'left'))
+            if end > start:
+                yield sliceColumns(columns, start, end)
+
+    def readRange(self, t_start=None, t_end=None):
+        '''返回时间在[t_start, t_end)内的各列（复制为连续数组）'''
+        chunks = list(self.iterRange(t_start, t_end))
+        if len(chunks) == 1:
+            # 复制，不引用内存映射，关闭文件后仍可使用
+            return {name: np.array(column, copy=True)
+                    for name, column in chunks[0].items()}
+        if len(chunks) == 0:
+            return sliceColumns(makeColumnViews(
+                    np.zeros(self.chunk_size, dtype=np.uint8), 0, self.layout),
+                    0, 0)
+        return {name: np.concatenate([c[name] for c in chunks])
+                for name in chunks[0]}
+
+    def iterFrames(self, t_start=None, t_end=None):
+        '''逐帧返回(timestamp, HumanPoseFrame)'''
+        for columns in self.iterRange(t_start, t_end):
+            for row in range(len(columns['timestamp'])):
+                yield float(columns['timestamp'][row]), \
+                        toPoseFrame(columns, row)
+
+
+if __name__ == '__main__':
+    import fire
+
+    def info(path):
+        '''打印录制文件的信息'''
+        with PoseRecordReader(path) as reader:
+            time_range = reader.getTimeRange()
+            print("chunks: %d x %d frames, max persons: %d" % (
+                    reader.getChunkNum(), reader.chunk_frames,
+                    reader.max_persons))
+            print("frames: %d" % reader.getFrameNum())
+            if time_range is not None:
+                print("time: %s ~ %s (%.1fs)" % (
+                        time.strftime('%Y-%m-%d %H:%M:%S',
+                            time.localtime(reader.toWallTime(time_range[0]))),
+                        time.strftime('%Y-%m-%d %H:%M:%S',
+                            time.localtime(reader.toWallTime(time_range[1]))),
+                        time_range[1] - time_range[0]))
+            print("file size: %d bytes" % os.path.getsize(path))
+
+    fire.Fire({'info': info})
@@ -0,0 +1,165 @@
+#coding: utf-8
+
+import time
+import threading
+import collections
+import msg_pb2
+
+
+# 属性ID -> RspGetProp（及ReqSetProp）中对应的字段名
+PROP_FIELDS = {
+    msg_pb2.MSG_PROP_DEVICE_STATUS               : 'dev_status',
+    msg_pb2.MSG_PROP_DEVICE_BASE_INFO            : 'dev_base_info',
+    msg_pb2.MSG_PROP_TEMPERATURE                 : 'temperature',
+    msg_pb2.MSG_PROP_APP_NEW_VERSION             : 'app_new_version',
+    msg_pb2.MSG_PROP_APP_VERSIONS                : 'app_versions',
+    msg_pb2.MSG_PROP_MEDIA_SOURCE                : 'media_source',
+    msg_pb2.MSG_PROP_CAM_PARAM                   : 'cam_param',
+    msg_pb2.MSG_PROP_CAM_REAL_PARAM              : 'cam_param_real',
+    msg_pb2.MSG_PROP_CAM_CTRL                    : 'cam_ctrl',
+    msg_pb2.MSG_PROP_ENABLE_CAM_IMG_STREAM       : 'is_send_cam_img_stream',
+    msg_pb2.MSG_PROP_ENABLE_AI                   : 'is_enable_ai',
+    msg_pb2.MSG_PROP_STREAM_TARGET_ADDR          : 'stream_target_addr',
+    msg_pb2.MSG_PROP_ENABLE_HUMAN_POSE_STREAM    : 'is_send_human_pose_stream',
+    msg_pb2.MSG_PROP_HUMAN_BOX_MODEL_PARAM       : 'human_box_model_param',
+    msg_pb2.MSG_PROP_HUMAN_POSE3D_MODEL_PARAM    : 'human_pose3d_model_param',
+    msg_pb2.MSG_PROP_HUMAN_BOX_TRACK_PARAM       : 'human_box_track_param',
+    msg_pb2.MSG_PROP_HUMAN_POSE2D_FILTER_PARAM   : 'human_pose2d_filter_param',
+    msg_pb2.MSG_PROP_HUMAN_HAND_ACTION_CLS_PARAM : 'hand_action_cls_param',
+}
+
+# 可设置的属性：属性ID -> ReqSetProp中的字段名
+SETTABLE_PROP_FIELDS = {prop_id: field for prop_id, field in PROP_FIELDS.items()
+        if field in msg_pb2.ReqSetProp.DESCRIPTOR.fields_by_name}
+
+# 属性缓存的有效时间（秒），未列出的属性不缓存。可设置的属性在设置成功后会被更新，
+# 有效时间只用于发现其他客户端或设备自身的修改。
+PROP_CACHE_TTLS = {
+    msg_pb2.MSG_PROP_DEVICE_STATUS               : 10,
+    msg_pb2.MSG_PROP_DEVICE_BASE_INFO            : float('inf'),
+    msg_pb2.MSG_PROP_TEMPERATURE                 : 2,
+    msg_pb2.MSG_PROP_APP_NEW_VERSION             : 60,
+    msg_pb2.MSG_PROP_APP_VERSIONS                : 60,
+    msg_pb2.MSG_PROP_MEDIA_SOURCE                : 10,
+    msg_pb2.MSG_PROP_CAM_PARAM                   : 10,
+    msg_pb2.MSG_PROP_CAM_REAL_PARAM              : 2,
+    msg_pb2.MSG_PROP_CAM_CTRL                    : 10,
+    msg_pb2.MSG_PROP_ENABLE_CAM_IMG_STREAM       : 10,
+    msg_pb2.MSG_PROP_ENABLE_AI                   : 10,
+    msg_pb2.MSG_PROP_STREAM_TARGET_ADDR          : 10,
+    msg_pb2.MSG_PROP_ENABLE_HUMAN_POSE_STREAM    : 10,
+    msg_pb2.MSG_PROP_HUMAN_BOX_MODEL_PARAM       : 10,
+    msg_pb2.MSG_PROP_HUMAN_POSE3D_MODEL_PARAM    : 10,
+    msg_pb2.MSG_PROP_HUMAN_BOX_TRACK_PARAM       : 10,
+    msg_pb2.MSG_PROP_HUMAN_POSE2D_FILTER_PARAM   : 10,
+    msg_pb2.MSG_PROP_HUMAN_HAND_ACTION_CLS_PARAM : 10,
+}
+
+# 设置属性后需要失效的其他属性
+PROP_DEPENDENTS = {
+    msg_pb2.MSG_PROP_CAM_PARAM   : [msg_pb2.MSG_PROP_CAM_REAL_PARAM],
+    msg_pb2.MSG_PROP_MEDIA_SOURCE: [msg_pb2.MSG_PROP_CAM_REAL_PARAM],
+}
+
+
+def makePropCacheKey(prop_id, args=None):
+    if not args:
+        return (prop_id, )
+    return (prop_id, ) + tuple(sorted((k, repr(v)) for k, v in args.items()))
+
+
+def copyRsp(rsp):
+    copied = type(rsp)()
+    copied.CopyFrom(rsp)
+    return copied
+
+
+class PropCache(object):
+    '''设备属性缓存
+
+    缓存RspGetProp，每个属性有单独的有效时间；设置属性成功后用请求的值更新缓存
+    （写穿），并使相关属性失效。可在多个线程中使用。
+
+    存入和取出时都复制RspGetProp，调用者修改得到的对象不影响缓存。
+    '''
+    def __init__(self, ttls:dict=None):
+        super(PropCache, self).__init__()
+        self.ttls = dict(PROP_CACHE_TTLS if ttls is None else ttls)
+        # key -> (expire_time, rsp)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def setTtl(self, prop_id, ttl):
+        '''设置属性的有效时间，ttl为0表示不缓存，已缓存的值失效'''
+        with self.lock:
+            self.ttls[prop_id] = ttl
+            self._invalidate(prop_id)
+
+    def get(self, prop_id, args=None):
+        '''获取未过期的缓存，不存在时返回None'''
+        key = makePropCacheKey(prop_id, args)
+        with self.lock:
+            # ttls可能被setTtl修改，与entries一起在锁内读取
+            if self.ttls.get(prop_id, 0) <= 0:
+                return None
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            self.stats['misses' if entry is None else 'hits'] += 1
+        return None if entry is None else copyRsp(entry[1])
+
+    def put(self, rsp, args=None):
+        '''缓存获取属性的回复'''
+        key = makePropCacheKey(rsp.prop_id, args)
+        rsp = copyRsp(rsp)
+        with self.lock:
+            ttl = self.ttls.get(rsp.prop_id, 0)
+            if ttl <= 0:
+                return
+            self.entries[key] = (time.monotonic() + ttl, rsp)
+
+    def update(self, req):
+        '''设置属性成功后，用请求(ReqSetProp)的值更新缓存'''
+        prop_id = req.prop_id
+        field = PROP_FIELDS.get(prop_id)
+        with self.lock:
+            self.stats['updates'] += 1
+            self._invalidate(prop_id)
+            for dep_prop_id in PROP_DEPENDENTS.get(prop_id, []):
+                self._invalidate(dep_prop_id)
+        if field is None or prop_id == msg_pb2.MSG_PROP_CAM_CTRL:
+            # 相机Ctrl按id缓存，只失效不更新
+            return
+        rsp = msg_pb2.RspGetProp()
+        rsp.prop_id = prop_id
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        value = getattr(req, field)
+        if hasattr(value, 'CopyFrom'):
+            getattr(rsp, field).CopyFrom(value)
+        else:
+            setattr(rsp, field, value)
+        self.put(rsp)
+
+    def invalidate(self, prop_id=None):
+        '''使属性的缓存失效，prop_id为None时清空缓存'''
+        with self.lock:
+            self._invalidate(prop_id)
+
+    def _invalidate(self, prop_id=None):
+        if prop_id is None:
+            self.stats['invalidations'] += len(self.entries)
+            self.entries.clear()
+            return
+        for key in [k for k in self.entries if k[0] == prop_id]:
+            del self.entries[key]
+            self.stats['invalidations'] += 1
+
+    def getStats(self):
+        '''命中、未命中、过期、更新和失效的次数'''
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        return stats
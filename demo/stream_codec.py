@@ -0,0 +1,363 @@
+#coding: utf-8
+'''数据流消息的编解码'''
+
+import numpy as np
+import msg_pb2
+
+
+# 设备发送的2d关键点个数，解码时追加root节点（6和9的中点）
+KPS_DEV_NUM = 14
+KPS_NUM = KPS_DEV_NUM + 1
+KPS_ROOT_PARENTS = (6, 9)
+HAND_DIR_BITS = 6
+
+
+def decodeVarint(buf, pos):
+    '''从buf[pos]解码protobuf varint，返回(value, 下一个位置)'''
+    value = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def skipField(buf, pos, wire_type):
+    '''跳过一个字段的值，返回下一个位置'''
+    if wire_type == 0:
+        return decodeVarint(buf, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        length, pos = decodeVarint(buf, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError("Unsupported wire type: %d" % wire_type)
+
+
+class CamImgStreamView(object):
+    '''相机图片流消息的惰性解码结果
+
+    img_idx和pix_fmt已解析；data为指向消息缓冲区的memoryview，未复制。
+    使用完毕后调用release()归还消息缓冲区，之后不可再访问data（包括由data创建
+    的numpy数组）；未调用时缓冲区由GC回收，不会被复用。
+    '''
+    __slots__ = ('img_idx', 'pix_fmt', 'data', '_raw', '_release')
+
+    def __init__(self, img_idx, pix_fmt, data, raw, release=None):
+        self.img_idx = img_idx
+        self.pix_fmt = pix_fmt
+        self.data = data
+        self._raw = raw
+        self._release = release
+
+    def parse(self):
+        '''完整解析，返回ReqCamImgStream（复制图片数据）'''
+        req = msg_pb2.ReqCamImgStream()
+        req.ParseFromString(self._raw)
+        return req
+
+    def release(self):
+        release, self._release = self._release, None
+        self.data = self._raw = None
+        if release is not None:
+            release()
+
+
+def decodeCamImgStream(data, release=None):
+    '''惰性解码相机图片流消息（不含cmd），返回CamImgStreamView
+
+    只扫描字段标签，得到img_idx、pix_fmt和图片数据在data中的范围，不复制图片。
+    release: 图片使用完毕后的回调，例如归还消息缓冲区
+    '''
+    data = memoryview(data)
+    img_idx = 0
+    pix_fmt = 0
+    img_data = data[0:0]
+    pos = 0
+    end = len(data)
+    while pos < end:
+        tag, pos = decodeVarint(data, pos)
+        if tag != 0x0a:  # cam_img = 1
+            pos = skipField(data, pos, tag & 0x07)
+            continue
+        length, pos = decodeVarint(data, pos)
+        img_end = pos + length
+        while pos < img_end:
+            tag, pos = decodeVarint(data, pos)
+            if tag == 0x08:    # idx = 1
+                img_idx, pos = decodeVarint(data, pos)
+            elif tag == 0x10:  # pix_fmt = 2
+                pix_fmt, pos = decodeVarint(data, pos)
+            elif tag == 0x2a:  # data = 5
+                length, pos = decodeVarint(data, pos)
+                img_data = data[pos:pos+length]
+                pos += length
+            else:
+                pos = skipField(data, pos, tag & 0x07)
+    if pos != end:
+        raise ValueError("Truncated ReqCamImgStream")
+    return CamImgStreamView(img_idx, pix_fmt, img_data, data, release)
+
+
+def parseCamImgStream(data):
+    '''解析相机图片流消息（不含cmd），返回(img_idx, img_data)'''
+    req = msg_pb2.ReqCamImgStream()
+    req.ParseFromString(data)
+    img = req.cam_img
+    return img.idx, img.data
+
+
+class HumanPoseFrame(object):
+    '''一帧人体Pose数据，每个人占一行，按消息中的idx与Box对应
+
+    boxes: (N, 5) float32，每行为xmin, ymin, xmax, ymax, score
+    kps2d: (N, 15, 3) float32，每个点为x, y, v，最后一个点为root
+    kps3d: (N, 15, 4) float32，每个点为x, y, z, v，已调整为显示坐标系
+    hand_dirs: (N, 2) uint32，左右手方向的位掩码
+    has_box/has_kps2d/has_kps3d/has_hand_dir: (N,) bool，该人是否有对应数据，
+        没有数据的行全为0
+    '''
+    __slots__ = ('img_idx', 'boxes', 'has_box', 'kps2d', 'has_kps2d', 'kps3d',
+            'has_kps3d', 'hand_dirs', 'has_hand_dir')
+
+    def __init__(self, img_idx, boxes, has_box, kps2d, has_kps2d, kps3d,
+            has_kps3d, hand_dirs, has_hand_dir):
+        self.img_idx = img_idx
+        self.boxes = boxes
+        self.has_box = has_box
+        self.kps2d = kps2d
+        self.has_kps2d = has_kps2d
+        self.kps3d = kps3d
+        self.has_kps3d = has_kps3d
+        self.hand_dirs = hand_dirs
+        self.has_hand_dir = has_hand_dir
+
+    def getPersonNum(self):
+        return len(self.boxes)
+
+    def getScaled(self, scale):
+        '''Box和2D关键点坐标乘以scale后的副本（用于在缩小的图片上绘制）'''
+        boxes = self.boxes.copy()
+        boxes[:, :4] *= scale
+        kps2d = self.kps2d.copy()
+        kps2d[..., :2] *= scale
+        return HumanPoseFrame(self.img_idx, boxes, self.has_box, kps2d,
+                self.has_kps2d, self.kps3d, self.has_kps3d, self.hand_dirs,
+                self.has_hand_dir)
+
+    def getHandDirBits(self):
+        '''(N, 2, 6)，每位为该方向的位值（0表示无该方向）'''
+        return self.hand_dirs[:, :, None] & \
+                (np.uint32(1) << np.arange(HAND_DIR_BITS, dtype=np.uint32))
+
+    def toDict(self):
+        '''转为parseHumanPoseStream的字典格式（只含第一个人，坐标为int）'''
+        boxes = [[int(b[0]), int(b[1]), int(b[2]), int(b[3]), float(b[4])]
+                for b in self.boxes[self.has_box].tolist()]
+        pose = {'boxes': boxes}
+        rows = np.flatnonzero(self.has_kps2d)
+        if len(rows) > 0:
+            kps = self.kps2d[rows[0]].tolist()
+            pose['kps'] = [[int(p[0]), int(p[1]), p[2]] for p in kps]
+        rows = np.flatnonzero(self.has_kps3d)
+        if len(rows) > 0:
+            kps3d = self.kps3d[rows[0]].tolist()
+            pose['kps3d'] = [[int(p[0]), int(p[1]), int(p[2]), p[3]]
+                    for p in kps3d]
+        rows = np.flatnonzero(self.has_hand_dir)
+        if len(rows) > 0:
+            left_dir, right_dir = self.getHandDirBits()[rows[0]].tolist()
+            pose['hand_dir'] = (left_dir, right_dir)
+        return pose
+
+
+def getPersonRows(idxs, box_num):
+    '''消息中的idx转为行号；idx越界或重复时（如旧固件未填写）按顺序对应'''
+    if len(idxs) == 0:
+        return idxs
+    if idxs.min() >= 0 and idxs.max() < box_num and \
+            len(np.unique(idxs)) == len(idxs):
+        return idxs
+    return np.arange(len(idxs))
+
+
+def scatterRows(values, rows, person_num):
+    '''把values按rows放到person_num行的数组中，返回(数组, 是否有数据)'''
+    out = np.zeros((person_num, ) + values.shape[1:], dtype=values.dtype)
+    out[rows] = values
+    has = np.zeros(person_num, dtype=bool)
+    has[rows] = True
+    return out, has
+
+
+def decodeHumanPoseStream(data):
+    '''解码人体Pose数据流消息（不含cmd），返回HumanPoseFrame
+
+    每帧按人数一次分配数组，逐点只做一次取值，root节点、3d坐标系调整以及按idx
+    与Box对应均按数组计算，不区分人数。
+    '''
+    req = msg_pb2.ReqHumanPoseStream()
+    req.ParseFromString(data)
+
+    boxes = np.empty((len(req.boxes), 5), dtype=np.float32)
+    for i, b in enumerate(req.boxes):
+        boxes[i] = (b.xmin, b.ymin, b.xmax, b.ymax, b.score)
+
+    pose2ds = req.pose2ds
+    kps2d = np.zeros((len(pose2ds), KPS_NUM, 3), dtype=np.float32)
+    pose2d_idxs = np.empty(len(pose2ds), dtype=np.int64)
+    for i, pose in enumerate(pose2ds):
+        pose2d_idxs[i] = pose.idx
+        points = pose.point
+        n = min(len(points), KPS_DEV_NUM)
+        if n > 0:
+            kps2d[i, :n] = [(p.x, p.y, p.v) for p in points[:n]]
+    # 添加root节点
+    kp_a = kps2d[:, KPS_ROOT_PARENTS[0]]
+    kp_b = kps2d[:, KPS_ROOT_PARENTS[1]]
+    kps2d[:, KPS_DEV_NUM, :2] = np.floor_divide(kp_a[:, :2] + kp_b[:, :2], 2)
+    kps2d[:, KPS_DEV_NUM, 2] = np.minimum(kp_a[:, 2], kp_b[:, 2])
+
+    pose3ds = req.pose3ds
+    kps3d = np.zeros((len(pose3ds), KPS_NUM, 4), dtype=np.float32)
+    pose3d_idxs = np.empty(len(pose3ds), dtype=np.int64)
+    for i, pose in enumerate(pose3ds):
+        pose3d_idxs[i] = pose.idx
+        points = pose.point
+        n = min(len(points), KPS_NUM)
+        if n > 0:
+            kps3d[i, :n] = [(p.x, p.y, p.z, p.v) for p in points[:n]]
+    # 调整kps3d坐标系：[x, y, z, v] -> [-x, -z, -y, v]
+    kps3d = kps3d[:, :, [0, 2, 1, 3]]
+    kps3d[:, :, :3] *= -1
+
+    hand_dirs = np.empty((len(req.hand_dirs), 2), dtype=np.uint32)
+    hand_idxs = np.empty(len(req.hand_dirs), dtype=np.int64)
+    for i, h in enumerate(req.hand_dirs):
+        hand_dirs[i] = (h.left, h.right)
+        hand_idxs[i] = h.idx
+
+    # 按idx与Box对应，没有Box的人补全为0
+    box_num = len(boxes)
+    rows2d = getPersonRows(pose2d_idxs, box_num)
+    rows3d = getPersonRows(pose3d_idxs, box_num)
+    rows_hand = getPersonRows(hand_idxs, box_num)
+    person_num = max([box_num] + [int(rows.max()) + 1
+            for rows in (rows2d, rows3d, rows_hand) if len(rows) > 0])
+    boxes, has_box = scatterRows(boxes, np.arange(box_num), person_num)
+    kps2d, has_kps2d = scatterRows(kps2d, rows2d, person_num)
+    kps3d, has_kps3d = scatterRows(kps3d, rows3d, person_num)
+    hand_dirs, has_hand_dir = scatterRows(hand_dirs, rows_hand, person_num)
+
+    return HumanPoseFrame(req.img_idx, boxes, has_box, kps2d, has_kps2d,
+            kps3d, has_kps3d, hand_dirs, has_hand_dir)
+
+
+def parseHumanPoseStream(data):
+    '''解析人体Pose数据流消息（不含cmd），返回(img_idx, pose)，pose为字典'''
+    frame = decodeHumanPoseStream(data)
+    return frame.img_idx, frame.toDict()
+
+
+def encodeHumanPoseStream(frame:HumanPoseFrame):
+    '''HumanPoseFrame编码为ReqHumanPoseStream，为decodeHumanPoseStream的逆过程
+
+    有Box的人应在前面（与解码结果一致），Pose的idx为行号；2d关键点不含root节点，
+    3d坐标转换回设备坐标系，坐标取整。
+    '''
+    req = msg_pb2.ReqHumanPoseStream()
+    req.img_idx = frame.img_idx
+    for b in frame.boxes[frame.has_box].tolist():
+        req.boxes.add(xmin=int(b[0]), ymin=int(b[1]), xmax=int(b[2]),
+                ymax=int(b[3]), score=b[4])
+    for i in np.flatnonzero(frame.has_kps2d):
+        pose = req.pose2ds.add(idx=int(i))
+        for p in frame.kps2d[i, :KPS_DEV_NUM].tolist():
+            pose.point.add(x=int(p[0]), y=int(p[1]), v=p[2])
+    for i in np.flatnonzero(frame.has_kps3d):
+        pose = req.pose3ds.add(idx=int(i))
+        # [-x, -z, -y, v] -> [x, y, z, v]
+        for p in frame.kps3d[i].tolist():
+            pose.point.add(x=int(-p[0]), y=int(-p[2]), z=int(-p[1]), v=p[3])
+    for i in np.flatnonzero(frame.has_hand_dir):
+        req.hand_dirs.add(idx=int(i), left=int(frame.hand_dirs[i, 0]),
+                right=int(frame.hand_dirs[i, 1]))
+    return req
+
+
+def encodeVarint(value):
+    '''protobuf varint编码，负数按64位补码（int32/enum字段）'''
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encodeMediaStreamPrefix(img_idx, data_len,
+        pix_fmt=msg_pb2.Image.JPEG, width=0, height=0,
+        media_type=msg_pb2.MEDIA_IMAGE_STREAM):
+    '''编码ReqMediaStream中图片数据之前的部分
+
+    返回的前缀后接data_len字节的图片数据，与设置同样字段后SerializeToString()的
+    结果逐字节一致（字段按编号顺序，值为0的字段省略），发送时图片数据无需复制：
+    ``msg_handler.sendMsgBufs(cmd, [prefix, img_data])``
+    '''
+    img = bytearray()
+    if img_idx:
+        img += b'\x08' + encodeVarint(img_idx)
+    if pix_fmt:
+        img += b'\x10' + encodeVarint(pix_fmt)
+    if width:
+        img += b'\x18' + encodeVarint(width)
+    if height:
+        img += b'\x20' + encodeVarint(height)
+    if data_len:
+        img += b'\x2a' + encodeVarint(data_len)
+    prefix = bytearray()
+    if media_type:
+        prefix += b'\x08' + encodeVarint(media_type)
+    prefix += b'\x12' + encodeVarint(len(img) + data_len)
+    prefix += img
+    return bytes(prefix)
+
+
+def parseRspMediaStream(data):
+    '''解析媒体数据流回复消息（不含cmd）'''
+    rsp = msg_pb2.RspMediaStream()
+    rsp.ParseFromString(data)
+    return rsp
+
+
+def getJpegSize(data):
+    '''从JPEG的SOF段读取(width, height)，不是JPEG或找不到时返回None'''
+    n = len(data)
+    if n < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    while pos + 4 <= n:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos + 9 > n:
+                return None
+            height = (data[pos + 5] << 8) | data[pos + 6]
+            width = (data[pos + 7] << 8) | data[pos + 8]
+            return width, height
+        pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+    return None
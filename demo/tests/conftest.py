@@ -0,0 +1,7 @@
+#coding: utf-8
+'''demo下的模块以脚本目录为导入路径（如from flow_control import ...）'''
+
+import os.path as osp
+import sys
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
@@ -0,0 +1,150 @@
+#coding: utf-8
+
+import os
+import asyncio
+
+import msg_pb2
+from msg_udp_handler import MSG_CMD_STRUCT, MSG_GET_CMD_RESPONS
+from async_msg_udp_handler import AsyncMsgUdpHandler
+from async_dev_agent import AsyncDevAgent
+
+
+class FakeDev(object):
+    '''在事件循环中应答属性请求和切换版本请求的假设备'''
+    def __init__(self, handler):
+        super(FakeDev, self).__init__()
+        self.handler = handler
+        self.temperature = 40.5
+        # 回复切换版本前先发送一条无关的消息
+        self.send_noise = False
+        for cmd, callback in [
+                (msg_pb2.MSG_CMD_GET_PROPERTY, self.handleGetProp),
+                (msg_pb2.MSG_CMD_SET_PROPERTY, self.handleSetProp),
+                (msg_pb2.MSG_CMD_SWITCH_APP_VERSION, self.handleSwitch)]:
+            handler.setMsgCallback(cmd, callback)
+
+    def parseMsg(self, msg, req):
+        req.ParseFromString(bytes(msg['payload'][2:]))
+        msg_id = msg['last_frame_head']['msg_id']
+        self.handler.freeMsg(msg)
+        return msg_id
+
+    def handleGetProp(self, msg):
+        req = msg_pb2.ReqGetProp()
+        rsp = msg_pb2.RspGetProp()
+        rsp.req_msg_id = self.parseMsg(msg, req)
+        rsp.prop_id = req.prop_id
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        rsp.temperature = self.temperature
+        self.handler.sendRspMsg(msg_pb2.MSG_CMD_GET_PROPERTY, rsp)
+
+    def handleSetProp(self, msg):
+        req = msg_pb2.ReqSetProp()
+        rsp = msg_pb2.RspSetProp()
+        rsp.req_msg_id = self.parseMsg(msg, req)
+        rsp.prop_id = req.prop_id
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        self.handler.sendRspMsg(msg_pb2.MSG_CMD_SET_PROPERTY, rsp)
+
+    def handleSwitch(self, msg):
+        req = msg_pb2.ReqSwitchAppVersion()
+        self.parseMsg(msg, req)
+        if self.send_noise:
+            self.handler.sendMsg(msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                    msg_pb2.ReqHumanPoseStream(img_idx=1))
+        rsp = msg_pb2.RspSwitchAppVersion()
+        rsp.app_version = req.app_version
+        rsp.status = msg_pb2.MSG_STATUS_OK
+        self.handler.sendRspMsg(msg_pb2.MSG_CMD_SWITCH_APP_VERSION, rsp)
+
+
+async def openPair(**kwargs):
+    '''返回(设备端, 主机端)，主机端发往设备端'''
+    dev = await AsyncMsgUdpHandler(('127.0.0.1', 0), None, **kwargs).open()
+    host = await AsyncMsgUdpHandler(('127.0.0.1', 0),
+            dev.sock.getsockname(), **kwargs).open()
+    return dev, host
+
+
+def testReassembleFragmentedMsg():
+    async def run():
+        dev, host = await openPair(frame_max_bytes=256)
+        try:
+            payload = os.urandom(5000)
+            host.sendMsgBufs(0x1234, [payload])
+            msg = await dev.recvMsg(1, cmd=0x1234)
+            assert msg['last_frame_head']['frame_total'] > 1
+            assert bytes(msg['payload']) == MSG_CMD_STRUCT.pack(0x1234) + payload
+            dev.freeMsg(msg)
+        finally:
+            dev.close()
+            host.close()
+    asyncio.run(run())
+
+
+def testGetSetPropAgainstFakeDev():
+    async def run():
+        dev, host = await openPair(socket_timeout=1)
+        try:
+            FakeDev(dev)
+            agent = AsyncDevAgent(host)
+            temperature, rsps = await asyncio.gather(agent.getTemperature(),
+                    agent.getProps([msg_pb2.MSG_PROP_DEVICE_STATUS,
+                        msg_pb2.MSG_PROP_TEMPERATURE]))
+            assert temperature == 40.5
+            assert [rsp.prop_id for rsp in rsps] == [
+                    msg_pb2.MSG_PROP_DEVICE_STATUS, msg_pb2.MSG_PROP_TEMPERATURE]
+            assert await agent.enableAi()
+        finally:
+            dev.close()
+            host.close()
+    asyncio.run(run())
+
+
+def testSwitchAppVersionIgnoresOtherMsgs():
+    async def run():
+        dev, host = await openPair(socket_timeout=1)
+        try:
+            FakeDev(dev).send_noise = True
+            agent = AsyncDevAgent(host)
+            assert await agent.switchAppVersion('v2')
+            # 无关的消息留在队列中
+            msg = await host.recvMsg(1)
+            assert MSG_CMD_STRUCT.unpack_from(msg['payload'])[0] == \
+                    msg_pb2.MSG_CMD_STREAM_HUMAN_POSE
+            assert not host.msg_waiters[
+                    MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_SWITCH_APP_VERSION)]
+        finally:
+            dev.close()
+            host.close()
+    asyncio.run(run())
+
+
+def testIterHumanPose():
+    async def run():
+        stream, sender = await openPair(socket_timeout=0.01)
+        try:
+            agent = AsyncDevAgent(await AsyncMsgUdpHandler(('127.0.0.1', 0),
+                    None).open(), stream)
+            for img_idx in range(3):
+                sender.sendMsg(msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                        msg_pb2.ReqHumanPoseStream(img_idx=img_idx))
+            idxs = [img_idx async for img_idx, _ in agent.iterHumanPose(0.2)]
+            assert idxs == [0, 1, 2]
+
+            # timeout为None时一直等待，不受socket_timeout影响
+            async def sendLater():
+                await asyncio.sleep(0.1)
+                sender.sendMsg(msg_pb2.MSG_CMD_STREAM_HUMAN_POSE,
+                        msg_pb2.ReqHumanPoseStream(img_idx=7))
+            task = asyncio.create_task(sendLater())
+            it = agent.iterHumanPose()
+            img_idx, _ = await asyncio.wait_for(it.__anext__(), 2)
+            assert img_idx == 7
+            await it.aclose()
+            await task
+            agent.msg_handler.close()
+        finally:
+            stream.close()
+            sender.close()
+    asyncio.run(run())
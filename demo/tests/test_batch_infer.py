@@ -0,0 +1,80 @@
+#coding: utf-8
+
+import time
+import threading
+import collections
+
+import cv2
+import numpy as np
+import pytest
+
+import msg_pb2
+from channels import RingChannel, POLICY_DROP_OLDEST
+from flow_control import FrameCreditWindow
+from stream_codec import decodeHumanPoseStream
+from batch_infer import BatchInferService, checkImgSize, main
+
+
+def makePose(img_idx):
+    return decodeHumanPoseStream(
+            msg_pb2.ReqHumanPoseStream(img_idx=img_idx).SerializeToString())
+
+
+def makeService(records):
+    pose_recv_queue = RingChannel(1, POLICY_DROP_OLDEST, 'pose_recv')
+    service = BatchInferService(None, None, pose_recv_queue,
+            FrameCreditWindow(4), records.append, lambda idx: {'idx': idx})
+    return service, pose_recv_queue
+
+
+def testDroppedPoseIsNotTimeout():
+    records = []
+    service, pose_recv_queue = makeService(records)
+    now = time.monotonic()
+    pending = collections.OrderedDict((idx, now) for idx in range(3))
+    # 接收队列满时丢弃帧0的Pose
+    pose_recv_queue.put((0, makePose(0)))
+    pose_recv_queue.put((1, makePose(1)))
+    service.handlePose(pending, *pose_recv_queue.get())
+    # 帧2没有收到Pose
+    del pending[2]
+    service.writeMissing(2)
+    assert [(r['idx'], r.get('error')) for r in records] == [
+            (0, 'dropped'), (1, None), (2, 'timeout')]
+    summary = service.getSummary()
+    assert (summary['dropped'], summary['received'], summary['missing']) == \
+            (1, 1, 1)
+
+
+def testWaitsForPendingDropRelease():
+    # 通道已计数但release尚未调用时，等待release后再判断
+    service, pose_recv_queue = makeService([])
+    pose_recv_queue.stats['drops'] += 1
+    timer = threading.Timer(0.05, service.onPoseDropped, ((5, None),))
+    timer.start()
+    assert service.isPoseDropped(5)
+    assert not service.isPoseDropped(6)
+    timer.join()
+
+
+def testCheckImgSize():
+    assert checkImgSize(640, 480) is None
+    assert checkImgSize(1920, 1088) is not None
+    assert 'multiples of 16' in checkImgSize(100, 64)
+
+
+def testInvalidVideoSizeRejected(tmp_path, monkeypatch):
+    video_path = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10,
+            (100, 60))
+    if not writer.isOpened():
+        pytest.skip('VideoWriter is not available')
+    for _ in range(3):
+        writer.write(np.zeros((60, 100, 3), np.uint8))
+    writer.release()
+    # 应在连接设备之前退出
+    def _connect(*args, **kwargs):
+        raise AssertionError('video size is not checked')
+    monkeypatch.setattr('batch_infer.MsgUdpHandler', _connect)
+    with pytest.raises(SystemExit):
+        main(video_path, output=str(tmp_path / 'poses.jsonl'))
@@ -0,0 +1,98 @@
+#coding: utf-8
+
+import queue
+import threading
+import time
+
+import pytest
+
+from channels import RingChannel, LatestSlot, POLICY_DROP_OLDEST, \
+    getChannelStats
+
+
+def testFifoAndEmpty():
+    channel = RingChannel(3, name='fifo')
+    for i in range(3):
+        channel.put(i)
+    assert channel.full() and channel.qsize() == 3
+    assert [channel.get() for _ in range(3)] == [0, 1, 2]
+    assert channel.empty()
+    with pytest.raises(queue.Empty):
+        channel.get_nowait()
+    with pytest.raises(queue.Empty):
+        channel.get(timeout=0.01)
+
+
+def testBlockPolicy():
+    channel = RingChannel(1)
+    channel.put(1)
+    with pytest.raises(queue.Full):
+        channel.put_nowait(2)
+    with pytest.raises(queue.Full):
+        channel.put(2, timeout=0.01)
+    with pytest.raises(ValueError):
+        channel.put(2, timeout=-1)
+    # 取出后阻塞的put继续
+    threading.Timer(0.05, channel.get).start()
+    channel.put(2, timeout=1)
+    assert channel.get() == 2
+    assert channel.getStats() == {'puts': 2, 'gets': 2, 'size': 0}
+
+
+def testDropOldestReleases():
+    released = []
+    channel = RingChannel(2, POLICY_DROP_OLDEST, 'recv', released.append)
+    for i in range(5):
+        channel.put_nowait(i)
+    assert released == [0, 1, 2]
+    assert [channel.get(), channel.get()] == [3, 4]
+    assert channel.getStats()['drops'] == 3
+
+
+def testLatestSlot():
+    released = []
+    slot = LatestSlot('latest', released.append)
+    slot.put(1)
+    slot.put(2)
+    assert slot.get() == 2 and released == [1]
+    assert slot.maxsize == 1
+
+
+def testClear():
+    released = []
+    channel = RingChannel(3, release=released.append)
+    channel.put(1)
+    channel.put(2)
+    assert channel.clear() == 2
+    assert released == [1, 2] and channel.empty()
+    assert channel.getStats()['drops'] == 2
+
+
+def testGetWakesOnPut():
+    channel = RingChannel(1)
+    threading.Timer(0.05, channel.put, ('x', )).start()
+    t = time.monotonic()
+    assert channel.get(timeout=2) == 'x'
+    assert time.monotonic() - t < 1
+
+
+@pytest.mark.parametrize('maxsize', [1, 4])
+def testSpscOrder(maxsize):
+    channel = RingChannel(maxsize)
+    out = []
+    def _consume():
+        for _ in range(5000):
+            out.append(channel.get(timeout=5))
+    consumer = threading.Thread(target=_consume)
+    consumer.start()
+    for i in range(5000):
+        channel.put(i, timeout=5)
+    consumer.join()
+    assert out == list(range(5000))
+
+
+def testGetChannelStats():
+    a, b = RingChannel(1, name='a'), LatestSlot('b')
+    b.put(1)
+    assert getChannelStats([a, b]) == {'a': {'size': 0},
+            'b': {'puts': 1, 'size': 1}}
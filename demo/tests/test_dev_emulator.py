@@ -0,0 +1,49 @@
+#coding: utf-8
+
+import cv2
+import numpy as np
+
+import msg_pb2
+from dev_agent import DevAgent
+from dev_emulator import DevEmulator
+from msg_udp_handler import MsgUdpHandler, MSG_CMD_STRUCT, MSG_GET_CMD_RESPONS
+from stream_codec import encodeMediaStreamPrefix, decodeHumanPoseStream
+
+
+def testEmulatorSmoke():
+    emulator = DevEmulator('127.0.0.1', 0, 0, fps=100, latency=0.01)
+    emulator.start()
+    msg_handler = MsgUdpHandler(('127.0.0.1', 0), emulator.getCtrlAddr(), 1)
+    stream_handler = MsgUdpHandler(('127.0.0.1', 0), emulator.getStreamAddr(), 1)
+    try:
+        dev_agent = DevAgent(msg_handler)
+        base_info = dev_agent.getDevBaseInfo()
+        assert base_info.product_model == 'HumanPose Emulator'
+
+        with dev_agent.pipeline():
+            dev_agent.enableImgStreamSource()
+            dev_agent.setStreamTargetAddr('127.0.0.1',
+                    stream_handler.sock.getsockname()[1])
+            dev_agent.play()
+
+        _, jpg = cv2.imencode('.jpg', np.zeros((64, 128, 3), np.uint8))
+        prefix = encodeMediaStreamPrefix(7, jpg.nbytes)
+        stream_handler.sendMsgBufs(msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM,
+                [prefix, jpg.data])
+        # 收到图片的回复和一帧Pose，顺序不定
+        msgs = {}
+        for _ in range(2):
+            msg = stream_handler.recvMsg()
+            assert msg is not None
+            msgs[MSG_CMD_STRUCT.unpack_from(msg['payload'])[0]] = \
+                    bytes(msg['payload'][2:])
+            stream_handler.freeMsg(msg)
+        rsp = msg_pb2.RspMediaStream()
+        rsp.ParseFromString(msgs[MSG_GET_CMD_RESPONS(
+                msg_pb2.MSG_CMD_MEDIA_SOURCE_STREAM)])
+        assert (rsp.img_idx, rsp.status) == (7, msg_pb2.MSG_STATUS_OK)
+        frame = decodeHumanPoseStream(msgs[msg_pb2.MSG_CMD_STREAM_HUMAN_POSE])
+        assert frame.img_idx == 7 and frame.getPersonNum() == 1
+    finally:
+        emulator.stop()
+        emulator.join()
@@ -0,0 +1,117 @@
+#coding: utf-8
+
+import contextlib
+from concurrent.futures import Future
+
+import pytest
+
+import msg_pb2
+from dev_profile import loadProfile, saveProfile, makeProfileItems, \
+    makeSetPropReq, applyProfile
+
+
+PROFILE = {
+    'MSG_PROP_CAM_PARAM': {'width': 1280, 'height': 720, 'fps': 30},
+    'ENABLE_AI': True,
+    'MSG_PROP_CAM_CTRL': [{'id': 1, 'value': 128}, {'id': 2, 'value': 64}],
+}
+
+
+class FakeDevAgent(object):
+    '''按prop_id(和相机Ctrl id)保存属性当前值，记录设置请求'''
+    def __init__(self):
+        super(FakeDevAgent, self).__init__()
+        self.rsps = {}
+        self.set_reqs = []
+        self.fail_get = set()
+        self.fail_set = set()
+
+    def addRsp(self, prop_id, **values):
+        rsp = msg_pb2.RspGetProp(prop_id=prop_id,
+                status=msg_pb2.MSG_STATUS_OK, **values)
+        key = (prop_id, rsp.cam_ctrl.id) \
+                if prop_id == msg_pb2.MSG_PROP_CAM_CTRL else (prop_id, None)
+        self.rsps[key] = rsp
+
+    def invalidatePropCache(self, prop_id=None):
+        pass
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        yield self
+
+    def getProp(self, prop_id, **args):
+        cam_ctrl_id = args['cam_ctrl']['id'] if 'cam_ctrl' in args else None
+        future = Future()
+        future.set_result(None if prop_id in self.fail_get else
+                self.rsps.get((prop_id, cam_ctrl_id)))
+        return future
+
+    def setProps(self, reqs):
+        self.set_reqs.extend(reqs)
+        return [req.prop_id not in self.fail_set for req in reqs]
+
+
+def testProfileRoundTrip(tmp_path):
+    path = str(tmp_path / 'profile.json')
+    saveProfile(PROFILE, path)
+    assert loadProfile(path) == PROFILE
+
+
+def testMakeProfileItems():
+    items = makeProfileItems(PROFILE)
+    assert [(prop_id, args) for prop_id, args, _ in items] == [
+            (msg_pb2.MSG_PROP_CAM_PARAM, {}),
+            (msg_pb2.MSG_PROP_ENABLE_AI, {}),
+            (msg_pb2.MSG_PROP_CAM_CTRL, {'cam_ctrl': {'id': 1}}),
+            (msg_pb2.MSG_PROP_CAM_CTRL, {'cam_ctrl': {'id': 2}})]
+    assert items[3][2] == {'id': 2, 'value': 64}
+    with pytest.raises(ValueError):
+        makeProfileItems({'NOT_A_PROP': 1})
+    with pytest.raises(ValueError):
+        makeProfileItems({'TEMPERATURE': 40})
+
+
+def testMakeSetPropReqMergesCurrentValue():
+    rsp = msg_pb2.RspGetProp()
+    rsp.cam_param.width = 640
+    rsp.cam_param.height = 480
+    rsp.cam_param.fps = 25
+    req = makeSetPropReq(msg_pb2.MSG_PROP_CAM_PARAM, {'fps': 30}, rsp)
+    assert req.prop_id == msg_pb2.MSG_PROP_CAM_PARAM
+    assert (req.cam_param.width, req.cam_param.height, req.cam_param.fps) == \
+            (640, 480, 30)
+    req = makeSetPropReq(msg_pb2.MSG_PROP_CAM_PARAM, {'fps': 30})
+    assert (req.cam_param.width, req.cam_param.fps) == (0, 30)
+
+
+def testApplyProfileSetsOnlyChanged():
+    dev_agent = FakeDevAgent()
+    rsp = msg_pb2.RspGetProp()
+    rsp.cam_param.width, rsp.cam_param.height, rsp.cam_param.fps = 1280, 720, 30
+    dev_agent.addRsp(msg_pb2.MSG_PROP_CAM_PARAM, cam_param=rsp.cam_param)
+    dev_agent.addRsp(msg_pb2.MSG_PROP_ENABLE_AI, is_enable_ai=False)
+    rsp.cam_ctrl.id, rsp.cam_ctrl.value = 1, 128
+    dev_agent.addRsp(msg_pb2.MSG_PROP_CAM_CTRL, cam_ctrl=rsp.cam_ctrl)
+    # 相机Ctrl 2读取失败，按有变化处理
+
+    report = applyProfile(dev_agent, PROFILE)
+    assert report['unchanged'] == ['MSG_PROP_CAM_PARAM', 'MSG_PROP_CAM_CTRL[1]']
+    assert report['changed'] == ['MSG_PROP_ENABLE_AI', 'MSG_PROP_CAM_CTRL[2]']
+    assert report['failed'] == ['MSG_PROP_CAM_CTRL[2]']
+    assert [req.prop_id for req in dev_agent.set_reqs] == [
+            msg_pb2.MSG_PROP_ENABLE_AI, msg_pb2.MSG_PROP_CAM_CTRL]
+    assert dev_agent.set_reqs[0].is_enable_ai
+    assert dev_agent.set_reqs[1].cam_ctrl.id == 2
+
+
+def testApplyProfileDryRunAndSetFailure():
+    dev_agent = FakeDevAgent()
+    dev_agent.addRsp(msg_pb2.MSG_PROP_ENABLE_AI, is_enable_ai=False)
+    profile = {'ENABLE_AI': True}
+    report = applyProfile(dev_agent, profile, dry_run=True)
+    assert report['changed'] == ['MSG_PROP_ENABLE_AI']
+    assert dev_agent.set_reqs == []
+    dev_agent.fail_set.add(msg_pb2.MSG_PROP_ENABLE_AI)
+    report = applyProfile(dev_agent, profile)
+    assert report['failed'] == ['MSG_PROP_ENABLE_AI']
@@ -0,0 +1,94 @@
+#coding: utf-8
+
+import time
+
+import pytest
+
+from flow_control import FrameCreditWindow, diffImgIdx, IMG_IDX_MOD
+
+
+def testDiffImgIdxWraps():
+    assert diffImgIdx(5, 3) == 2
+    assert diffImgIdx(0, IMG_IDX_MOD - 1) == 1
+    assert diffImgIdx(IMG_IDX_MOD - 1, 0) == -1
+
+
+def testCredits():
+    window = FrameCreditWindow(2, max_window=2)
+    window.onSend(0)
+    window.onSend(1)
+    assert not window.hasCredit()
+    assert window.ack(0)
+    assert window.hasCredit()
+    assert not window.ack(0)
+    assert window.getStats()['dup_acks'] == 1
+
+
+def testAckDropsEarlierFrames():
+    window = FrameCreditWindow(4, max_window=4)
+    for idx in [IMG_IDX_MOD - 2, IMG_IDX_MOD - 1, 0]:
+        window.onSend(idx, now=0)
+    # 回绕后确认0，更早的两帧视为丢失
+    window.ack(0, now=0.01)
+    assert sorted(window.popDropped()) == [IMG_IDX_MOD - 2, IMG_IDX_MOD - 1]
+    stats = window.getStats()
+    assert stats['losts'] == 2 and stats['in_flight'] == 0
+    assert window.popDropped() == []
+
+
+def testExpire():
+    window = FrameCreditWindow(2, max_window=4, ack_timeout=0.5)
+    now = time.monotonic()
+    window.onSend(0, now=now - 0.6)
+    window.onSend(1, now=now)
+    assert window.expire(now=now) == [0]
+    assert window.getStats()['timeouts'] == 1 and window.hasCredit()
+    assert window.popDropped() == [0]
+
+
+def testReject():
+    window = FrameCreditWindow(None, max_window=4)
+    window.window = 2
+    window.onSend(0)
+    window.onSend(1)
+    assert window.reject(1)
+    assert not window.reject(1)
+    # 被拒绝时自适应窗口减1
+    stats = window.getStats()
+    assert stats['window'] == 1 and stats['rejects'] == 1
+    assert window.popDropped() == [1]
+
+
+def testAckedFramesNotDropped():
+    # 已确认的帧不会因为超时被报告为丢失
+    window = FrameCreditWindow(2, max_window=2, ack_timeout=0.1)
+    window.onSend(0, now=0)
+    window.ack(0, now=0.01)
+    assert window.expire(now=10) == []
+    assert window.popDropped() == []
+
+
+@pytest.mark.parametrize('rtt,expected', [(0.03, 'inc'), (0.2, 'dec')])
+def testAdaptiveWindow(rtt, expected):
+    window = FrameCreditWindow(None, min_window=1, max_window=8)
+    start = window.window
+    # 先测得最小往返时间0.03s
+    now = 0.
+    for idx in range(start):
+        window.onSend(idx, now=now)
+        window.ack(idx, now=now + 0.03)
+    window.window = start = 4
+    for idx in range(start, start * 2):
+        window.onSend(idx, now=now)
+    for idx in range(start, start * 2):
+        window.ack(idx, now=now + rtt)
+    assert window.window == (start + 1 if expected == 'inc' else start - 1)
+
+
+def testWaitCredit():
+    window = FrameCreditWindow(1, max_window=1, ack_timeout=0.05)
+    window.onSend(0)
+    assert not window.waitCredit(timeout=0.01)
+    # 超时未确认的帧归还信用
+    assert window.waitCredit(timeout=1)
+    assert window.popDropped() == [0]
@@ -0,0 +1,116 @@
+#coding: utf-8
+
+import queue
+import threading
+import time
+
+import pytest
+
+from flow_control import IMG_IDX_MOD
+from frame_sync import FrameSynchronizer
+
+
+def testMatchInAnyOrder():
+    sync = FrameSynchronizer(max_ready=4)
+    sync.put(True, 1, 'img1')
+    sync.put(False, 2, 'pose2')
+    sync.put(False, 1, 'pose1')
+    sync.put(True, 2, 'img2')
+    assert tuple(sync.get(0)) == (1, 'img1', 'pose1')
+    assert tuple(sync.get(0)) == (2, 'img2', 'pose2')
+    assert sync.get(0) is None
+    assert sync.getStats()['matched'] == 2
+
+
+def testMatchSkipsEarlierFrames():
+    released = []
+    sync = FrameSynchronizer(max_ready=4, release_img=released.append)
+    sync.put(True, 1, 'img1')
+    sync.put(False, 2, 'pose2')
+    sync.put(True, 3, 'img3')
+    sync.put(False, 3, 'pose3')
+    # 3配对后，1和2不会再配对
+    assert tuple(sync.get(0)) == (3, 'img3', 'pose3')
+    assert released == ['img1']
+    assert sync.getStats()['skipped'] == 2
+    # 更早的数据到达时丢弃
+    sync.put(True, 2, 'img2')
+    assert released == ['img1', 'img2']
+    assert sync.getStats()['late'] == 1
+
+
+def testWrapAround():
+    sync = FrameSynchronizer(max_ready=4)
+    for idx in [IMG_IDX_MOD - 1, 0]:
+        sync.put(True, idx, 'img')
+        sync.put(False, idx, 'pose')
+    assert [sync.get(0).img_idx for _ in range(2)] == [IMG_IDX_MOD - 1, 0]
+
+
+def testTimeouts():
+    sync = FrameSynchronizer(timeout=0.05, max_ready=4)
+    sync.put(True, 1, 'img1')
+    sync.put(False, 2, 'pose2')
+    t = time.monotonic()
+    # 超时后按img_idx顺序输出，缺少的一项为None
+    assert tuple(sync.get(1)) == (1, 'img1', None)
+    assert tuple(sync.get(1)) == (2, None, 'pose2')
+    assert time.monotonic() - t < 0.5
+    stats = sync.getStats()
+    assert stats['pose_timeouts'] == 1 and stats['img_timeouts'] == 1
+
+
+def testEvictOldest():
+    released = []
+    sync = FrameSynchronizer(max_frames=2, release_img=released.append)
+    for idx in range(3):
+        sync.put(True, idx, 'img%d' % idx)
+    assert released == ['img0']
+    stats = sync.getStats()
+    assert stats['evicted'] == 1 and stats['pending_imgs'] == 2
+
+
+def testLatestOnlyDropsReady():
+    released = []
+    sync = FrameSynchronizer(max_ready=1, release_img=released.append)
+    for idx in range(3):
+        sync.put(True, idx, 'img%d' % idx)
+        sync.put(False, idx, 'pose%d' % idx)
+    assert sync.get(0).img_idx == 2
+    assert released == ['img0', 'img1']
+    assert sync.getStats()['ready_drops'] == 2
+
+
+def testBlockModeKeepsEveryFrame():
+    sync = FrameSynchronizer(is_block=True)
+    shown = []
+    def _consume():
+        for _ in range(20):
+            shown.append(sync.get(2).img_idx)
+    consumer = threading.Thread(target=_consume)
+    consumer.start()
+    for idx in range(20):
+        assert sync.put(True, idx, 'img', timeout=2)
+        assert sync.put(False, idx, 'pose', timeout=2)
+    consumer.join()
+    assert shown == list(range(20))
+
+
+def testBlockModePutTimeout():
+    sync = FrameSynchronizer(is_block=True)
+    sync.put(True, 0, 'img')
+    sync.put(False, 0, 'pose')
+    assert not sync.put(True, 1, 'img', timeout=0.01)
+    with pytest.raises(queue.Full):
+        sync.getImgQueue().put((1, 'img'), timeout=0.01)
+
+
+def testInputQueues():
+    sync = FrameSynchronizer()
+    img_queue, pose_queue = sync.getImgQueue(), sync.getPoseQueue()
+    assert not img_queue.full() and img_queue.empty()
+    with pytest.raises(queue.Empty):
+        img_queue.get_nowait()
+    img_queue.put_nowait((5, 'img'))
+    pose_queue.put((5, 'pose'))
+    assert tuple(sync.get(0)) == (5, 'img', 'pose')
@@ -0,0 +1,74 @@
+#coding: utf-8
+
+import json
+
+import numpy as np
+import pytest
+
+from frame_tracer import FrameTracer
+
+
+def testMarkAndFinish():
+    observed = []
+    tracer = FrameTracer(max_events=10)
+    tracer.setObserver(lambda name, d: observed.append((name, d)))
+    tracer.mark(1, 'read_start', t=1.0)
+    tracer.mark(1, 'read', t=1.5)
+    # 开始时间点缺失的阶段不记录
+    tracer.mark(1, 'sent', t=2.0)
+    tracer.mark(1, 'recv', t=3.0)
+    tracer.finish(1)
+    assert observed == [('capture', 0.5), ('device', 1.0), ('total', 2.0)]
+    assert 1 not in tracer.traces
+    # 重复finish和未知帧被忽略
+    tracer.finish(1)
+    tracer.finish(2)
+    assert tracer.stats['finished'] == 1
+
+
+def testEvictPending():
+    tracer = FrameTracer(max_pending=2)
+    for img_idx in range(3):
+        tracer.mark(img_idx, 'read_start', t=0)
+    assert list(tracer.traces) == [1, 2]
+    assert tracer.stats['evicted'] == 1
+
+
+def testStatsPercentiles():
+    tracer = FrameTracer(window=100)
+    durations = np.arange(1, 101) / 1000.
+    for img_idx, d in enumerate(durations):
+        tracer.mark(img_idx, 'encode_start', t=10.)
+        tracer.mark(img_idx, 'encoded', t=10. + d)
+    stats = tracer.getStats()
+    assert list(stats) == ['encode']
+    expected = np.percentile(durations * 1000, [50, 95, 99])
+    assert stats['encode']['count'] == 100
+    assert [stats['encode'][k] for k in ['p50_ms', 'p95_ms', 'p99_ms']] == \
+            pytest.approx(expected, abs=1e-3)
+    # 只保留最近window个
+    tracer.mark(100, 'encode_start', t=0.)
+    tracer.mark(100, 'encoded', t=1.)
+    assert tracer.getStats()['encode']['count'] == 100
+
+
+def testChromeTrace(tmp_path):
+    tracer = FrameTracer(max_events=1)
+    t0 = tracer.start_time
+    for img_idx in [3, 4]:
+        tracer.mark(img_idx, 'sent', t=t0 + img_idx)
+        tracer.mark(img_idx, 'recv', t=t0 + img_idx + 0.25)
+        tracer.finish(img_idx)
+    path = str(tmp_path / 'trace.json')
+    tracer.saveChromeTrace(path)
+    with open(path, encoding='utf-8') as f:
+        trace = json.load(f)
+    assert trace['displayTimeUnit'] == 'ms'
+    # 只保留最近max_events帧，每个完整阶段一对b/e事件，时间单位为微秒
+    assert trace['traceEvents'] == [
+        {'name': 'device', 'cat': 'frame', 'ph': 'b', 'id': 4, 'pid': 0,
+            'tid': 0, 'ts': 4e6},
+        {'name': 'device', 'cat': 'frame', 'ph': 'e', 'id': 4, 'pid': 0,
+            'tid': 0, 'ts': 4.25e6},
+    ]
+    assert FrameTracer().getChromeTrace()['traceEvents'] == []
@@ -0,0 +1,39 @@
+#coding: utf-8
+
+from concurrent.futures import Future
+
+import numpy as np
+
+from demo import ImgSendService
+from flow_control import FrameCreditWindow
+
+
+class FakeMsgHandler(object):
+    def __init__(self):
+        super(FakeMsgHandler, self).__init__()
+        self.sent = []
+
+    def sendMsgBufs(self, cmd, bufs):
+        self.sent.append((cmd, b''.join(bytes(buf) for buf in bufs)))
+
+
+def testEncodeFailureRejectsCredit():
+    msg_handler = FakeMsgHandler()
+    flow_window = FrameCreditWindow(1)
+    service = ImgSendService(msg_handler, None, flow_window=flow_window)
+    future = Future()
+    future.set_exception(RuntimeError('encode failed'))
+    flow_window.onSend(5)
+    assert not flow_window.hasCredit()
+    service.sendImg(5, future)
+    # 不发送，归还信用，记为被拒绝的帧
+    assert msg_handler.sent == []
+    assert service.stats['encode_errors'] == 1 and service.stats['imgs'] == 0
+    assert flow_window.hasCredit()
+    assert flow_window.popDropped() == [5]
+
+    future = Future()
+    future.set_result(np.frombuffer(b'\xff\xd8jpeg\xff\xd9', np.uint8))
+    flow_window.onSend(6)
+    service.sendImg(6, future)
+    assert len(msg_handler.sent) == 1 and service.stats['imgs'] == 1
@@ -0,0 +1,94 @@
+#coding: utf-8
+
+import time
+import queue
+import threading
+import collections
+
+from flow_control import FrameCreditWindow
+from demo import MediaSourceService
+
+
+class FakeDevice(threading.Thread):
+    '''从发送队列取出图片，latency秒后确认并回复Pose（Pose为img_idx），
+    skip_idxs中的帧不回复'''
+    def __init__(self, img_send_queue, pose_recv_queue, flow_window,
+            latency=0.03, skip_idxs=()):
+        super(FakeDevice, self).__init__(daemon=True)
+        self.img_send_queue = img_send_queue
+        self.pose_recv_queue = pose_recv_queue
+        self.flow_window = flow_window
+        self.latency = latency
+        self.skip_idxs = set(skip_idxs)
+        self.is_running = True
+
+    def run(self):
+        # 按顺序处理，多帧同时在途：(回复时间, img_idx)
+        pending = collections.deque()
+        while self.is_running:
+            try:
+                img_idx, _ = self.img_send_queue.get(timeout=0.005)
+            except queue.Empty:
+                pass
+            else:
+                pending.append((time.monotonic() + self.latency, img_idx))
+            while pending and pending[0][0] <= time.monotonic():
+                _, img_idx = pending.popleft()
+                if img_idx in self.skip_idxs:
+                    continue
+                self.flow_window.ack(img_idx)
+                self.pose_recv_queue.put((img_idx, img_idx))
+
+
+def runService(frame_num, ack_timeout, stall_idx=None, stall_time=0,
+        skip_idxs=()):
+    '''运行MediaSourceService，显示stall_idx时阻塞stall_time秒，返回显示的img_idx'''
+    img_read_queue = queue.Queue()
+    for i in range(frame_num):
+        img_read_queue.put((i, b'img%d' % i))
+    img_read_queue.put(None)
+    img_send_queue = queue.Queue(1)
+    pose_recv_queue = queue.Queue()
+    # 显示队列只能放一帧，显示阻塞时MediaSourceService随之阻塞
+    img_show_queue, pose_show_queue = queue.Queue(1), queue.Queue(1)
+    flow_window = FrameCreditWindow(3, max_window=3, ack_timeout=ack_timeout)
+    device = FakeDevice(img_send_queue, pose_recv_queue, flow_window,
+            skip_idxs=skip_idxs)
+    service = MediaSourceService(img_read_queue, img_send_queue,
+            img_show_queue, pose_recv_queue, pose_show_queue, flow_window)
+    device.start()
+    service.start()
+    shown = []
+    deadline = time.monotonic() + 10
+    while (service.is_alive() or not img_show_queue.empty()) and \
+            time.monotonic() < deadline:
+        try:
+            img_idx, img = img_show_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        pose = pose_show_queue.get(timeout=1)
+        assert img == b'img%d' % img_idx
+        assert pose == (img_idx, img_idx)
+        shown.append(img_idx)
+        if img_idx == stall_idx:
+            time.sleep(stall_time)
+    service.stop()
+    device.is_running = False
+    service.join()
+    return shown
+
+
+def testAllFramesShown():
+    assert runService(8, ack_timeout=1.0) == list(range(8))
+
+
+def testDisplayStallLongerThanAckTimeout():
+    # 显示阻塞超过ack_timeout时，已收到Pose的帧仍要显示
+    assert runService(8, ack_timeout=0.2, stall_idx=2, stall_time=0.6) == \
+            list(range(8))
+
+
+def testUnansweredFrameDropped():
+    # 设备不回复的帧超时后丢弃，后续帧正常显示
+    shown = runService(6, ack_timeout=0.2, skip_idxs=[5])
+    assert shown == list(range(5))
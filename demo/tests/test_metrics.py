@@ -0,0 +1,67 @@
+#coding: utf-8
+
+import pytest
+
+from frame_tracer import FrameTracer
+from metrics import MetricsRegistry, observeTracer
+
+
+def testRender():
+    registry = MetricsRegistry()
+    frames = registry.counter('hpose_frames_total', 'Frames sent',
+            {'dir': 'tx'})
+    frames.inc(3)
+    registry.gauge('hpose_temperature_celsius', 'Device temperature',
+            func=lambda: 41.5)
+    # func返回None时不输出
+    registry.gauge('hpose_unknown', 'Not available', func=lambda: None)
+    latency = registry.histogram('hpose_latency_seconds', 'Latency',
+            buckets=(0.01, 0.1))
+    for value in [0.005, 0.01, 0.05, 3.]:
+        latency.observe(value)
+    assert registry.render() == '\n'.join([
+        '# HELP hpose_frames_total Frames sent',
+        '# TYPE hpose_frames_total counter',
+        'hpose_frames_total{dir="tx"} 3',
+        '# HELP hpose_temperature_celsius Device temperature',
+        '# TYPE hpose_temperature_celsius gauge',
+        'hpose_temperature_celsius 41.5',
+        '# HELP hpose_unknown Not available',
+        '# TYPE hpose_unknown gauge',
+        '# HELP hpose_latency_seconds Latency',
+        '# TYPE hpose_latency_seconds histogram',
+        # 分桶为累计值，等于上界的值计入该桶
+        'hpose_latency_seconds_bucket{le="0.01"} 2',
+        'hpose_latency_seconds_bucket{le="0.1"} 3',
+        'hpose_latency_seconds_bucket{le="+Inf"} 4',
+        'hpose_latency_seconds_sum 3.065',
+        'hpose_latency_seconds_count 4',
+    ]) + '\n'
+
+
+def testLabelEscapingAndTypeConflict():
+    registry = MetricsRegistry()
+    registry.counter('hpose_errors_total', 'Errors',
+            {'msg': 'a "b"\\c\nd'}).inc()
+    assert 'hpose_errors_total{msg="a \\"b\\"\\\\c\\nd"} 1' in \
+            registry.render().splitlines()
+    with pytest.raises(ValueError):
+        registry.gauge('hpose_errors_total', 'Errors')
+
+
+def testObserveTracer():
+    registry = MetricsRegistry()
+    tracer = FrameTracer()
+    histograms = observeTracer(registry, tracer, buckets=(0.1, 1.))
+    tracer.mark(1, 'sent', t=0.)
+    tracer.mark(1, 'recv', t=0.5)
+    tracer.finish(1)
+    assert sorted(histograms) == ['device', 'total']
+    lines = registry.render().splitlines()
+    # 同名直方图只输出一次HELP/TYPE，各阶段以stage标签区分
+    assert lines.count('# TYPE hpose_stage_latency_seconds histogram') == 1
+    assert 'hpose_stage_latency_seconds_bucket{stage="device",le="0.1"} 0' \
+            in lines
+    assert 'hpose_stage_latency_seconds_bucket{stage="device",le="1.0"} 1' \
+            in lines
+    assert 'hpose_stage_latency_seconds_count{stage="total"} 1' in lines
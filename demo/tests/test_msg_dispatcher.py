@@ -0,0 +1,57 @@
+#coding: utf-8
+
+import threading
+
+from msg_udp_handler import MsgUdpHandler, MSG_CMD_STRUCT
+from msg_dispatcher import MsgDispatcher
+
+
+def makeDispatcher():
+    receiver = MsgUdpHandler(('127.0.0.1', 0), None, socket_timeout=1)
+    sender = MsgUdpHandler(('127.0.0.1', 0), receiver.sock.getsockname())
+    return MsgDispatcher(receiver, recv_timeout=0.05), sender
+
+
+def testHandlerErrorDoesNotStopDispatcher():
+    dispatcher, sender = makeDispatcher()
+    handled = []
+    event = threading.Event()
+    def _handle(msg):
+        payload = bytes(msg['payload'][2:])
+        if payload == b'bad':
+            raise ValueError("malformed")
+        handled.append(payload)
+        event.set()
+    dispatcher.setHandler(0x8001, _handle)
+    dispatcher.start()
+    try:
+        sender.sendMsgBufs(0x8001, [b'bad'])
+        sender.sendMsgBufs(0x8001, [b'good'])
+        assert event.wait(2)
+    finally:
+        dispatcher.stop()
+        dispatcher.join()
+    assert handled == [b'good']
+    assert dispatcher.getStats()['handler_errors'] == 1
+
+
+def testExpectMsgBeforeHandler():
+    dispatcher, sender = makeDispatcher()
+    dispatcher.setHandler(0x8002, lambda msg: None)
+    future = dispatcher.expectMsg(0x8002)
+    dispatcher.start()
+    try:
+        sender.sendMsgBufs(0x8002, [b'rsp'])
+        msg = future.result(2)
+    finally:
+        dispatcher.stop()
+        dispatcher.join()
+    assert bytes(msg['payload']) == MSG_CMD_STRUCT.pack(0x8002) + b'rsp'
+
+
+def testUnknownCmdWarnsOnce(capsys):
+    dispatcher, sender = makeDispatcher()
+    for cmd in [0x8003, 0x8003, 0x8004, 0x8003]:
+        dispatcher.dispatch({'payload': MSG_CMD_STRUCT.pack(cmd)})
+    assert capsys.readouterr().out.count("Unknown cmd") == 2
+    assert dispatcher.getStats()['unknown_msgs'] == 4
@@ -0,0 +1,90 @@
+#coding: utf-8
+
+import asyncio
+
+import pytest
+
+import msg_pb2
+from dev_agent import DevAgent
+from msg_udp_handler import MSG_CMD_STRUCT, MSG_GET_CMD_RESPONS
+from msg_request_tracker import MsgRequestTracker, mapFuture
+from async_dev_agent import AsyncDevAgent
+from async_msg_udp_handler import AsyncMsgUdpHandler
+
+
+def testResolveByMsgId():
+    tracker = MsgRequestTracker()
+    f1 = tracker.add(1, key='a')
+    f2 = tracker.add(2, key='a', parse=lambda rsp: rsp + 1)
+    assert tracker.resolve(2, 10, key='a') and f2.result() == 11
+    assert not f1.done()
+    # 重复或未知的回复被丢弃
+    assert not tracker.resolve(2, 10, key='a')
+    assert tracker.getStats()['unmatched_rsps'] == 1
+
+
+def testZeroReqMsgIdChecksKey():
+    # 未填写req_msg_id的回复不能完成msg_id为0的其他属性请求
+    tracker = MsgRequestTracker()
+    f0 = tracker.add(0, key='temperature')
+    f1 = tracker.add(1, key='dev_status')
+    assert tracker.resolve(0, 'status rsp', key='dev_status')
+    assert f1.result() == 'status rsp' and not f0.done()
+    assert tracker.resolve(0, 'temperature rsp', key='temperature')
+    assert f0.result() == 'temperature rsp'
+    assert not tracker.resolve(0, 'stray', key='dev_status')
+
+
+def testExpire():
+    tracker = MsgRequestTracker()
+    future = tracker.add(1, timeout=0.5, timeout_result='timeout')
+    assert tracker.expire(now=0) == 0 and not future.done()
+    assert tracker.getNextDeadline() is not None
+    assert tracker.expire(now=tracker.getNextDeadline()) == 1
+    assert future.result() == 'timeout' and tracker.getPendingNum() == 0
+
+
+def testMapFuture():
+    tracker = MsgRequestTracker()
+    future = mapFuture(tracker.add(3), lambda rsp: rsp * 2)
+    tracker.resolve(3, 21)
+    assert future.result() == 42
+
+
+def testMapFutureException():
+    tracker = MsgRequestTracker()
+    future = mapFuture(tracker.add(3), lambda rsp: rsp['status'])
+    tracker.resolve(3, None)
+    with pytest.raises(TypeError):
+        future.result(0)
+
+
+class FakeMsgHandler(object):
+    socket_timeout = 0.1
+
+    def __init__(self):
+        super(FakeMsgHandler, self).__init__()
+        self.freed = []
+
+    def freeMsg(self, msg):
+        self.freed.append(msg)
+
+
+def testParseRspFreesMismatchedMsg():
+    msg_handler = FakeMsgHandler()
+    agent = DevAgent(msg_handler)
+    cmd = MSG_GET_CMD_RESPONS(msg_pb2.MSG_CMD_GET_PROPERTY)
+    msgs = [{'payload': MSG_CMD_STRUCT.pack(cmd)} for _ in range(2)]
+    assert not agent.parseSwitchAppVersionRsp(msgs[0], 'v2')
+    assert not agent.parseRebootSystemRsp(msgs[1])
+    assert msg_handler.freed == msgs
+
+
+def testAsyncPipelineIsNoop():
+    async def _run():
+        async with AsyncMsgUdpHandler(('127.0.0.1', 0), ('127.0.0.1', 9),
+                0.1) as msg_handler:
+            agent = AsyncDevAgent(msg_handler)
+            async with agent.pipeline() as pipeline_agent:
+                assert pipeline_agent is agent
+    asyncio.run(_run())
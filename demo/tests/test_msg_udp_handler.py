@@ -0,0 +1,144 @@
+#coding: utf-8
+
+import os
+import random
+import struct
+import threading
+
+import msg_pb2
+from msg_udp_handler import MsgReassembler, MsgUdpHandler, MSG_CMD_FORMAT, \
+    MSG_CMD_STRUCT, UDP_PAYLOAD_MAX_BYTES, FRAME_HEAD_BYTES
+
+
+def makeFrames(payload, stride, msg_id):
+    '''把payload按stride字节分帧，返回[(帧头, 负载)]'''
+    chunks = [payload[i:i+stride] for i in range(0, len(payload), stride)]
+    return [({'frame_len': 16 + len(chunk), 'frame_idx': i + 1,
+            'frame_total': len(chunks), 'msg_id': msg_id}, chunk)
+            for i, chunk in enumerate(chunks)]
+
+
+def testReassembleReorderedAndInterleaved():
+    reassembler = MsgReassembler(100)
+    a, b = os.urandom(450), os.urandom(230)
+    frames = makeFrames(a, 100, 1) + makeFrames(b, 100, 2)
+    random.Random(0).shuffle(frames)
+    msgs = {}
+    for frame_head, frame_payload in frames:
+        msg = reassembler.addFrame(frame_head, memoryview(frame_payload),
+                now=0)
+        if msg is not None:
+            msgs[msg['last_frame_head']['msg_id']] = bytes(msg['payload'])
+    assert msgs == {1: a, 2: b}
+    assert reassembler.getStats()['partial_msgs'] == 0
+
+
+def testReassembleLastFrameFirst():
+    reassembler = MsgReassembler(100)
+    payload = os.urandom(250)
+    frames = makeFrames(payload, 100, 5)
+    assert reassembler.addFrame(*frames[2], now=0) is None
+    assert reassembler.addFrame(*frames[0], now=0) is None
+    msg = reassembler.addFrame(*frames[1], now=0)
+    assert bytes(msg['payload']) == payload
+
+
+def testReassembleDropAndTimeout():
+    reassembler = MsgReassembler(100, max_partial_msgs=2, partial_timeout=1.0)
+    for msg_id in [1, 2, 3]:
+        reassembler.addFrame(*makeFrames(os.urandom(200), 100, msg_id)[0],
+                now=0)
+    stats = reassembler.getStats()
+    assert stats['dropped_msgs'] == 1 and stats['partial_msgs'] == 2
+    # 超时的消息丢弃，之后的帧重新开始
+    frames = makeFrames(os.urandom(200), 100, 2)
+    assert reassembler.addFrame(*frames[1], now=2) is None
+    stats = reassembler.getStats()
+    assert stats['timeout_msgs'] == 2 and stats['partial_msgs'] == 1
+
+
+def testReassembleDuplicateAndInvalid():
+    reassembler = MsgReassembler(100)
+    frames = makeFrames(os.urandom(150), 100, 1)
+    assert reassembler.addFrame(*frames[0], now=0) is None
+    assert reassembler.addFrame(*frames[0], now=0) is None
+    bad_head = dict(frames[1][0], frame_idx=3)
+    assert reassembler.addFrame(bad_head, frames[1][1], now=0) is None
+    stats = reassembler.getStats()
+    assert stats['duplicate_frames'] == 1 and stats['invalid_frames'] == 1
+    assert reassembler.addFrame(*frames[1], now=0) is not None
+
+
+def testFreeMsgReusesBuffer():
+    reassembler = MsgReassembler(100)
+    for frame_head, frame_payload in makeFrames(b'x' * 150, 100, 1):
+        msg = reassembler.addFrame(frame_head, frame_payload, now=0)
+    buf = msg['buf']
+    reassembler.freeMsg(msg)
+    msg = reassembler.addFrame(*makeFrames(b'y' * 50, 100, 2)[0], now=0)
+    assert msg['buf'] is buf and bytes(msg['payload']) == b'y' * 50
+
+
+def makeMediaStreamReq(data):
+    req = msg_pb2.ReqMediaStream()
+    req.type = msg_pb2.MEDIA_IMAGE_STREAM
+    req.img.data = data
+    return req
+
+
+def testSendRecvLargeMsg():
+    receiver = MsgUdpHandler(('127.0.0.1', 0), None, socket_timeout=1,
+            frame_max_bytes=1000)
+    sender = MsgUdpHandler(('127.0.0.1', 0), receiver.sock.getsockname(),
+            frame_max_bytes=1000)
+    req = makeMediaStreamReq(os.urandom(5000))
+    sender.sendMsg(0x1234, req)
+    msg = receiver.recvMsg()
+    assert bytes(msg['payload']) == struct.pack(MSG_CMD_FORMAT, 0x1234) + \
+            req.SerializeToString()
+    assert receiver.recvMsg(timeout=0.01) is None
+
+
+def testRecvMsgWithoutTimeoutBlocks():
+    # socket_timeout和timeout都为None时一直等待，直到收到消息
+    receiver = MsgUdpHandler(('127.0.0.1', 0), None, socket_timeout=None)
+    sender = MsgUdpHandler(('127.0.0.1', 0), receiver.sock.getsockname())
+    req = makeMediaStreamReq(b'data')
+    timer = threading.Timer(0.1, sender.sendMsg, (0x1234, req))
+    timer.start()
+    msg = receiver.recvMsg()
+    timer.join()
+    assert bytes(msg['payload']) == struct.pack(MSG_CMD_FORMAT, 0x1234) + \
+            req.SerializeToString()
+
+
+def testSendMsgBufs():
+    # 多段负载拼接后分帧，分帧边界不必与缓冲区边界对齐
+    receiver = MsgUdpHandler(('127.0.0.1', 0), None, socket_timeout=1,
+            frame_max_bytes=1000)
+    sender = MsgUdpHandler(('127.0.0.1', 0), receiver.sock.getsockname(),
+            frame_max_bytes=1000)
+    payload = os.urandom(5000)
+    sender.sendMsgBufs(0x1234, [payload[:1234], memoryview(payload)[1234:]])
+    msg = receiver.recvMsg()
+    assert bytes(msg['payload']) == MSG_CMD_STRUCT.pack(0x1234) + payload
+
+
+def testFrameSizeLimit():
+    reassembler = MsgReassembler(100)
+    frame_head, _ = makeFrames(b'x', 100, 1)[0]
+    assert reassembler.addFrame(frame_head, b'x' * 101, now=0) is None
+    assert reassembler.getStats()['invalid_frames'] == 1
+
+
+def testRecvFramesLargerThanOwnFrameSize():
+    # 对方的分帧可以大于本端的frame_max_bytes，直到UDP数据报的上限
+    receiver = MsgUdpHandler(('127.0.0.1', 0), None, socket_timeout=1,
+            frame_max_bytes=1000, recv_buf_bytes=1024*1024)
+    sender = MsgUdpHandler(('127.0.0.1', 0), receiver.sock.getsockname(),
+            frame_max_bytes=UDP_PAYLOAD_MAX_BYTES)
+    payload = os.urandom((UDP_PAYLOAD_MAX_BYTES - FRAME_HEAD_BYTES) * 2 + 10)
+    sender.sendMsgBufs(0x1234, [payload])
+    msg = receiver.recvMsg()
+    assert bytes(msg['payload']) == MSG_CMD_STRUCT.pack(0x1234) + payload
+    assert receiver.getRecvStats().get('invalid_frames', 0) == 0
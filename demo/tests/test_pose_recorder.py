@@ -0,0 +1,95 @@
+#coding: utf-8
+
+import time
+import struct
+
+import numpy as np
+import pytest
+
+import msg_pb2
+from stream_codec import decodeHumanPoseStream, KPS_DEV_NUM, KPS_NUM
+from pose_recorder import PoseRecordWriter, PoseRecordReader
+
+
+def makePoseFrame(img_idx, person_num=2):
+    req = msg_pb2.ReqHumanPoseStream()
+    req.img_idx = img_idx
+    for p in range(person_num):
+        req.boxes.add(xmin=p, ymin=img_idx, xmax=p + 10, ymax=img_idx + 10,
+                score=0.5)
+        pose2d = req.pose2ds.add(idx=p)
+        for i in range(KPS_DEV_NUM):
+            pose2d.point.add(x=img_idx + i, y=p + i, v=0.5)
+        pose3d = req.pose3ds.add(idx=p)
+        for i in range(KPS_NUM):
+            pose3d.point.add(x=img_idx, y=p, z=i, v=0.5)
+        req.hand_dirs.add(idx=p, left=img_idx % 64, right=p)
+    return decodeHumanPoseStream(req.SerializeToString())
+
+
+def writeRecord(path, frame_num, chunk_frames):
+    with PoseRecordWriter(path, chunk_frames=chunk_frames) as writer:
+        for i in range(frame_num):
+            writer.write(makePoseFrame(i), timestamp=float(i))
+
+
+def testReadBack(tmp_path):
+    path = str(tmp_path / 'poses.hpr')
+    writeRecord(path, 10, chunk_frames=4)
+    with PoseRecordReader(path) as reader:
+        assert reader.getTimeRange() == (0., 9.)
+        columns = reader.readRange(2, 7)
+        assert list(columns['img_idx']) == [2, 3, 4, 5, 6]
+        assert not isinstance(columns['kps2d'], np.memmap)
+        frames = list(reader.iterFrames(8))
+    assert [t for t, _ in frames] == [8., 9.]
+    expected = makePoseFrame(9)
+    np.testing.assert_allclose(frames[1][1].kps2d, expected.kps2d)
+    np.testing.assert_allclose(frames[1][1].kps3d, expected.kps3d)
+    np.testing.assert_array_equal(frames[1][1].hand_dirs, expected.hand_dirs)
+
+
+def testReadRangeSingleChunkIsCopy(tmp_path):
+    # 只在一个块内时也复制，关闭读取器后仍可使用
+    path = str(tmp_path / 'poses.hpr')
+    writeRecord(path, 10, chunk_frames=16)
+    with PoseRecordReader(path) as reader:
+        columns = reader.readRange(1, 3)
+    for column in columns.values():
+        assert not isinstance(column, np.memmap) and column.base is None
+    assert list(columns['img_idx']) == [1, 2]
+
+
+def testDefaultTimestampsAreMonotonic(tmp_path):
+    path = str(tmp_path / 'poses.hpr')
+    with PoseRecordWriter(path) as writer:
+        for i in range(3):
+            writer.write(makePoseFrame(i))
+    with PoseRecordReader(path) as reader:
+        timestamps = reader.readRange()['timestamp']
+        assert np.all(np.diff(timestamps) >= 0)
+        assert abs(reader.toWallTime(timestamps[-1]) - time.time()) < 5
+
+
+def testRejectDecreasingTimestamp(tmp_path):
+    with PoseRecordWriter(str(tmp_path / 'poses.hpr')) as writer:
+        writer.write(makePoseFrame(0), timestamp=2.)
+        writer.write(makePoseFrame(1), timestamp=2.)
+        with pytest.raises(ValueError):
+            writer.write(makePoseFrame(2), timestamp=1.)
+        assert writer.getStats()['frames'] == 2
+
+
+def testReadVersion1(tmp_path):
+    # 版本1的时间戳为系统时间，文件头没有time_origin
+    path = str(tmp_path / 'poses.hpr')
+    with PoseRecordWriter(path, chunk_frames=4, time_origin=0) as writer:
+        for i in range(5):
+            writer.write(makePoseFrame(i), timestamp=1000. + i)
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack('<I', 1))
+    with PoseRecordReader(path) as reader:
+        assert reader.time_origin == 0
+        assert reader.toWallTime(reader.getTimeRange()[1]) == 1004.
+        assert list(reader.readRange(1001, 1003)['img_idx']) == [1, 2]
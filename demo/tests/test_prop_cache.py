@@ -0,0 +1,78 @@
+#coding: utf-8
+
+import threading
+
+import msg_pb2
+from prop_cache import PropCache
+from dev_agent import DevAgent
+from msg_udp_handler import MsgUdpHandler
+
+
+def makeTemperatureRsp(temperature):
+    rsp = msg_pb2.RspGetProp()
+    rsp.prop_id = msg_pb2.MSG_PROP_TEMPERATURE
+    rsp.status = msg_pb2.MSG_STATUS_OK
+    rsp.temperature = temperature
+    return rsp
+
+
+def testGetReturnsCopy():
+    cache = PropCache()
+    rsp = makeTemperatureRsp(40)
+    cache.put(rsp)
+    # 修改存入的对象或取出的对象都不影响缓存
+    rsp.temperature = 50
+    cached = cache.get(msg_pb2.MSG_PROP_TEMPERATURE)
+    assert cached.temperature == 40
+    cached.temperature = 60
+    assert cache.get(msg_pb2.MSG_PROP_TEMPERATURE).temperature == 40
+    assert cache.getStats()['hits'] == 2
+
+
+def testUpdateAndInvalidateDependents():
+    cache = PropCache()
+    real = msg_pb2.RspGetProp()
+    real.prop_id = msg_pb2.MSG_PROP_CAM_REAL_PARAM
+    cache.put(real)
+    req = msg_pb2.ReqSetProp()
+    req.prop_id = msg_pb2.MSG_PROP_CAM_PARAM
+    req.cam_param.width = 640
+    cache.update(req)
+    assert cache.get(msg_pb2.MSG_PROP_CAM_PARAM).cam_param.width == 640
+    assert cache.get(msg_pb2.MSG_PROP_CAM_REAL_PARAM) is None
+
+
+def testTtlZeroNotCached():
+    cache = PropCache()
+    cache.setTtl(msg_pb2.MSG_PROP_TEMPERATURE, 0)
+    cache.put(makeTemperatureRsp(40))
+    assert cache.get(msg_pb2.MSG_PROP_TEMPERATURE) is None
+
+
+def testSetTtlRacesWithPutAndGet():
+    # setTtl(0)之后不应留下缓存，即使与put/get同时进行
+    cache = PropCache()
+    rsp = makeTemperatureRsp(40)
+    stop = threading.Event()
+    def _access():
+        while not stop.is_set():
+            cache.put(rsp)
+            cache.get(msg_pb2.MSG_PROP_TEMPERATURE)
+    threads = [threading.Thread(target=_access) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for i in range(200):
+        cache.setTtl(msg_pb2.MSG_PROP_TEMPERATURE, i % 2)
+    cache.setTtl(msg_pb2.MSG_PROP_TEMPERATURE, 0)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert cache.get(msg_pb2.MSG_PROP_TEMPERATURE) is None
+    assert cache.getStats()['entries'] == 0
+
+
+def testDevAgentCacheOffByDefault():
+    # 设置后读回应请求设备，默认不缓存
+    msg_handler = MsgUdpHandler(('127.0.0.1', 0), ('127.0.0.1', 9))
+    assert DevAgent(msg_handler).prop_cache is None
+    assert DevAgent(msg_handler, use_prop_cache=True).prop_cache is not None
@@ -0,0 +1,62 @@
+#coding: utf-8
+
+import os.path as osp
+
+import numpy as np
+import pytest
+
+import msg_pb2
+from stream_codec import decodeCamImgStream
+from frame_sync import FrameSynchronizer
+from demo import HumanPoseDisplayer, getJpegData
+
+
+IMG_PATH = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))),
+        'images', '1280x720.jpg')
+
+
+@pytest.fixture
+def jpeg():
+    with open(IMG_PATH, 'rb') as f:
+        return f.read()
+
+
+def makeDisplayer(show_img_w=None):
+    return HumanPoseDisplayer('test', FrameSynchronizer(), True, 640, 480,
+            0.3, show_img_w=show_img_w)
+
+
+def makeCamImgStream(jpeg, release=None):
+    req = msg_pb2.ReqCamImgStream()
+    req.cam_img.idx = 7
+    req.cam_img.pix_fmt = msg_pb2.Image.JPEG
+    req.cam_img.data = jpeg
+    return decodeCamImgStream(req.SerializeToString(), release)
+
+
+def testGetJpegData(jpeg):
+    assert getJpegData(jpeg) is jpeg
+    assert bytes(getJpegData(makeCamImgStream(jpeg))) == jpeg
+
+
+@pytest.mark.parametrize('source', ['bytes', 'memoryview', 'cam_img_stream'])
+def testDecodeShowImg(jpeg, source):
+    # ImgsReader输出bytes，透传的视频输出memoryview，设备摄像头为CamImgStreamView
+    released = []
+    img_raw = {'bytes': jpeg, 'memoryview': memoryview(jpeg),
+            'cam_img_stream': makeCamImgStream(jpeg,
+                    lambda: released.append(True))}[source]
+    img, reduce = makeDisplayer().decodeShowImg(img_raw)
+    assert img.shape == (720, 1280, 3) and reduce == 1
+    assert released == ([True] if source == 'cam_img_stream' else [])
+
+
+def testDecodeShowImgReduced(jpeg):
+    img, reduce = makeDisplayer(show_img_w=640).decodeShowImg(jpeg)
+    assert img.shape == (360, 640, 3) and reduce == 2
+
+
+def testDecodeShowImgArray():
+    img_raw = np.zeros((480, 1280, 3), np.uint8)
+    img, reduce = makeDisplayer(show_img_w=320).decodeShowImg(img_raw)
+    assert img.shape == (120, 320, 3) and reduce == 4
@@ -0,0 +1,160 @@
+#coding: utf-8
+
+import numpy as np
+import pytest
+
+import msg_pb2
+from stream_codec import decodeHumanPoseStream, parseHumanPoseStream, \
+    encodeVarint, decodeVarint, skipField, encodeMediaStreamPrefix, \
+    decodeCamImgStream, encodeHumanPoseStream, getJpegSize, KPS_DEV_NUM, \
+    KPS_ROOT_PARENTS
+from dev_emulator import makeSyntheticPose
+
+
+def makeHumanPoseReq():
+    req = msg_pb2.ReqHumanPoseStream()
+    req.img_idx = 9
+    req.boxes.add(xmin=1, ymin=2, xmax=30, ymax=40, score=0.5)
+    pose2d = req.pose2ds.add(idx=0)
+    for i in range(KPS_DEV_NUM):
+        pose2d.point.add(x=i * 2, y=i * 3 + 1, v=0.1 * (i % 5 + 1))
+    pose3d = req.pose3ds.add(idx=0)
+    for i in range(KPS_DEV_NUM + 1):
+        pose3d.point.add(x=i, y=i + 100, z=i + 200, v=0.5)
+    req.hand_dirs.add(idx=0, left=0b101, right=0b10)
+    return req
+
+
+def testDecodeHumanPoseStream():
+    req = makeHumanPoseReq()
+    frame = decodeHumanPoseStream(req.SerializeToString())
+    assert frame.img_idx == 9
+    np.testing.assert_allclose(frame.boxes, [[1, 2, 30, 40, 0.5]])
+    # 追加的root节点为两个父节点的中点（向下取整），置信度取较小值
+    a, b = (frame.kps2d[0, i] for i in KPS_ROOT_PARENTS)
+    root = frame.kps2d[0, KPS_DEV_NUM]
+    assert tuple(root[:2]) == (np.floor((a[0] + b[0]) / 2),
+            np.floor((a[1] + b[1]) / 2))
+    assert root[2] == pytest.approx(min(a[2], b[2]))
+    # 3d坐标系：[x, y, z, v] -> [-x, -z, -y, v]
+    assert tuple(frame.kps3d[0, 1]) == pytest.approx((-1, -201, -101, 0.5))
+    bits = frame.getHandDirBits()[0]
+    assert list(bits[0]) == [1, 0, 4, 0, 0, 0]
+    assert list(bits[1]) == [0, 2, 0, 0, 0, 0]
+
+
+def testParseHumanPoseStream():
+    req = makeHumanPoseReq()
+    img_idx, pose = parseHumanPoseStream(req.SerializeToString())
+    assert img_idx == 9 and pose['boxes'] == [[1, 2, 30, 40, 0.5]]
+    assert pose['kps'][1] == [2, 4, pytest.approx(0.2)]
+    assert len(pose['kps']) == KPS_DEV_NUM + 1
+    assert pose['kps3d'][0] == [0, -200, -100, 0.5]
+    assert pose['hand_dir'] == ([1, 0, 4, 0, 0, 0], [0, 2, 0, 0, 0, 0])
+
+
+def testDecodeEmptyHumanPoseStream():
+    req = msg_pb2.ReqHumanPoseStream()
+    req.img_idx = 3
+    frame = decodeHumanPoseStream(req.SerializeToString())
+    assert frame.boxes.shape == (0, 5) and frame.kps2d.shape[0] == 0
+    assert parseHumanPoseStream(req.SerializeToString()) == (3, {'boxes': []})
+
+
+def testHumanPoseMatchedByIdx():
+    # Pose按idx与Box对应，idx越界时（旧固件未填写）按顺序对应
+    req = msg_pb2.ReqHumanPoseStream()
+    req.img_idx = 1
+    req.boxes.add(xmin=1, ymin=2, xmax=3, ymax=4, score=0.5)
+    req.boxes.add(xmin=5, ymin=6, xmax=7, ymax=8, score=0.5)
+    req.pose2ds.add(idx=1).point.add(x=5, y=6, v=0.9)
+    frame = decodeHumanPoseStream(req.SerializeToString())
+    assert frame.getPersonNum() == 2
+    assert list(frame.has_box) == [True, True]
+    assert list(frame.has_kps2d) == [False, True]
+    assert tuple(frame.kps2d[1, 0]) == pytest.approx((5, 6, 0.9))
+    req.pose2ds[0].idx = 5
+    frame = decodeHumanPoseStream(req.SerializeToString())
+    assert list(frame.has_kps2d) == [True, False]
+
+
+@pytest.mark.parametrize('value', [1, 127, 128, 300, 2**32 - 1])
+def testEncodeVarintMatchesProtobuf(value):
+    img = msg_pb2.Image()
+    img.idx = value
+    assert img.SerializeToString() == b'\x08' + encodeVarint(value)
+
+
+def testEncodeVarintZeroAndNegative():
+    assert encodeVarint(0) == b'\x00'
+    # int32/enum的负数按64位补码编码，与protobuf一致
+    req = msg_pb2.ReqSetProp()
+    req.prop_id = -1
+    assert req.SerializeToString() == b'\x08' + encodeVarint(-1)
+
+
+@pytest.mark.parametrize('img_idx,data_len,width', [(0, 0, 0), (1, 10, 640),
+        (2**32 - 1, 300000, 1920)])
+def testMediaStreamPrefixMatchesProtobuf(img_idx, data_len, width):
+    img_data = bytes(range(256)) * (data_len // 256) + b'x' * (data_len % 256)
+    req = msg_pb2.ReqMediaStream()
+    req.type = msg_pb2.MEDIA_IMAGE_STREAM
+    req.img.idx = img_idx
+    req.img.pix_fmt = msg_pb2.Image.JPEG
+    req.img.width = width
+    req.img.data = img_data
+    prefix = encodeMediaStreamPrefix(img_idx, data_len, width=width)
+    assert prefix + img_data == req.SerializeToString()
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2**32 - 1, 2**63])
+def testVarintRoundTrip(value):
+    data = b'\xff' + encodeVarint(value) + b'\x01'
+    assert decodeVarint(data, 1) == (value, len(data) - 1)
+
+
+def testSkipField():
+    data = b'\x96\x01' + b'\x00' * 8 + b'\x03abc' + b'\x00' * 4
+    assert skipField(data, 0, 0) == 2
+    assert skipField(data, 2, 1) == 10
+    assert skipField(data, 10, 2) == 14
+    assert skipField(data, 14, 5) == 18
+    with pytest.raises(ValueError):
+        skipField(data, 0, 3)
+
+
+def testDecodeCamImgStream():
+    req = msg_pb2.ReqCamImgStream()
+    req.cam_img.idx = 300
+    req.cam_img.pix_fmt = msg_pb2.Image.JPEG
+    req.cam_img.width, req.cam_img.height = 640, 480
+    req.cam_img.data = b'\xff\xd8jpeg'
+    data = req.SerializeToString()
+    released = []
+    view = decodeCamImgStream(data, lambda: released.append(True))
+    assert (view.img_idx, view.pix_fmt) == (300, msg_pb2.Image.JPEG)
+    assert bytes(view.data) == b'\xff\xd8jpeg'
+    assert view.parse() == req
+    view.release()
+    assert released == [True]
+    with pytest.raises((ValueError, IndexError)):
+        decodeCamImgStream(data[:-2])
+
+
+def testHumanPoseStreamRoundTrip():
+    frame = makeSyntheticPose(42, 1280, 720, person_num=3, t=1.5)
+    data = encodeHumanPoseStream(frame).SerializeToString()
+    decoded = decodeHumanPoseStream(data)
+    assert decoded.img_idx == 42 and decoded.getPersonNum() == 3
+    np.testing.assert_array_equal(decoded.has_kps2d, frame.has_kps2d)
+    np.testing.assert_allclose(decoded.kps2d[:, :KPS_DEV_NUM],
+            frame.kps2d[:, :KPS_DEV_NUM])
+    np.testing.assert_allclose(decoded.kps3d, frame.kps3d)
+    np.testing.assert_array_equal(decoded.hand_dirs, frame.hand_dirs)
+
+
+def testGetJpegSize():
+    import cv2
+    _, data = cv2.imencode('.jpg', np.zeros((48, 64, 3), np.uint8))
+    assert getJpegSize(data.tobytes()) == (64, 48)
+    assert getJpegSize(b'not a jpeg') is None
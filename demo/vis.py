@@ -100,19 +100,24 @@ def drawBox(img, box, box_score=None, box_pixel=None, color=BBOX_COLOR,
     xmin, ymin, xmax, ymax = box[:4]
     cv2.rectangle(img, (xmin, ymin), (xmax, ymax), color, thickness)
     if box_score is not None:
-        score_str = "%.1f" % (box_score*100)
-        # 描边
-        outline_color = tuple([255 - x for x in text_color])
-        cv2.putText(img, score_str, (xmin, ymin+text_y_offset),
-                cv2.FONT_HERSHEY_SIMPLEX, text_size, outline_color,
-                text_thickness+2, lineType=cv2.LINE_AA)
-        cv2.putText(img, score_str, (xmin, ymin+text_y_offset),
-                cv2.FONT_HERSHEY_SIMPLEX, text_size, text_color,
-                text_thickness, lineType=cv2.LINE_AA)
+        drawBoxScore(img, xmin, ymin, box_score, text_y_offset, text_color,
+                text_size, text_thickness)
     if box_pixel is not None:
         x, y = box_pixel
         cv2.circle(img, (x, y), 8, (0, 0, 255), 8)
 
+def drawBoxScore(img, xmin, ymin, box_score, text_y_offset=15,
+        text_color=BBOX_COLOR, text_size=0.6, text_thickness=1):
+    score_str = "%.1f" % (box_score*100)
+    # 描边
+    outline_color = tuple([255 - x for x in text_color])
+    cv2.putText(img, score_str, (xmin, ymin+text_y_offset),
+            cv2.FONT_HERSHEY_SIMPLEX, text_size, outline_color,
+            text_thickness+2, lineType=cv2.LINE_AA)
+    cv2.putText(img, score_str, (xmin, ymin+text_y_offset),
+            cv2.FONT_HERSHEY_SIMPLEX, text_size, text_color,
+            text_thickness, lineType=cv2.LINE_AA)
+
 def drawLandmark(img, landmark, radius=2, color=COLOR_R1, thickness=2,
         lineType=cv2.LINE_AA):
     for (x, y) in landmark:
@@ -136,6 +141,49 @@ def drawKps(img, kps, thr=0.5):
         cv2.circle(img, (kp[0], kp[1]), radius, color, thickness,
                 lineType=cv2.LINE_AA)
 
+def drawBoxes(img, boxes, color=BBOX_COLOR, thickness=1, **text_args):
+    '''绘制多个Box，boxes为(N, 5)数组，矩形一次绘制完成，text_args见drawBoxScore
+    '''
+    if len(boxes) == 0:
+        return
+    xyxy = np.asarray(boxes)[:, :4].astype(np.int32)
+    rects = np.ascontiguousarray(xyxy[:, [0, 1, 2, 1, 2, 3, 0, 3]]) \
+            .reshape(-1, 4, 2)
+    cv2.polylines(img, list(rects), True, color, thickness)
+    for (xmin, ymin, _, _), score in zip(xyxy.tolist(), boxes[:, 4].tolist()):
+        drawBoxScore(img, xmin, ymin, score, **text_args)
+
+def drawKpsBatch(img, kps, thr=0.5):
+    '''绘制多个人的关键点，kps为(P, 15, 3)数组
+
+    每种骨骼和关节只调用一次cv2.polylines，绘制次数与人数无关。
+    '''
+    if len(kps) == 0:
+        return
+    kps = np.asarray(kps)
+    xy = kps[:, :, :2].astype(np.int32)
+    visible = kps[:, :, 2] >= thr
+    # Draw skeletons
+    for (idx_s, idx_e, color, thickness) in KPS_SKELETONS:
+        mask = visible[:, idx_s] & visible[:, idx_e]
+        if not mask.any():
+            continue
+        lines = np.ascontiguousarray(xy[mask][:, [idx_s, idx_e]])
+        cv2.polylines(img, list(lines), False, color, thickness,
+                lineType=cv2.LINE_AA)
+    # Draw joints，相同样式的关节一起绘制
+    joint_styles = {}
+    for i, style in enumerate(KPS_JOINTS):
+        joint_styles.setdefault(style, []).append(i)
+    for (radius, color, thickness), idxs in joint_styles.items():
+        centers = xy[:, idxs][visible[:, idxs]]
+        if len(centers) == 0:
+            continue
+        circle = np.array(cv2.ellipse2Poly((0, 0), (radius, radius), 0, 0,
+                360, 30), dtype=np.int32)
+        cv2.polylines(img, list(centers[:, None, :] + circle[None]), True,
+                color, thickness, lineType=cv2.LINE_AA)
+
 def drawActions(img, actions, color, font_size=1, thickness=3, coord_offset=0,
         edge_distance=50):
     img_h, img_w = img.shape[:2]